@@ -1,49 +1,168 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from master import master_init
+from master import master_init, apply_overrides, runs_exclusively, resolve_hosts, publish_config
+from scripts.kv_client import KVClient
+from scripts.framing import get_wire_compression
+from utils.dispatcher import get_dispatcher
+from utils.job_scheduler import get_job_scheduler
+from utils.worker_pool import scale_worker_pool
 import json
-import socket
-import pickle
+import itertools
 import subprocess
 
 app = Flask(__name__)
 CORS(app)
 
-SIZE = 4096
+# one pooled KV client per KV store address, shared by all requests
+kv_clients = {}
+
+def get_kv_client(config):
+    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
+    if kv_store_addr not in kv_clients:
+        kv_clients[kv_store_addr] = KVClient(kv_store_addr, config["kv_pool_size"], config["kv_timeout"], get_wire_compression(config))
+    return kv_clients[kv_store_addr]
+
+def get_job_payload(payload):
+    # ?job_id=... scopes a request to the output of that job; without it the
+    # KV store answers from the newest output of the operation
+    job_id = request.args.get("job_id")
+    return ("job", job_id, payload) if job_id else payload
 
 @app.route('/', methods=["GET"])
 def home():
     return "<h1>GCP Map Reduce Master VM is running!</h1>"
 
+def get_scheduler():
+    with open("config.json", "r") as fp:
+        config = json.load(fp)
+    return get_job_scheduler(config, master_init), config
+
 @app.route('/launch_map_reduce', methods=["POST"])
+@app.route('/jobs', methods=["POST"])
 def launch_map_reduce():
-    master_init()
-    return jsonify({"status": "complete"})
+    # queues a job and returns its ID at once; the optional JSON body holds
+    # config.json overrides for this job, e.g. {"operation_name": "wordcount"}
+    scheduler, config = get_scheduler()
+    overrides = request.get_json(silent=True) or {}
+    try:
+        job_config = apply_overrides(dict(config), overrides)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job_id = scheduler.submit(job_config["operation_name"], overrides, runs_exclusively(job_config))
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@app.route('/jobs', methods=["GET"])
+def list_jobs():
+    scheduler, _ = get_scheduler()
+    return jsonify(scheduler.list_jobs())
+
+@app.route('/jobs/<job_id>', methods=["GET"])
+def job_status(job_id):
+    # phase, per-task state, throughput & ETA of a job
+    scheduler, _ = get_scheduler()
+    status = scheduler.status(job_id)
+    if status is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>', methods=["DELETE"])
+def cancel_job(job_id):
+    # a queued job never runs; a running job stops at its next phase
+    # boundary or task check and releases its workers
+    scheduler, _ = get_scheduler()
+    state = scheduler.cancel(job_id)
+    if state is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    return jsonify({"job_id": job_id, "state": state})
+
+@app.route('/workers', methods=["GET"])
+def list_workers():
+    with open("config.json", "r") as fp:
+        config = resolve_hosts(json.load(fp))
+    return jsonify(get_dispatcher(config).live_workers())
+
+@app.route('/workers', methods=["POST"])
+def scale_workers():
+    # worker daemon pool sizing, e.g. {"mapper": 3, "reducer": 2}; jobs run
+    # with "worker_mode": "daemon" then use the daemons without provisioning
+    with open("config.json", "r") as fp:
+        config = resolve_hosts(json.load(fp))
+    # the daemons register with the dispatcher and read its address from the config
+    get_dispatcher(config)
+    publish_config(config)
+    counts = request.get_json()
+    workers = {}
+    for role in ["mapper", "reducer"]:
+        if role in counts:
+            workers[role] = scale_worker_pool(config, role, int(counts[role]))
+    return jsonify(workers)
 
 @app.route('/final_output', methods=["GET"])
 def fetch_final_output_from_kvstore():
+    # optional filters: start & end (key range), prefix, top (top-K by value),
+    # offset & limit, e.g. /final_output?prefix=energ&limit=10, and job_id
     with open("config.json", "r") as fp:
-        config = json.load(fp)
+        config = resolve_hosts(json.load(fp))
     
-    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
+    kv_client = get_kv_client(config)
+
+    query = {}
+    for name in ["start", "end", "prefix"]:
+        if name in request.args:
+            query[name] = request.args[name]
+    for name in ["top", "offset", "limit"]:
+        if name in request.args:
+            try:
+                query[name] = int(request.args[name])
+            except ValueError:
+                query[name] = -1
+            if query[name] < 0:
+                return jsonify({"error": f"{name} must be a non-negative integer"}), 400
 
-    if config["operation_name"] == "invertedindex":
-        payload = ("get", "final-output", "invertedindex")
+    if "job_id" in request.args:
+        # the job's own operation
+        payload = ("get", "final-output", None, query)
+    elif config["operation_name"] == "invertedindex":
+        payload = ("get", "final-output", "invertedindex", query)
     else:
-        payload = ("get", "final-output", "wordcount")
-
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
-    serialized_msg = b""
-    while True:
-        packet = client.recv(SIZE)
-        serialized_msg += packet
-        if b"ENDOFDATA" in packet:
-            break
-    serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-    final_output = pickle.loads(serialized_msg)
-    return jsonify(final_output)
+        payload = ("get", "final-output", "wordcount", query)
+
+    # the KV store streams the stored JSON file, or the records matching the
+    # query, and the chunks are passed on as they arrive
+    chunks = kv_client.stream(*get_job_payload(payload))
+    first_chunk = next(chunks, b"")
+    if not isinstance(first_chunk, (bytes, bytearray)):
+        return jsonify(first_chunk)
+    return Response(stream_with_context(itertools.chain([first_chunk], chunks)), mimetype="application/json")
+
+def query_final_output(query_type, terms):
+    # the KV store answers from the memory-mapped index of the final output,
+    # so neither side loads the whole output to look up a few terms
+    with open("config.json", "r") as fp:
+        config = resolve_hosts(json.load(fp))
+    if config["operation_name"] != "invertedindex" and "job_id" not in request.args:
+        return jsonify({"error": "term queries need the invertedindex output"}), 400
+    if not terms:
+        return jsonify({"error": "no query terms"}), 400
+    response = get_kv_client(config).request(*get_job_payload(("get", "index-query", "invertedindex", query_type, terms)))
+    if isinstance(response, str):
+        return jsonify({"error": response.strip()}), 404
+    return jsonify(response)
+
+@app.route('/query', methods=["GET"])
+def query_terms():
+    # /query?terms=energy,conservation&op=and|or|phrase; a single term is an "and" of one
+    query_type = request.args.get("op", "and")
+    if query_type not in ["and", "or", "phrase"]:
+        return jsonify({"error": f"unknown op {query_type}"}), 400
+    terms = [term for term in request.args.get("terms", "").split(",") if term.strip()]
+    return query_final_output(query_type, terms)
+
+@app.route('/query/prefix', methods=["GET"])
+def query_prefix():
+    # /query/prefix?prefix=conserv: terms starting with prefix and their documents
+    prefix = request.args.get("prefix", "")
+    return query_final_output("prefix", [prefix] if prefix.strip() else [])
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="8081", debug=True)
@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.provisioner import Provisioner
+from utils.bundle import build_bundle, deploy_bundle
+from utils.fake_compute import FakeCompute, FakeShell
+
+# Per-VM bootstrap bytes & time of the original setup (apt-get python3-pip,
+# scp --recurse of the whole repo, pip install -r requirements.txt) against
+# the deployment bundle of utils/bundle.py, first on a fresh VM and then on a
+# VM that already has the bundle. Runs on the fake shell of
+# utils/fake_compute.py with typical latencies in simulated seconds, SCALE
+# times faster; reported times are simulated seconds.
+#
+# usage: python3 benchmarks/bench_bundle.py [repo_path]
+
+SCALE = 0.01
+COMMAND_SECONDS = 2          # ssh round trip of one command
+APT_INSTALL_SECONDS = 20     # sudo apt-get -qq install python3-pip
+PIP_INSTALL_SECONDS = 40     # pip install -r requirements.txt
+SCP_SECONDS = 2              # scp startup
+SCP_BYTES_PER_SECOND = 2 * 1024 * 1024
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def legacy_setup(provisioner, instance_name, repo_path):
+    # the setup of the original shell-scripts/*_init.sh
+    provisioner.run_ssh(instance_name, "sudo apt-get -qq install python3-pip")
+    time.sleep(APT_INSTALL_SECONDS * SCALE)
+    provisioner.shell.scp(instance_name, repo_path, "~")
+    provisioner.run_ssh(instance_name, "pip install -r ./gcp-map-reduce/requirements.txt")
+    time.sleep(PIP_INSTALL_SECONDS * SCALE)
+
+def time_setup(provisioner, setup_func, instance_name):
+    shell = provisioner.shell
+    copied_bytes = shell.copied_bytes
+    start_time = time.time()
+    setup_func(provisioner, instance_name)
+    return shell.copied_bytes - copied_bytes, (time.time() - start_time) / SCALE
+
+def main():
+    repo_path = sys.argv[1] if len(sys.argv) > 1 else REPO_ROOT
+    with open(os.path.join(REPO_ROOT, "config.json")) as fp:
+        config = json.load(fp)
+    config["raw_input_data_path"] = os.path.join(REPO_ROOT, "raw-dataset")
+    config["bundle_path"] = tempfile.mkdtemp()
+
+    compute = FakeCompute()
+    shell = FakeShell(compute, command_seconds=COMMAND_SECONDS * SCALE, scp_seconds=SCP_SECONDS * SCALE,
+        scp_bytes_per_second=SCP_BYTES_PER_SECOND / SCALE)
+    provisioner = Provisioner(compute, config, shell=shell)
+
+    provisioner.provision(["legacy1"])
+    results = [("repo + pip (original)", "-") + time_setup(provisioner, lambda p, name: legacy_setup(p, name, repo_path), "legacy1")]
+    for role in ["kv-store", "mapper", "reducer"]:
+        start_time = time.time()
+        bundle = build_bundle(config, role)
+        build_seconds = time.time() - start_time
+        provisioner.provision([f"{role}1"])
+        results.append((f"{role} bundle", f"{build_seconds:.3f}") + time_setup(provisioner, lambda p, name: deploy_bundle(p, name, bundle), f"{role}1"))
+        results.append((f"{role} bundle, redeploy", "-") + time_setup(provisioner, lambda p, name: deploy_bundle(p, name, bundle), f"{role}1"))
+
+    print(f"\n{'setup':<26} {'build (s)':>10} {'copied KB':>12} {'bootstrap (s)':>14}")
+    for name, build_seconds, copied_bytes, setup_seconds in results:
+        print(f"{name:<26} {build_seconds:>10} {copied_bytes / 1024:>12.1f} {setup_seconds:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import pickle
+import socket
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.framing import send_msg, recv_msg, send_stream, recv_stream
+
+# Throughput of the length-prefixed framing (scripts/framing.py) against the
+# original "pickle + ENDOFDATA sentinel" protocol, over a localhost TCP socket.
+#
+# usage: python3 benchmarks/bench_framing.py [max_payload_mb]
+
+SIZE = 4096
+ROUNDS = 3
+
+def legacy_send(sock, obj):
+    sock.sendall(pickle.dumps(obj) + b"ENDOFDATA")
+
+def legacy_recv(sock):
+    # the receive loop used by every component before scripts/framing.py
+    serialized_msg = b""
+    while True:
+        packet = sock.recv(SIZE)
+        serialized_msg += packet
+        if b"ENDOFDATA" in packet:
+            break
+    serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
+    return pickle.loads(serialized_msg)
+
+def framed_stream_send(sock, obj):
+    # obj is bytes; sent as 1 MB chunks and reassembled by the receiver
+    send_stream(sock, (obj[i:i + (1 << 20)] for i in range(0, len(obj), 1 << 20)))
+
+def framed_stream_recv(sock):
+    recv_msg(sock)
+    return sum(len(chunk) for chunk in recv_stream(sock))
+
+PROTOCOLS = {
+    "legacy ENDOFDATA": (legacy_send, legacy_recv),
+    "framed message": (send_msg, recv_msg),
+    "framed stream": (framed_stream_send, framed_stream_recv),
+}
+
+def run_protocol(send_func, recv_func, payload):
+    # one connection per message, as the legacy protocol cannot delimit
+    # back-to-back messages on one socket
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def sender():
+        for _ in range(ROUNDS):
+            conn, _ = server.accept()
+            send_func(conn, payload)
+            conn.close()
+
+    thread = threading.Thread(target=sender)
+    thread.start()
+    start_time = time.perf_counter()
+    for _ in range(ROUNDS):
+        client = socket.create_connection(server.getsockname())
+        recv_func(client)
+        client.close()
+    elapsed = time.perf_counter() - start_time
+    thread.join()
+    server.close()
+    return elapsed / ROUNDS
+
+def main():
+    max_payload_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    payload_size = 1 << 10
+    print(f"{'payload':>10}  {'protocol':<18} {'ms/msg':>10} {'MB/s':>10}")
+    while payload_size <= max_payload_mb << 20:
+        payload = os.urandom(payload_size)
+        for name, (send_func, recv_func) in PROTOCOLS.items():
+            elapsed = run_protocol(send_func, recv_func, payload)
+            throughput = payload_size / elapsed / (1 << 20)
+            print(f"{payload_size >> 10:>8}KB  {name:<18} {elapsed * 1000:>10.2f} {throughput:>10.1f}")
+        payload_size <<= 4
+
+if __name__ == "__main__":
+    main()
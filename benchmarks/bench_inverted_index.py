@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.text_cleanup import TextNormalizer
+from scripts.input_splits import DocumentLines
+from scripts.invertedindex_map import invertedindex_map_init
+from scripts.invertedindex_reduce import invertedindex_reduce_init
+from scripts.postings import IndexWriter, IndexReader
+
+# Size, build time and lookup speed of the positional index
+# (scripts/postings.py) against the original invertedindex output, a JSON
+# object of token -> doc names without positions, on the raw-dataset corpus.
+# Both are built from the same map output in one process, so only the output
+# stage differs; the index additionally answers phrase queries. Then the
+# latency of single term lookups and the heap of a reader on synthetic
+# indexes of growing term counts: the reader memory maps the index and binary
+# searches its term table, so neither grows with the index.
+#
+# usage: python3 benchmarks/bench_inverted_index.py [raw_input_data_path] [lookups]
+
+TERM_COUNTS = [10000, 100000, 1000000]
+PHRASES = [["project", "gutenberg", "license"], ["conservation", "of", "energy"], ["the", "united", "states"]]
+
+def map_corpus(raw_input_data_path):
+    normalizer = TextNormalizer()
+    dataset = {}
+    for filename in sorted(os.listdir(raw_input_data_path)):
+        with open(os.path.join(raw_input_data_path, filename), "rb") as fp:
+            dataset[filename] = DocumentLines(0)
+            dataset[filename].extend(normalizer.normalize_bytes(fp.read()))
+    mapper_output = invertedindex_map_init(dataset, "mapper1")
+    return list(invertedindex_reduce_init(((token, mapper_output[token]) for token in sorted(mapper_output)), "reducer1"))
+
+def build_json(records, file_path):
+    with open(file_path, "w") as fp:
+        json.dump({token: [doc_name for doc_name, _ in postings] for token, postings in records}, fp, indent=4)
+
+def build_index(records, file_path):
+    index_writer = IndexWriter(file_path)
+    for token, postings in records:
+        index_writer.add(token, postings)
+    index_writer.close()
+
+def build_synthetic_index(term_count, file_path):
+    index_writer = IndexWriter(file_path)
+    for i in range(term_count):
+        index_writer.add(f"term{i:08d}", [[f"doc{i % 64}.txt", [i % 1000, i % 1000 + 7]]])
+    index_writer.close()
+
+def timed(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+def main():
+    raw_input_data_path = sys.argv[1] if len(sys.argv) > 1 else "./raw-dataset"
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    records, map_seconds = timed(map_corpus, raw_input_data_path)
+    output_path = tempfile.mkdtemp()
+    json_path = os.path.join(output_path, "final-output-invertedindex.json")
+    index_path = os.path.join(output_path, "final-output-invertedindex.index")
+    _, json_build_seconds = timed(build_json, records, json_path)
+    _, index_build_seconds = timed(build_index, records, index_path)
+
+    tokens = [token for token, _ in records]
+    probe = [tokens[(i * 7919) % len(tokens)] for i in range(lookups)]
+
+    def json_lookups():
+        with open(json_path) as fp:
+            output = json.load(fp)
+        return [output[token] for token in probe]
+
+    def index_lookups():
+        index_reader = IndexReader(index_path)
+        return [index_reader.documents(token) for token in probe]
+
+    json_results, json_query_seconds = timed(json_lookups)
+    index_results, index_query_seconds = timed(index_lookups)
+    assert [sorted(docs) for docs in json_results] == index_results
+
+    print(f"{len(records)} terms, mapped & reduced in {map_seconds:.2f}s")
+    print(f"{'output':<8} {'size (KB)':>10} {'build (s)':>10} {f'load + {lookups} lookups (s)':>28}")
+    print(f"{'json':<8} {os.path.getsize(json_path) / 1024:>10.1f} {json_build_seconds:>10.3f} {json_query_seconds:>28.3f}")
+    print(f"{'index':<8} {os.path.getsize(index_path) / 1024:>10.1f} {index_build_seconds:>10.3f} {index_query_seconds:>28.3f}")
+
+    index_reader = IndexReader(index_path)
+    for phrase in PHRASES:
+        matches, phrase_seconds = timed(index_reader.phrase, phrase)
+        print(f"phrase {' '.join(phrase)!r}: {sum(len(starts) for starts in matches.values())} matches in {len(matches)} docs ({phrase_seconds * 1000:.2f} ms)")
+    index_reader.close()
+
+    print(f"\n{'terms':>8} {'size (MB)':>10} {'open (ms)':>10} {'lookup (us)':>12} {'reader heap (KB)':>17}")
+    for term_count in TERM_COUNTS:
+        synthetic_path = os.path.join(output_path, f"synthetic-{term_count}.index")
+        build_synthetic_index(term_count, synthetic_path)
+        # heap held by an open reader, the mapped file aside
+        tracemalloc.start()
+        index_reader = IndexReader(synthetic_path)
+        heap_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        index_reader.close()
+        index_reader, open_seconds = timed(IndexReader, synthetic_path)
+        probe = [f"term{(i * 7919) % term_count:08d}" for i in range(lookups)]
+        results, lookup_seconds = timed(lambda: [index_reader.documents(term) for term in probe])
+        assert all(results)
+        print(f"{term_count:>8} {os.path.getsize(synthetic_path) / 1024 / 1024:>10.1f} {open_seconds * 1000:>10.2f} "
+            f"{lookup_seconds / lookups * 1000000:>12.1f} {heap_bytes / 1024:>17.1f}")
+        index_reader.close()
+
+if __name__ == "__main__":
+    main()
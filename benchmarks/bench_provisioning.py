@@ -0,0 +1,106 @@
+import functools
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.instance_utils import create_instance, wait_for_operation, get_instance_obj
+from utils.provisioner import Provisioner, start_script
+from utils.bundle import build_bundle
+from utils.fake_compute import FakeCompute, FakeShell
+
+# Time to bring up N mapper VMs with the original launch_mappers +
+# shell-scripts/mapper_init.sh flow (fixed sleeps, then one VM set up after
+# the other) against utils/provisioner.py (every VM created, polled for
+# readiness and set up concurrently), on the fake Compute API of
+# utils/fake_compute.py. Latencies are typical GCE ones, in simulated seconds,
+# run SCALE times faster; reported times are simulated seconds.
+#
+# usage: python3 benchmarks/bench_provisioning.py [max_vms]
+
+SCALE = 0.01
+CREATE_SECONDS = 30     # insert request until the VM is RUNNING
+SSH_READY_SECONDS = 15  # RUNNING until sshd accepts connections
+COMMAND_SECONDS = 5     # one ssh command (apt-get, pip install, start)
+SCP_SECONDS = 15        # copying the repo
+POLL_SECONDS = 1
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(REPO_ROOT, "config.json")) as fp:
+    CONFIG = json.load(fp)
+CONFIG.update({
+    "provision_max_workers": 0,
+    "provision_poll_seconds": POLL_SECONDS * SCALE,
+    "provision_ready_timeout": 600 * SCALE,
+    "raw_input_data_path": os.path.join(REPO_ROOT, "raw-dataset"),
+    "bundle_path": tempfile.mkdtemp(),
+})
+
+def scaled_sleep(seconds):
+    time.sleep(seconds * SCALE)
+
+def legacy_launch_mappers(compute, shell, config, mapper_count):
+    # the original launch_mappers followed by mapper_init.sh
+    project = config["project_id"]
+    zone = config["zone"]
+    mapper_obj_table = {}
+    operations = []
+    for i in range(1, mapper_count+1):
+        mapper_instance_name = f"mapper{i}"
+        operations.append(create_instance(compute=compute, project=project, zone=zone, name=mapper_instance_name))
+    # (the original looked every VM up under the last loop's mapper_instance_name)
+    for i, oper in enumerate(operations, start=1):
+        wait_for_operation(compute, project, zone, oper['name'], poll_interval=POLL_SECONDS * SCALE)
+        mapper_instance_name = f"mapper{i}"
+        mapper_obj_table[mapper_instance_name] = get_instance_obj(compute, project, zone, mapper_instance_name)
+    scaled_sleep(max(5 * mapper_count, 10))
+
+    scaled_sleep(30)
+    for i in range(1, mapper_count+1):
+        name = f"mapper{i}"
+        shell.ssh(name, "echo start")
+        scaled_sleep(5)
+        shell.ssh(name, "sudo apt-get -qq install python3-pip")
+        shell.scp(name, REPO_ROOT, "~") # ../gcp-map-reduce
+        shell.ssh(name, "pip install -r ./gcp-map-reduce/requirements.txt")
+        shell.ssh(name, "python3 gcp-map-reduce/scripts/mapper.py")
+    return mapper_obj_table
+
+def concurrent_launch_mappers(compute, shell, config, mapper_count, bundle):
+    mapper_names = [f"mapper{i}" for i in range(1, mapper_count+1)]
+    return Provisioner(compute, config, shell=shell).provision(mapper_names, start_script(bundle, "mapper.py"))
+
+def time_launch(launch_func, mapper_count):
+    compute = FakeCompute(create_seconds=CREATE_SECONDS * SCALE)
+    shell = FakeShell(compute, ssh_ready_seconds=SSH_READY_SECONDS * SCALE,
+        command_seconds=COMMAND_SECONDS * SCALE, scp_seconds=SCP_SECONDS * SCALE)
+    start_time = time.time()
+    mapper_obj_table = launch_func(compute, shell, CONFIG, mapper_count)
+    elapsed = (time.time() - start_time) / SCALE
+    assert len(mapper_obj_table) == mapper_count
+    started = [name for name, command in shell.commands if "scripts/mapper.py" in command]
+    assert sorted(started) == sorted(mapper_obj_table), started
+    return elapsed
+
+def main():
+    max_vms = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    counts = [1]
+    while counts[-1] * 2 <= max_vms:
+        counts.append(counts[-1] * 2)
+
+    # built once up front: building takes real, not simulated, time
+    bundle = build_bundle(CONFIG, "mapper")
+    results = []
+    for mapper_count in counts:
+        legacy_seconds = time_launch(legacy_launch_mappers, mapper_count)
+        concurrent_seconds = time_launch(functools.partial(concurrent_launch_mappers, bundle=bundle), mapper_count)
+        results.append((mapper_count, legacy_seconds, concurrent_seconds))
+
+    print(f"\n{'VMs':>4} {'sequential (s)':>15} {'concurrent (s)':>15} {'speedup':>8}")
+    for mapper_count, legacy_seconds, concurrent_seconds in results:
+        print(f"{mapper_count:>4} {legacy_seconds:>15.1f} {concurrent_seconds:>15.1f} {legacy_seconds / concurrent_seconds:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
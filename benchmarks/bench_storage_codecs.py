@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.text_cleanup import TextNormalizer
+from scripts.wordcount_map import wordcount_map_init
+from scripts.wordcount_combine import wordcount_combine_init
+from scripts.invertedindex_map import invertedindex_map_init
+from scripts.storage_codecs import RECORD_CODECS, compress_bytes, iter_decompressed_chunks
+from scripts.framing import read_file_chunks
+
+# Encode/decode time and bytes on disk of the storage codecs
+# (scripts/storage_codecs.py) against the plain JSON files the KV store used
+# to write, on the map output of the raw-dataset corpus.
+#
+# usage: python3 benchmarks/bench_storage_codecs.py [raw_input_data_path] [compression_level]
+
+ROUNDS = 3
+
+def load_dataset(raw_input_data_path):
+    normalizer = TextNormalizer()
+    dataset = {}
+    for filename in sorted(os.listdir(raw_input_data_path)):
+        with open(os.path.join(raw_input_data_path, filename), "rb") as fp:
+            dataset[filename] = normalizer.normalize_bytes(fp.read())
+    return dataset
+
+def get_workloads(dataset):
+    # sorted (key, values) records as a mapper sends them, plus the legacy
+    # JSON object the KV store used to write for the same output
+    wordcount_output = wordcount_map_init(dataset, "bench")
+    combined_output = wordcount_combine_init(wordcount_output, "bench")
+    # token -> [doc name, positions] postings
+    invertedindex_output = invertedindex_map_init(dataset, "bench")
+    return {
+        "wordcount": (sorted(wordcount_output.items()), dict(wordcount_output)),
+        "wordcount+combiner": (sorted(combined_output.items()), combined_output),
+        "invertedindex": (sorted(invertedindex_output.items()), invertedindex_output),
+    }
+
+def best_time(func):
+    best = None
+    for _ in range(ROUNDS):
+        start_time = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_legacy_json(legacy_output):
+    encode_time, data = best_time(lambda: json.dumps(legacy_output).encode("utf-8"))
+    decode_time, _ = best_time(lambda: json.loads(data))
+    return encode_time, decode_time, len(data)
+
+def bench_codec(records, codec, compression, level):
+    def encode():
+        run_bytes = b"".join(codec.encode_record(key, value) for key, value in records)
+        return compress_bytes(run_bytes, compression, level)
+
+    encode_time, data = best_time(encode)
+    decode_time, decoded_count = best_time(lambda: sum(1 for _ in codec.iter_records(
+        iter_decompressed_chunks(read_file_chunks(data), compression))))
+    assert decoded_count == len(records)
+    return encode_time, decode_time, len(data)
+
+def main():
+    raw_input_data_path = sys.argv[1] if len(sys.argv) > 1 else "./raw-dataset"
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    workloads = get_workloads(load_dataset(raw_input_data_path))
+
+    print(f"{'workload':<20} {'format':<18} {'encode ms':>10} {'decode ms':>10} {'KB':>9} {'ratio':>7}")
+    for workload, (records, legacy_output) in workloads.items():
+        encode_time, decode_time, size = bench_legacy_json(legacy_output)
+        legacy_size = size
+        print(f"{workload:<20} {'legacy json':<18} {encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f} {size / 1024:>9.1f} {1.0:>7.2f}")
+        for codec_name, codec in RECORD_CODECS.items():
+            for compression in ["none", "zlib", "lzma"]:
+                encode_time, decode_time, size = bench_codec(records, codec, compression, level)
+                name = codec_name + ("+" + compression if compression != "none" else "")
+                print(f"{workload:<20} {name:<18} {encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f} {size / 1024:>9.1f} {size / legacy_size:>7.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.text_cleanup import cleanup_lines_list, TextNormalizer
+
+# Throughput of the single-pass TextNormalizer (scripts/text_cleanup.py)
+# against the legacy multi-pass cleanup_lines_list on the raw-dataset corpus.
+# Both are timed from raw file bytes to the list of cleaned lines, and their
+# tokens are compared so a speedup never hides a behaviour change.
+#
+# usage: python3 benchmarks/bench_text_cleanup.py [raw_input_data_path] [repeat]
+
+ROUNDS = 5
+
+def legacy_cleanup(data):
+    # what the master used to do for every document
+    return cleanup_lines_list(data.decode("utf-8", "ignore").split("\n"))
+
+def time_func(func, corpus):
+    best = None
+    for _ in range(ROUNDS):
+        start_time = time.perf_counter()
+        for data in corpus:
+            func(data)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    raw_input_data_path = sys.argv[1] if len(sys.argv) > 1 else "./raw-dataset"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    corpus = []
+    for filename in sorted(os.listdir(raw_input_data_path)):
+        with open(os.path.join(raw_input_data_path, filename), "rb") as fp:
+            corpus.append(fp.read() * repeat)
+    corpus_bytes = sum(len(data) for data in corpus)
+
+    normalizer = TextNormalizer()
+    chunk_size = 1 << 16
+    candidates = {
+        "legacy cleanup_lines_list": legacy_cleanup,
+        "TextNormalizer bytes": normalizer.normalize_bytes,
+        "TextNormalizer 64KB chunks": lambda data: list(normalizer.normalize_chunks(
+            data[i:i + chunk_size] for i in range(0, len(data), chunk_size))),
+        "TextNormalizer + stopwords": TextNormalizer(stopwords=["the", "and", "of", "a", "to"], min_token_length=2).normalize_bytes,
+    }
+
+    # the default normalizer must produce exactly the legacy tokens
+    for data in corpus:
+        expected = [line.split() for line in legacy_cleanup(data)]
+        for name in ["TextNormalizer bytes", "TextNormalizer 64KB chunks"]:
+            actual = [line.split() for line in candidates[name](data)]
+            if actual != expected:
+                sys.exit(f"{name} output differs from cleanup_lines_list")
+
+    print(f"corpus: {len(corpus)} files, {corpus_bytes / (1 << 20):.1f} MB")
+    print(f"{'normalizer':<28} {'ms':>10} {'MB/s':>10} {'speedup':>8}")
+    legacy_elapsed = None
+    for name, func in candidates.items():
+        elapsed = time_func(func, corpus)
+        legacy_elapsed = legacy_elapsed or elapsed
+        throughput = corpus_bytes / elapsed / (1 << 20)
+        print(f"{name:<28} {elapsed * 1000:>10.1f} {throughput:>10.1f} {legacy_elapsed / elapsed:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
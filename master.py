@@ -1,11 +1,10 @@
 import multiprocessing as mp
 import json
+import math
 import os
 import glob
 import socket
-import pickle
 import time
-import string
 import threading
 import logging
 from scripts.kv_store_server import start_kv_server
@@ -14,14 +13,21 @@ from scripts import reducer
 from importlib import import_module
 
 from utils.instance_utils import *
+from utils.provisioner import Provisioner, start_script
+from utils.bundle import build_bundle, VENDOR_PYTHONPATH
+from utils import local_backend
+from scripts.partitioner import sample_keys, compute_range_boundaries
+from scripts.input_splits import compute_input_splits, sample_input_lines, read_split_bytes
+from scripts.map_cache import get_map_identity, get_block_cache_key
+from scripts.text_cleanup import get_text_normalizer
+from scripts.framing import get_wire_compression
+from scripts.kv_client import KVClient
+from utils.task_tracker import AckListener, TaskTracker
+from utils.dispatcher import get_dispatcher
 import subprocess
 
-# GCP modules
-from googleapiclient import discovery
-
 CONFIG_FILE_PATH = "config.json"
 MESSAGE_FORMAT = "utf-8"
-SIZE = 4096
 
 def import_map_reduce_functions(config):
     # import the map/reduce functions as specified in config.json
@@ -41,179 +47,171 @@ def import_map_reduce_functions(config):
         reduce_func = reducer_app_module.invertedindex_reduce_init
     return map_func, reduce_func
 
-def cleanup_lines_list(doc_lines_list):
-    # remove punctuations 
-    punctuation_set = set(string.punctuation)
-    for i in range(len(doc_lines_list)):
-        doc_lines_list[i] = doc_lines_list[i].translate(str.maketrans('', '', string.punctuation))
-    
-    # strip whitespaces and newline chars
-    doc_lines_list = [doc_lines_list[i].strip() for i in range(len(doc_lines_list))]
-    
-    # remove blank lines
-    doc_lines_list = [doc_lines_list[i] for i in range(len(doc_lines_list)) if doc_lines_list[i]]
-    
-    # convert all words to lower case
-    for i in range(len(doc_lines_list)):
-            doc_lines_list[i] = doc_lines_list[i].lower()
-            line_encode = doc_lines_list[i].encode("ascii", "ignore")
-            doc_lines_list[i] = line_encode.decode()
-    return doc_lines_list
-    
-def generate_dataset(raw_input_data_path):
-    dataset = {}
-    for filename in os.listdir(raw_input_data_path):
-        filepath = os.path.join(raw_input_data_path, filename)
-        with open(filepath, "r") as fp:
-            doc_lines_list = fp.readlines()
-        doc_lines_list = cleanup_lines_list(doc_lines_list)
-        dataset[filename] = doc_lines_list
-    return dataset
-
-def load_data_in_kvstore(kv_store_addr, dataset, mapper_count):
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
-    payload = ("set", "input", dataset, mapper_count)
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
-
-def wait_for_mappers(master_server, config):
-    count = 0
-    mapper_count = config["mapper_count"]
-
-    # Wait for explicit ACK from all mappers 
-    while count < mapper_count:
-        conn, client_addr = master_server.accept()
-        print(f"[MASTER] Connection request accepted from mapper {client_addr}")
-
-        serialized_msg = b""
-        while True:
-            packet = conn.recv(SIZE)
-            serialized_msg += packet
-            if b"ENDOFDATA" in packet:
-                break
-        serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-        payload = pickle.loads(serialized_msg)
-        
-        if payload[0][:6] == "mapper" and payload[1] == "DONE":
-            print(f"[MASTER] {payload[0]} task completed")
-            logging.info(f"{payload[0]} task completed")
-            count += 1
-    print(f"\n[MASTER] ACK received from all {mapper_count} mappers")
-    logging.info(f"ACK received from all {mapper_count} mappers")
+def load_data_in_kvstore(kv_client, input_splits):
+    # only the split descriptors travel; mappers read the bytes themselves
+    return kv_client.request("set", "input", input_splits)
+
+def add_map_cache_keys(input_splits, config):
+    # appends the map cache key of its block to every split; the master reads
+    # (and hashes) the whole corpus for it, which is still far cheaper than mapping it
+    map_identity = get_map_identity(config)
+    for mapper_splits in input_splits.values():
+        for input_split in mapper_splits:
+            filename, offset, length = input_split
+            block_bytes = read_split_bytes(os.path.join(config["raw_input_data_path"], filename), offset, length)
+            input_split.append(get_block_cache_key(map_identity, filename, offset, block_bytes))
+
+def restore_cached_mappers(kv_client, input_splits, config):
+    # commits the output of every mapper whose blocks are all in the map cache;
+    # returns their ids
+    cache_keys = [input_split[3] for mapper_splits in input_splits.values() for input_split in mapper_splits]
+    cached_keys = set(kv_client.request("map-cache", "lookup", cache_keys))
+    cached_mapper_ids = []
+    for mapper_id, mapper_splits in input_splits.items():
+        if all(input_split[3] in cached_keys for input_split in mapper_splits):
+            if mapper.commit_cached_map_task(mapper_id, mapper_splits, kv_client, config):
+                cached_mapper_ids.append(mapper_id)
+    print(f"[MASTER] Map cache: {len(cached_keys)}/{len(cache_keys)} blocks cached, {len(cached_mapper_ids)} mapper tasks restored")
+    logging.info(f"Map cache: {len(cached_keys)}/{len(cache_keys)} blocks cached, mapper tasks restored: {cached_mapper_ids}")
+    return cached_mapper_ids
+
+def wait_for_mappers(ack_listener, mapper_tracker, other_trackers=()):
+    # Wait for explicit ACK from all mappers; stragglers get backup attempts
+    mapper_tracker.wait(ack_listener, other_trackers=other_trackers)
     print(f"\n[MASTER] --------- BARRIER (waiting for mappers to complete) ---------- \n")
     logging.info(f"BARRIER (waiting for mappers to complete)")
 
-def wait_for_reducers(master_server, config):
-    count = 0
-    reducer_count = config["reducer_count"]
-
-    # Wait for explicit ACK from all reducers
-    while count < reducer_count:
-        conn, client_addr = master_server.accept()
-        print(f"[MASTER] Connection request accepted from reducer {client_addr}")
-
-        serialized_msg = b""
-        while True:
-            packet = conn.recv(SIZE)
-            serialized_msg += packet
-            if b"ENDOFDATA" in packet:
-                break
-        serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-        payload = pickle.loads(serialized_msg)
-
-        if payload[0][:7] == "reducer" and payload[1] == "DONE":
-            print(f"[MASTER] {payload[0]} task completed")
-            logging.info(f"{payload[0]} task completed")
-            count += 1
-
-    print(f"\n[MASTER] ACK received from all {reducer_count} reducers")
-    logging.info(f"ACK received from all {reducer_count} reducers")
-
-def cleanup_kvstore(kv_store_addr):
-    print(f"**** cleanup *** {kv_store_addr}")
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
-    payload = ("cleanup", "all")
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
-
-def combine_reducer_output(kv_store_addr):
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
-    payload = ("combine", "final-output")
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
+def wait_for_reducers(ack_listener, reducer_tracker):
+    # Wait for explicit ACK from all reducers; stragglers get backup attempts
+    reducer_tracker.wait(ack_listener)
+
+def fetch_skew_report(kv_client):
+    return kv_client.request("get", "skew-report")
+
+def log_skew_report(report):
+    if not isinstance(report, list):
+        print(f"[MASTER] Partition skew report unavailable: {report}")
+        logging.error(f"Partition skew report unavailable: {report}")
+        return
+    print(f"\n[MASTER] Partition skew report")
+    logging.info(f"Partition skew report")
+    for row in report:
+        line = f"partition {row['partition']}: {row['keys']} keys, {row['records']} records, {row['bytes']} bytes"
+        print(f"[MASTER]   {line}")
+        logging.info(line)
+
+def start_kv_job(kv_client, config):
+    # the KV store keeps the job's objects apart and answers its requests
+    # with its config; older jobs' data is deleted as per the retention policy
+    return kv_client.request("start-job", config)
+
+def cleanup_kvstore(kv_client):
+    print(f"**** cleanup *** {kv_client.kv_store_addr}")
+    return kv_client.request("cleanup", "all")
+
+def combine_reducer_output(kv_client):
+    return kv_client.request("combine", "final-output")
 
 def launch_kv_store(compute, config):
-    project = config["project_id"]
-    zone = config["zone"]
     kv_store_instance_name = config["kv_store_instance_name"]
 
-    operation = create_instance(compute=compute, project=project, zone=zone, name=kv_store_instance_name)
-    wait_for_operation(compute, project, zone, operation['name'])
-    kv_store_instance_obj = get_instance_obj(compute, project, zone, kv_store_instance_name)
+    provisioner = Provisioner(compute, config)
+    kv_store_instance_obj = provisioner.provision([kv_store_instance_name], start_script(build_bundle(config, "kv-store"), "kv_store_server.py"))[kv_store_instance_name]
     kv_internal_ip = get_instance_internal_ip(kv_store_instance_obj)
     kv_external_ip = get_instance_external_ip(kv_store_instance_obj)
     print(f"KV Store Created.")
     print(f"KV Store Internal IP: {kv_internal_ip}")
     print(f"KV Store External IP: {kv_external_ip}")
-    
-    time.sleep(5)
-    subprocess.call(["/bin/bash", "./shell-scripts/kv_store_init.sh", config["kv_store_instance_name"], zone])
-    
+
     config["kv_store_host"] = kv_internal_ip
+    save_gce_state(config, {"kv_store_host": kv_internal_ip})
+    # poll the port instead of sleeping until the server accepts connections
+    local_backend.wait_for_kv_store((kv_internal_ip, config["kv_store_port"]), timeout=config["provision_ready_timeout"])
 
     return kv_store_instance_obj
 
-def launch_mappers(compute, config):
-    project = config["project_id"]
-    zone = config["zone"]
-    mapper_count = config["mapper_count"]
-    mapper_obj_table = {}
-    operations = []
-
-    for i in range(1, mapper_count+1):
-        mapper_instance_name = f"mapper{i}"
-        operation = create_instance(compute=compute, project=project, zone=zone, name=mapper_instance_name)
-        operations.append(operation)
-    
-    for oper in operations:
-        wait_for_operation(compute, project, zone, oper['name'])
-        mapper_instance_obj = get_instance_obj(compute, project, zone, mapper_instance_name)
-        mapper_obj_table[mapper_instance_name] = mapper_instance_obj
-
-    time.sleep(max(5 * mapper_count, 10))
-    subprocess.call(["/bin/bash", "./shell-scripts/mapper_init.sh", str(mapper_count), zone])
-    return mapper_obj_table
+def launch_mappers(compute, config, mapper_names):
+    # all mapper VMs are created and set up concurrently; each mapper starts
+    # as soon as its own VM is ready
+    return Provisioner(compute, config).provision(mapper_names, start_script(build_bundle(config, "mapper"), "mapper.py"))
 
 def launch_reducers(compute, config):
-    project = config["project_id"]
-    zone = config["zone"]
-    reducer_count = config["reducer_count"]
-    reducer_obj_table = {}
-    operations = []
-
-    for i in range(1, reducer_count+1):
-        reducer_instance_name = f"reducer{i}"
-        operation = create_instance(compute=compute, project=project, zone=zone, name=reducer_instance_name)
-        operations.append(operation)
-    
-    for oper in operations:
-        wait_for_operation(compute, project, zone, oper['name'])
-        reducer_instance_obj = get_instance_obj(compute, project, zone, reducer_instance_name)
-        reducer_obj_table[reducer_instance_name] = reducer_instance_obj
-
-    subprocess.call(["/bin/bash", "./shell-scripts/reducer_init.sh", str(reducer_count), zone])
-    return reducer_obj_table
-
-def update_config_file(config):
-    print("[MASTER] Updating config file...")
-    with open(CONFIG_FILE_PATH, "w") as fp:
-        json.dump(config, fp, indent=4)
-
-def master_init():
+    reducer_names = [f"reducer{i}" for i in range(1, config["reducer_count"]+1)]
+    return Provisioner(compute, config).provision(reducer_names, start_script(build_bundle(config, "reducer"), "reducer.py"))
+
+def runs_exclusively(config):
+    # per-job GCE workers are the VMs mapperN & reducerN, so such jobs cannot
+    # run alongside other jobs
+    return config["execution_backend"] == "gce" and config["worker_mode"] != "daemon"
+
+def launch_gce_attempt(config, role, task_id, attempt, workers):
+    # backup attempts and re-executions run on a VM of the same role, which
+    # already has the code and config; the tracker lists idle VMs first
+    if not workers:
+        return None
+    worker = workers[0]
+    command = f"PYTHONPATH={VENDOR_PYTHONPATH} python3 gcp-map-reduce/scripts/{role}.py {task_id} ./gcp-map-reduce/config.json {attempt}"
+    subprocess.Popen(["gcloud", "compute", "ssh", worker, f"--zone={config['zone']}", "--", command])
+    return worker
+
+def load_gce_state(config):
+    # addresses of the VMs provisioned by earlier jobs, which outlive the job
+    # (see save_gce_state); config.json itself only holds what the user set
+    try:
+        with open(config["gce_state_path"], "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+def save_gce_state(config, state):
+    gce_state = dict(load_gce_state(config), **state)
+    with open(config["gce_state_path"] + ".tmp", "w") as fp:
+        json.dump(gce_state, fp, indent=4)
+    os.replace(config["gce_state_path"] + ".tmp", config["gce_state_path"])
+
+def resolve_hosts(config):
+    # returns config with the master & KV store addresses of its backend
+    backend = config["execution_backend"]
+    if backend == "gce":
+        config["master_host"] = socket.gethostbyname(socket.gethostname())
+        # the KV store VM of the last job that provisioned one
+        config["kv_store_host"] = load_gce_state(config).get("kv_store_host", config["kv_store_host"])
+        return config
+    elif backend in ("local-pool", "local-subprocess"):
+        return local_backend.localize_config(config)
+    raise ValueError(f"Unknown execution_backend in config.json: {backend}")
+
+def kv_store_is_running(config):
+    # worker daemon mode keeps the KV store VM of the previous job
+    try:
+        local_backend.wait_for_kv_store((config["kv_store_host"], config["kv_store_port"]), timeout=2)
+        return True
+    except OSError:
+        return False
+
+def publish_config(config):
+    # workers read their config from disk: the VMs get the job's config.json
+    # in their bundle (see utils/bundle.py) and local subprocess workers read
+    # local_config_path. config.json itself is left alone, so a job's
+    # overrides don't carry over to the jobs after it
+    if config["execution_backend"] == "local-subprocess":
+        local_backend.write_local_config(config)
+
+def apply_overrides(config, overrides):
+    # per-job config changes of a submitted job, e.g. {"operation_name": "wordcount"}
+    unknown_keys = sorted(set(overrides) - set(config))
+    if unknown_keys:
+        raise ValueError(f"Unknown config keys: {unknown_keys}")
+    config.update(overrides)
+    return config
+
+def master_init(overrides=None, progress=None):
+    # progress: the JobProgress of a job run by utils/job_scheduler.py, which
+    # gets the job's phase and trackers and can cancel it
     
     # read config parameters
     with open(CONFIG_FILE_PATH, "r") as fp:
-        config = json.load(fp)
+        config = apply_overrides(json.load(fp), overrides or {})
 
     # initialize logging configurations
     logging.basicConfig(
@@ -224,7 +222,23 @@ def master_init():
         level=logging.DEBUG
         )
 
-    config["master_host"] = socket.gethostbyname(socket.gethostname())
+    job_start_time = time.time()
+    backend = config["execution_backend"]
+    run_on_gce = backend == "gce"
+    config = resolve_hosts(config)
+    # "daemon": tasks go to the long-lived worker daemons through the task
+    # dispatcher instead of to workers started for this job
+    daemon_mode = config["worker_mode"] == "daemon"
+    job_id = progress.job_id if progress is not None else f"{config['operation_name']}-{int(job_start_time * 1000)}"
+    # workers scope their KV requests to the job
+    config["job_id"] = job_id
+    # jobs of the scheduler may run side by side: each gets its own master
+    # port and config file for local subprocess workers
+    scheduled = progress is not None
+    if scheduled:
+        config["master_port"] = 0
+        root, extension = os.path.splitext(config["local_config_path"])
+        config["local_config_path"] = f"{root}-{job_id}{extension}"
     master_addr = (config["master_host"], config["master_port"])
     operation_name = config["operation_name"]
 
@@ -235,81 +249,221 @@ def master_init():
         if operation_name == "invertedindex":
             config["mapper_function"] = "invertedindex_map"
             config["reducer_function"] = "invertedindex_reduce"
+            config["combiner_function"] = ""
         else:
             config["mapper_function"] = "wordcount_map"
             config["reducer_function"] = "wordcount_reduce"
+            config["combiner_function"] = "wordcount_combine"
+
+    def set_phase(phase):
+        if progress is not None:
+            progress.set_phase(phase)
+
+    set_phase("provisioning")
 
     # Open master server socket & start listening for connections
-    print(f"[MASTER] Master process has started for {operation_name} operation...")
-    logging.info(f"Master process has started for {operation_name} operation...")
+    print(f"[MASTER] Master process has started for {operation_name} operation ({backend} backend, {config['worker_mode']} workers, job {job_id})...")
+    logging.info(f"Master process has started for {operation_name} operation ({backend} backend, {config['worker_mode']} workers, job {job_id})...")
     # Create master socket
     master_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    master_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     master_server.bind(master_addr)
     master_server.listen()
+    master_addr = master_server.getsockname()
+    config["master_port"] = master_addr[1]
     print(f"[MASTER] Server listening for connections at address {master_addr}...")
     logging.info(f"Server listening for connections at address {master_addr}...")
-
-    subprocess.call(["/bin/bash", "./shell-scripts/master-init.sh"])
-
-    compute = discovery.build('compute', 'v1')
-    
-    kv_store_instance_obj = launch_kv_store(compute, config)
-
-    # Update config file with new IPs of master, kv_store_server & any other changes
-    update_config_file(config)
+    # worker ACKs are accepted in the background and queued
+    ack_listener = AckListener(master_server)
+    ack_listener.start()
+    if daemon_mode:
+        dispatcher = get_dispatcher(config)
+        dispatcher.start_job(job_id)
+        print(f"[MASTER] Worker daemons: {sorted(dispatcher.live_workers())}")
+        logging.info(f"Worker daemons: {dispatcher.live_workers()}")
+
+    if run_on_gce:
+        # GCP modules are only needed when provisioning VMs
+        from googleapiclient import discovery
+
+        compute = discovery.build('compute', 'v1')
+
+        if daemon_mode and kv_store_is_running(config):
+            # network, firewall & KV store are still there from the previous job
+            print(f"[MASTER] Reusing the running KV Store at {config['kv_store_host']}")
+            logging.info(f"Reusing the running KV Store at {config['kv_store_host']}")
+        else:
+            subprocess.call(["/bin/bash", "./shell-scripts/master-init.sh"])
+            kv_store_instance_obj = launch_kv_store(compute, config)
+    else:
+        # local backend: KV store and workers are processes on this host
+        pool = None
+        if backend == "local-pool" and not daemon_mode:
+            pool = mp.Pool(local_backend.get_local_worker_count(config))
+        # scheduled jobs share one KV store; a job run on its own starts its own
+        kv_process = None
+        if scheduled:
+            local_backend.get_shared_local_kv_store(config)
+        else:
+            kv_process = local_backend.launch_local_kv_store(config)
+    worker_handles = []
+
+    def launch_attempt(role):
+        # returns the TaskTracker callback that starts another attempt of a task of role
+        def launch(task_id, attempt, workers):
+            if daemon_mode:
+                # whichever daemon of the role pulls it first runs it
+                dispatcher.submit(job_id, role, task_id, attempt, config)
+                return ""
+            if run_on_gce:
+                return launch_gce_attempt(config, role, task_id, attempt, workers)
+            worker_handles.append(local_backend.launch_local_task(pool, config, role, task_id, attempt))
+            return ""
+        return launch
     
     print("*** config at this point is\n", config)
 
-    # cleanup kv store
-    print(f"[MASTER] Cleaning up KV Store...")
-    logging.info(f"Cleaning up KV Store...")
     kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
-    cleanup_kvstore(kv_store_addr)
-    time.sleep(2)
+    kv_client = KVClient(kv_store_addr, config["kv_pool_size"], config["kv_timeout"], get_wire_compression(config), job_id)
+
+    # a task that keeps failing, or a cancelled job, aborts the job; the
+    # workers are released either way
+    try:
+        # cleanup kv store
+        set_phase("splitting")
+        print(f"[MASTER] Cleaning up KV Store...")
+        logging.info(f"Cleaning up KV Store...")
+        start_kv_job(kv_client, config)
+        cleanup_kvstore(kv_client)
     
-    # generate dataset dictionary from raw-dataset
-    print(f"[MASTER] Partitioning raw dataset as per number of mappers...")
-    logging.info(f"Partitioning raw dataset as per number of mappers...")
-    dataset = generate_dataset(config["raw_input_data_path"])
-
-    # load dataset in "input" kv-store
-    print(f"[MASTER] Loading partitioned mapper-input files into KV Store...")
-    logging.info(f"Loading partitioned mapper-input files into KV Store...")
-    load_data_in_kvstore(kv_store_addr, dataset, config["mapper_count"])
-    time.sleep(1)
-
-    mapper_obj_table = launch_mappers(compute, config)
-
-    # Barrier: Wait for all mappers to complete
-    wait_for_mappers(master_server, config)
-
-    mapper_count = config["mapper_count"]
-    print(f"\n[MASTER] All {mapper_count} mapper tasks are complete...\n")
-    logging.info(f"All {mapper_count} mapper tasks are complete...")
-
-    reducer_obj_table = launch_reducers(compute, config)
-
-    # Wait for all reducers to complete: only applicable if single output file is desired
-    wait_for_reducers(master_server, config)
-
-    print(f"[MASTER] Generating final output file & writing to {config['final_output_path']}...")
-    logging.info(f"Generating final output file & writing to {config['final_output_path']}...")
-    # Combine reducers' output into a single file
-    combine_reducer_output(kv_store_addr)
+        # describe mapper input as byte ranges of the raw files (file sizes only)
+        print(f"[MASTER] Computing input splits as per number of mappers...")
+        logging.info(f"Computing input splits as per number of mappers...")
+        input_splits = compute_input_splits(config["raw_input_data_path"], config["mapper_count"], config["map_cache_block_bytes"] if config["map_cache"] else None)
+        for mapper_id, mapper_splits in input_splits.items():
+            logging.info(f"{mapper_id} input splits: {mapper_splits}")
+        if progress is not None:
+            progress.input_bytes = {mapper_id: sum(length for _, _, length in mapper_splits) for mapper_id, mapper_splits in input_splits.items()}
+
+        # sample the input to pick key ranges that give reducers equal shares
+        if config["partitioner"] == "range":
+            sample_lines = sample_input_lines(config["raw_input_data_path"], max(1, config["partition_sample_size"] // 8))
+            sample_text = "\n".join(sample_lines).encode("utf-8")
+            sample = sample_keys({"sample": get_text_normalizer(config).normalize_bytes(sample_text)}, config["partition_sample_size"])
+            config["partition_boundaries"] = compute_range_boundaries(sample, config["reducer_count"])
+            print(f"[MASTER] Range partition boundaries: {config['partition_boundaries']}")
+            logging.info(f"Range partition boundaries: {config['partition_boundaries']}")
+
+        if config["map_cache"]:
+            add_map_cache_keys(input_splits, config)
+
+        # load split descriptors in "input" kv-store
+        print(f"[MASTER] Loading mapper input splits into KV Store...")
+        logging.info(f"Loading mapper input splits into KV Store...")
+        load_data_in_kvstore(kv_client, input_splits)
+        cached_mapper_ids = restore_cached_mappers(kv_client, input_splits, config) if config["map_cache"] else []
+
+        # pipelined shuffle: reducers start while mappers run. A local pool needs a
+        # free worker beyond the (waiting) reducers, or re-executed and backup
+        # mappers would queue behind them forever
+        if config["pipelined_shuffle"] and backend == "local-pool" and not daemon_mode and local_backend.get_local_worker_count(config) <= config["reducer_count"]:
+            print(f"[MASTER] Pipelined shuffle disabled: the local pool needs more than {config['reducer_count']} workers")
+            logging.info(f"Pipelined shuffle disabled: the local pool needs more than {config['reducer_count']} workers")
+            config["pipelined_shuffle"] = False
+        pipelined_shuffle = config["pipelined_shuffle"]
+
+        # publish the job's config with the IPs of master, kv_store_server, partition boundaries & any other changes
+        publish_config(config)
+
+        cancelled = progress.cancelled if progress is not None else None
+        mapper_ids = [f"mapper{i}" for i in range(1, config["mapper_count"]+1)]
+        mapper_tracker = TaskTracker("mapper", mapper_ids, config, launch_attempt("mapper"), cancelled)
+        reducer_ids = [f"reducer{i}" for i in range(1, config["reducer_count"]+1)]
+        reducer_tracker = TaskTracker("reducer", reducer_ids, config, launch_attempt("reducer"), cancelled)
+        if progress is not None:
+            progress.trackers = [mapper_tracker, reducer_tracker]
+        set_phase("map")
+
+        def start_reducers():
+            if daemon_mode:
+                for reducer_id in reducer_ids:
+                    launch_attempt("reducer")(reducer_id, 0, [])
+            elif run_on_gce:
+                launch_reducers(compute, config)
+            else:
+                worker_handles.extend(local_backend.launch_local_workers(pool, config, "reducer"))
+            for reducer_id in reducer_ids:
+                reducer_tracker.start_attempt(reducer_id, reducer_id if run_on_gce and not daemon_mode else "")
+
+        # mappers restored from the map cache are not run
+        for mapper_id in cached_mapper_ids:
+            mapper_tracker.complete_cached(mapper_id)
+        launch_mapper_ids = [mapper_id for mapper_id in mapper_ids if mapper_id not in cached_mapper_ids]
+        if daemon_mode:
+            for mapper_id in launch_mapper_ids:
+                launch_attempt("mapper")(mapper_id, 0, [])
+        elif run_on_gce:
+            if launch_mapper_ids:
+                mapper_obj_table = launch_mappers(compute, config, launch_mapper_ids)
+        else:
+            worker_handles += local_backend.launch_local_workers(pool, config, "mapper", launch_mapper_ids)
+        for mapper_id in launch_mapper_ids:
+            # on GCE attempt 0 of mapperN runs on the VM named mapperN
+            mapper_tracker.start_attempt(mapper_id, mapper_id if run_on_gce and not daemon_mode else "")
+
+        if pipelined_shuffle:
+            # start reducers once reduce_slowstart of the mappers are done; they
+            # fetch each mapper's output as soon as it commits
+            mapper_tracker.wait(ack_listener, other_trackers=[reducer_tracker], min_completed=math.ceil(config["reduce_slowstart"] * len(mapper_ids)))
+            print(f"[MASTER] Starting reducers while {len(mapper_ids) - len(mapper_tracker.completed)} mappers are still running...")
+            logging.info(f"Starting reducers while {len(mapper_ids) - len(mapper_tracker.completed)} mappers are still running...")
+            start_reducers()
+
+        # Barrier: Wait for all mappers to complete
+        wait_for_mappers(ack_listener, mapper_tracker, [reducer_tracker] if pipelined_shuffle else [])
+
+        mapper_count = config["mapper_count"]
+        print(f"\n[MASTER] All {mapper_count} mapper tasks are complete...\n")
+        logging.info(f"All {mapper_count} mapper tasks are complete...")
+        set_phase("reduce")
+
+        log_skew_report(fetch_skew_report(kv_client))
+
+        if not pipelined_shuffle:
+            start_reducers()
+
+        # Wait for all reducers to complete: only applicable if single output file is desired
+        wait_for_reducers(ack_listener, reducer_tracker)
+
+        print(f"[MASTER] Generating final output file & writing to {os.path.join(config['final_output_path'], job_id)}...")
+        logging.info(f"Generating final output file & writing to {os.path.join(config['final_output_path'], job_id)}...")
+        # Combine reducers' output into a single file
+        set_phase("combine")
+        combine_reducer_output(kv_client)
+        if not config["kv_keep_intermediate"]:
+            kv_client.request("cleanup", "intermediate")
+        logging.info(f"KV Store object cache stats: {kv_client.request('get', 'cache-stats')}")
+        logging.info(f"KV Store transfer stats ({config['wire_compression']} wire compression): {kv_client.request('get', 'transfer-stats')}")
+    finally:
+        kv_client.close()
+        if daemon_mode:
+            # the daemons stay for the next job; they stop this job's stragglers
+            dispatcher.finish_job(job_id)
+            if not run_on_gce:
+                local_backend.stop_local_backend(pool, kv_process, worker_handles)
+        elif run_on_gce:
+            # cleanup (delete all mapper & reducer VMs)
+            subprocess.call(["/bin/bash", "./shell-scripts/cleanup.sh", str(config["mapper_count"]), str(config["reducer_count"]), config["zone"]])
+        else:
+            local_backend.stop_local_backend(pool, kv_process, worker_handles)
+        if scheduled and os.path.exists(config["local_config_path"]):
+            os.remove(config["local_config_path"])
+        ack_listener.stop()
+        master_server.close()
+    set_phase("done")
 
-    # cleanup (delete all mapper & reducer VMs)
-    subprocess.call(["/bin/bash", "./shell-scripts/cleanup.sh", str(config["mapper_count"]), str(config["reducer_count"]), config["zone"]])
+    print(f"[MASTER] {operation_name} job completed in {time.time() - job_start_time:.2f} seconds")
+    logging.info(f"{operation_name} job completed in {time.time() - job_start_time:.2f} seconds")
 
 if __name__ == "__main__":
     master_init()
-    
-    
-
-
-
-
-
-
-
-    
-
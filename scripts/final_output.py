@@ -0,0 +1,125 @@
+import heapq
+import json
+
+from scripts.sorted_runs import iter_record_chunks
+
+# Queries on a final output file, streamed record by record straight from
+# the file. write_final_output stores the output as a JSON object in key
+# order, one record per "    <key>: <value>" line (values spanning several
+# lines continue at a deeper indent), so records are found without parsing
+# the whole object, and a key is found by binary searching byte offsets of
+# the file. A query holds at most one record in memory, or top records with
+# top-K.
+#
+# query: dict of optional filters, applied in this order
+#   start, end: keys in [start, end)
+#   prefix: keys starting with prefix
+#   top: the top records by value (by length for list values), in value order
+#   offset, limit: the records after offset, at most limit of them
+
+RECORD_START = b'    "'
+OBJECT_END = b"}"
+SEEK_MIN_SPAN = 65536
+
+key_decoder = json.JSONDecoder()
+
+def parse_record_line(line):
+    # (key, first line of its JSON value) of a record's first line
+    text = line.decode("utf-8")
+    key, end = key_decoder.raw_decode(text, len(RECORD_START) - 1)
+    # the key is followed by ": "
+    return key, text[end + 2:]
+
+def iter_file_records(fp):
+    # (key, JSON value text) of the records from the current position of fp,
+    # which is the start of a line; lines before the first record are skipped
+    key = None
+    value_lines = []
+    for line in fp:
+        if line.startswith(RECORD_START) or line.startswith(OBJECT_END):
+            if key is not None:
+                yield key, "".join(value_lines).rstrip().rstrip(",")
+            if line.startswith(OBJECT_END):
+                return
+            key, value_line = parse_record_line(line)
+            value_lines = [value_line]
+        elif key is not None:
+            value_lines.append(line.decode("utf-8"))
+    if key is not None:
+        yield key, "".join(value_lines).rstrip().rstrip(",")
+
+def next_record_key(fp):
+    for line in fp:
+        if line.startswith(RECORD_START):
+            return parse_record_line(line)[0]
+        if line.startswith(OBJECT_END):
+            return None
+    return None
+
+def seek_to_key(fp, key):
+    # moves fp to the start of a line before the first record whose key is
+    # not smaller than key, at most about SEEK_MIN_SPAN bytes before it
+    low = 0
+    high = fp.seek(0, 2)
+    while high - low > SEEK_MIN_SPAN:
+        middle = (low + high) // 2
+        fp.seek(middle)
+        # the rest of the line middle falls in
+        fp.readline()
+        record_key = next_record_key(fp)
+        if record_key is not None and record_key < key:
+            low = middle
+        else:
+            high = middle
+    fp.seek(low)
+    if low:
+        fp.readline()
+
+def get_rank(value_text):
+    value = json.loads(value_text)
+    return len(value) if isinstance(value, (list, dict, str)) else value
+
+def iter_matching_records(file_path, query):
+    start = query.get("start")
+    end = query.get("end")
+    prefix = query.get("prefix")
+    if prefix is not None and (start is None or prefix > start):
+        start = prefix
+    with open(file_path, "rb") as fp:
+        if start is not None:
+            seek_to_key(fp, start)
+        for key, value_text in iter_file_records(fp):
+            if start is not None and key < start:
+                continue
+            if end is not None and key >= end:
+                return
+            if prefix is not None and not key.startswith(prefix):
+                # keys are sorted, so no later key has the prefix either
+                return
+            yield key, value_text
+
+def iter_query_records(file_path, query):
+    records = iter_matching_records(file_path, query)
+    if query.get("top") is not None:
+        # stable, so records of equal value stay in key order
+        records = iter(heapq.nlargest(query["top"], records, key=lambda record: get_rank(record[1])))
+    offset = query.get("offset") or 0
+    limit = query.get("limit")
+    for index, record in enumerate(records):
+        if index < offset:
+            continue
+        if limit is not None and index >= offset + limit:
+            break
+        yield record
+
+def iter_query_output(file_path, query):
+    # chunks of the JSON object of the records matching query, laid out like
+    # the stored file
+    def encoded_records():
+        yield b"{"
+        record_count = 0
+        for key, value_text in iter_query_records(file_path, query):
+            yield (("\n" if record_count == 0 else ",\n") + "    " + json.dumps(key) + ": " + value_text).encode("utf-8")
+            record_count += 1
+        yield b"\n}" if record_count else b"}"
+    return iter_record_chunks(encoded_records())
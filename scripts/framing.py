@@ -0,0 +1,246 @@
+import lzma
+import time
+import zlib
+import pickle
+import struct
+import threading
+
+# Wire format shared by the master, KV store, mappers and reducers.
+#
+# Every message is a frame: a fixed 9 byte header followed by the body.
+#   flags  (1 byte)  FLAG_CHUNK marks one chunk of a streamed body,
+#                    FLAG_ZLIB / FLAG_LZMA a compressed body,
+#                    FLAG_HELLO a compression negotiation frame
+#   length (8 bytes) body length in bytes, network byte order
+#
+# A regular message is a single frame holding a pickled Python object.
+# A streamed body is a run of FLAG_CHUNK frames terminated by an empty chunk,
+# so the receiver never needs more than one chunk in memory.
+#
+# Compression is negotiated per connection: the client opens with a
+# FLAG_HELLO frame listing the codecs it accepts and the server answers with
+# the codec both sides will use ("none" if there is no common one). After
+# that each side compresses the bodies it sends above its size threshold.
+# Receivers decompress by the frame flags alone.
+HEADER = struct.Struct("!BQ")
+FLAG_CHUNK = 0x01
+FLAG_ZLIB = 0x02
+FLAG_LZMA = 0x04
+FLAG_HELLO = 0x08
+COMPRESSION_FLAGS = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+STREAM_CHUNK_SIZE = 1 << 20
+
+# header and body are sent with a single sendall below this size
+SMALL_FRAME_SIZE = 1 << 16
+
+# reply sent before a streamed body so the receiver knows chunks follow
+STREAM_MARKER = "STREAM"
+
+class TransferStats:
+    # raw vs. on-the-wire bytes and time spent (de)compressing, summed over
+    # every frame sent or received on the connections sharing this object
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames_sent = 0
+        self.frames_compressed = 0
+        self.sent_raw_bytes = 0
+        self.sent_wire_bytes = 0
+        self.compress_seconds = 0.0
+        self.frames_received = 0
+        self.frames_decompressed = 0
+        self.received_wire_bytes = 0
+        self.received_raw_bytes = 0
+        self.decompress_seconds = 0.0
+
+    def record_sent(self, raw_bytes, wire_bytes, seconds=None):
+        with self.lock:
+            self.frames_sent += 1
+            self.sent_raw_bytes += raw_bytes
+            self.sent_wire_bytes += wire_bytes
+            if seconds is not None:
+                self.frames_compressed += 1
+                self.compress_seconds += seconds
+
+    def record_received(self, wire_bytes, raw_bytes, seconds=None):
+        with self.lock:
+            self.frames_received += 1
+            self.received_wire_bytes += wire_bytes
+            self.received_raw_bytes += raw_bytes
+            if seconds is not None:
+                self.frames_decompressed += 1
+                self.decompress_seconds += seconds
+
+    def stats(self):
+        with self.lock:
+            return {
+                "frames_sent": self.frames_sent,
+                "frames_compressed": self.frames_compressed,
+                "sent_raw_bytes": self.sent_raw_bytes,
+                "sent_wire_bytes": self.sent_wire_bytes,
+                "compress_seconds": round(self.compress_seconds, 6),
+                "frames_received": self.frames_received,
+                "frames_decompressed": self.frames_decompressed,
+                "received_wire_bytes": self.received_wire_bytes,
+                "received_raw_bytes": self.received_raw_bytes,
+                "decompress_seconds": round(self.decompress_seconds, 6),
+            }
+
+class WireCompression:
+    # Compression settings of one side of a connection. codec is what the
+    # peers agreed on ("none" before/without negotiation); level and
+    # min_bytes are local choices, so both sides may use different ones.
+
+    def __init__(self, codec="none", level=1, min_bytes=1 << 16, stats=None):
+        self.codec = codec
+        self.level = level
+        self.min_bytes = min_bytes
+        self.stats = stats if stats is not None else TransferStats()
+
+    def for_codec(self, codec):
+        # the settings of a connection that negotiated codec; stats are shared
+        return WireCompression(codec, self.level, self.min_bytes, self.stats)
+
+    def compress(self, body, flags):
+        if self.codec == "none" or len(body) < self.min_bytes:
+            self.stats.record_sent(len(body), len(body))
+            return body, flags
+        start_time = time.perf_counter()
+        if self.codec == "zlib":
+            compressed = zlib.compress(body, self.level)
+        else:
+            compressed = lzma.compress(body, preset=self.level)
+        elapsed = time.perf_counter() - start_time
+        if len(compressed) >= len(body):
+            # incompressible (e.g. already compressed data): send it raw
+            self.stats.record_sent(len(body), len(body), elapsed)
+            return body, flags
+        self.stats.record_sent(len(body), len(compressed), elapsed)
+        return compressed, flags | COMPRESSION_FLAGS[self.codec]
+
+    def decompress(self, body, flags, max_bytes=None):
+        if not flags & (FLAG_ZLIB | FLAG_LZMA):
+            self.stats.record_received(len(body), len(body))
+            return body, flags
+        start_time = time.perf_counter()
+        raw_body, flags = decompress_body(body, flags, max_bytes)
+        self.stats.record_received(len(body), len(raw_body), time.perf_counter() - start_time)
+        return raw_body, flags
+
+def decompress_body(body, flags, max_bytes=None):
+    # a body that would decompress to more than max_bytes raises ValueError
+    # without being inflated any further, as does a corrupt one
+    if not flags & (FLAG_ZLIB | FLAG_LZMA):
+        return body, flags
+    if max_bytes is None:
+        body = zlib.decompress(body) if flags & FLAG_ZLIB else lzma.decompress(body)
+    else:
+        decompressor = zlib.decompressobj() if flags & FLAG_ZLIB else lzma.LZMADecompressor()
+        try:
+            body = decompressor.decompress(body, max_bytes + 1)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"Corrupt compressed frame body: {e}")
+        if len(body) > max_bytes:
+            raise ValueError(f"Frame body decompresses to more than {max_bytes} bytes")
+        if not decompressor.eof:
+            raise ValueError("Truncated compressed frame body")
+    return body, flags & ~(FLAG_ZLIB | FLAG_LZMA)
+
+def get_wire_compression(config):
+    return WireCompression(config["wire_compression"], config["wire_compression_level"], config["wire_compression_min_bytes"])
+
+class Pickled(bytes):
+    # an already pickled message body (e.g. from a server-side cache);
+    # send_msg sends it as is instead of pickling it again
+    pass
+
+def recv_exactly(sock, size):
+    # read exactly size bytes into a preallocated buffer (no repeated concatenation)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+        received += count
+    return buffer
+
+def encode_frame(body, flags=0):
+    return HEADER.pack(flags, len(body)) + body
+
+def send_frame(sock, body, flags=0, wire=None):
+    if wire is not None:
+        body, flags = wire.compress(body, flags)
+    if len(body) < SMALL_FRAME_SIZE:
+        sock.sendall(encode_frame(body, flags))
+    else:
+        sock.sendall(HEADER.pack(flags, len(body)))
+        sock.sendall(body)
+
+def recv_frame(sock, wire=None):
+    flags, length = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    body = recv_exactly(sock, length)
+    if wire is not None:
+        body, flags = wire.decompress(body, flags)
+    else:
+        body, flags = decompress_body(body, flags)
+    return flags, body
+
+def send_msg(sock, obj, wire=None):
+    if isinstance(obj, Pickled):
+        send_frame(sock, obj, 0, wire)
+    else:
+        send_frame(sock, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 0, wire)
+
+def recv_msg(sock, wire=None):
+    flags, body = recv_frame(sock, wire)
+    if flags & FLAG_CHUNK:
+        raise ValueError("Expected a message frame, received a stream chunk")
+    return pickle.loads(body)
+
+def send_stream(sock, chunks, wire=None):
+    # chunks is any iterable of bytes-like objects
+    send_msg(sock, STREAM_MARKER, wire)
+    for chunk in chunks:
+        if len(chunk):
+            send_frame(sock, chunk, FLAG_CHUNK, wire)
+    send_frame(sock, b"", FLAG_CHUNK)
+
+def recv_stream(sock, wire=None):
+    # generator over the chunks following a STREAM_MARKER reply
+    while True:
+        flags, chunk = recv_frame(sock, wire)
+        if not flags & FLAG_CHUNK:
+            raise ValueError("Expected a stream chunk, received a message frame")
+        if not chunk:
+            return
+        yield chunk
+
+def negotiate_compression(sock, wire):
+    # client side: offer wire.codec and return the settings the server agreed to
+    send_frame(sock, wire.codec.encode(), FLAG_HELLO)
+    flags, body = recv_frame(sock)
+    if not flags & FLAG_HELLO:
+        raise ValueError("Expected a compression negotiation reply")
+    return wire.for_codec(body.decode())
+
+def answer_negotiation(body, wire):
+    # server side: pick wire.codec if the client offered it; returns the
+    # connection's settings and the reply frame
+    offered_codecs = bytes(body).decode().split(",")
+    codec = wire.codec if wire.codec in offered_codecs else "none"
+    return wire.for_codec(codec), encode_frame(codec.encode(), FLAG_HELLO)
+
+def read_file_chunks(file_path, chunk_size=STREAM_CHUNK_SIZE):
+    # file_path may also be an in-memory body (bytes) to stream in chunks
+    if isinstance(file_path, (bytes, bytearray)):
+        for i in range(0, len(file_path), chunk_size):
+            yield file_path[i:i + chunk_size]
+        return
+    with open(file_path, "rb") as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,28 @@
+import threading
+import logging
+
+class HeartbeatSender:
+    # Calls send_func every interval seconds on a background thread while a
+    # task attempt runs, so the master can tell a slow attempt from one whose
+    # worker crashed or hung (which stops sending). A failed send is logged
+    # and retried on the next beat; the task itself keeps running.
+
+    def __init__(self, send_func, interval):
+        self.send_func = send_func
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.send_func()
+            except OSError as e:
+                logging.error(f"Heartbeat to master failed: {e!r}")
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,95 @@
+import os
+import mmap
+import random
+
+# Mapper input is described by byte-range splits over the raw files instead of
+# the file contents themselves. A split is [filename, offset, length]; every
+# mapper gets a list of splits covering about total_bytes / mapper_count bytes.
+#
+# Line ownership follows the usual rule: a split owns every line that *starts*
+# inside [offset, offset + length), including the part of its last line that
+# runs past the end of the range. Together the splits of a file therefore
+# yield each line exactly once.
+
+class DocumentLines(list):
+    # the normalized lines a mapper read from one raw file, and the byte
+    # offset of the (first) split they came from, from which positional map
+    # functions count token positions. A file is one contiguous range of a
+    # mapper's input (or of a map cache block), so positions never overlap
+    # between mappers unless a split holds more tokens than bytes
+
+    def __init__(self, offset=0):
+        super().__init__()
+        self.offset = offset
+
+def compute_input_splits(raw_input_data_path, mapper_count, block_bytes=None):
+    # only file sizes are read, never the contents. With block_bytes, every
+    # file is cut at multiples of block_bytes and mappers get whole blocks
+    # (one split each), so the blocks of an unchanged file stay the same
+    # whatever happens to the rest of the corpus (see scripts/map_cache.py)
+    file_sizes = []
+    for filename in sorted(os.listdir(raw_input_data_path)):
+        file_path = os.path.join(raw_input_data_path, filename)
+        if os.path.isfile(file_path):
+            file_sizes.append((filename, os.path.getsize(file_path)))
+
+    total_bytes = sum(size for _, size in file_sizes)
+    split_size = max(1, -(-total_bytes // mapper_count)) # ceil division
+
+    input_splits = {"mapper" + str(i+1): [] for i in range(mapper_count)}
+    mapper_num = 1
+    mapper_bytes = 0
+    for filename, size in file_sizes:
+        offset = 0
+        while offset < size:
+            if block_bytes:
+                length = min(size - offset, block_bytes - offset % block_bytes)
+            else:
+                length = min(size - offset, split_size - mapper_bytes)
+            input_splits["mapper" + str(mapper_num)].append([filename, offset, length])
+            offset += length
+            mapper_bytes += length
+            if mapper_bytes >= split_size and mapper_num < mapper_count:
+                mapper_num += 1
+                mapper_bytes = 0
+    return input_splits
+
+def read_split_bytes(file_path, offset, length):
+    # bytes of the lines owned by the split, read through mmap
+    with open(file_path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = offset + length
+            if offset == 0:
+                start = 0
+            else:
+                # the line containing offset-1 belongs to the previous split
+                start = mm.find(b"\n", offset - 1) + 1
+                if start == 0 or start >= end:
+                    return b""
+            # finish the line that is still open at the end of the range
+            newline = mm.find(b"\n", end - 1)
+            stop = len(mm) if newline == -1 else newline + 1
+            return mm[start:stop]
+
+def read_split_lines(file_path, offset, length):
+    text = read_split_bytes(file_path, offset, length).decode("utf-8", "ignore")
+    return text.split("\n")
+
+def sample_input_lines(raw_input_data_path, line_count, seed=0):
+    # lines starting at random byte offsets of the raw files, for sampling keys
+    # (e.g. range partition boundaries) without reading the whole corpus
+    rng = random.Random(seed)
+    file_paths = [os.path.join(raw_input_data_path, f) for f in sorted(os.listdir(raw_input_data_path))]
+    file_paths = [f for f in file_paths if os.path.isfile(f) and os.path.getsize(f) > 0]
+    total_bytes = sum(os.path.getsize(f) for f in file_paths)
+
+    sample = []
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        # lines per file in proportion to its size
+        for _ in range(max(1, (line_count * size) // max(total_bytes, 1))):
+            offset = rng.randrange(size)
+            sample.extend(read_split_lines(file_path, offset, 1)[:1])
+    return sample
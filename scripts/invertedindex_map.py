@@ -3,16 +3,21 @@ import logging
 
 def invertedindex_map_init(dataset, mapper_id):
     print(f"[MAPPER - {mapper_id}] Inverted index mapping started...")
-    logging.info(f"[{mapper_id}] Inverted index reducing started...")
+    logging.info(f"[{mapper_id}] Inverted index mapping started...")
 
-    output = defaultdict(set)
+    # token -> doc -> positions. Positions count tokens from the byte offset
+    # of the split the lines were read from (see scripts/input_splits.py)
+    postings = defaultdict(lambda: defaultdict(list))
     for doc in dataset:
+        position = getattr(dataset[doc], "offset", 0)
         for line in dataset[doc]:
-            tokens = line.split()
-            for token in tokens:
-                output["default_mapper_key"].add((token, doc))
-    
-    for key, val in output.items():
-        output[key] = list(val)
-    
-    return output
\ No newline at end of file
+            for token in line.split():
+                postings[token][doc].append(position)
+                position += 1
+
+    # one [doc, positions] posting per document a token occurs in
+    output = {}
+    for token, doc_positions in postings.items():
+        output[token] = [[doc, positions] for doc, positions in doc_positions.items()]
+
+    return output
@@ -4,15 +4,10 @@ def invertedindex_reduce_init(reducer_input, reducer_id):
     print(f"[REDUCER - {reducer_id}] Inverted index reducing started...")
     logging.info(f"[{reducer_id}] Inverted index reducing started...")
 
-    reducer_output = {}
-    for item in reducer_input:
-        token, doc_name = item
-        if token not in reducer_output:
-            reducer_output[token] = set()
-        reducer_output[token].add(doc_name)
-    
-    for key, val in reducer_output.items():
-        reducer_output[key] = list(val)
-    
-    return reducer_output
-
+    # reducer_input yields (token, [doc, positions] postings) in token order;
+    # a document split across mappers has a posting from each of them
+    for token, postings in reducer_input:
+        doc_positions = {}
+        for doc, positions in postings:
+            doc_positions.setdefault(doc, []).extend(positions)
+        yield token, [[doc, sorted(doc_positions[doc])] for doc in sorted(doc_positions)]
@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    # Byte-budgeted LRU cache used by the KV store server.
+    #
+    # Keys are (category, id) tuples. Every entry carries a validator built
+    # from the stat() of the files it was loaded from, so an entry written by
+    # another process (e.g. a set handled in the asyncio process pool) or
+    # removed by cleanup is dropped on the next lookup instead of served stale.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (value, size, validator)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # categories invalidated while a journal is kept (None: all of them),
+        # see start_journal
+        self.journal = None
+        self.journal_start = (0, 0)
+
+    def get(self, key, validator):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, entry_validator = entry
+            if entry_validator != validator:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size, validator):
+        # a cache of max_bytes 0 is disabled
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, validator)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, category):
+        # drop every entry of a category, e.g. after a set of that category
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == category]:
+                self._remove(key)
+                self.invalidations += 1
+            if self.journal is not None:
+                self.journal.add(category)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.current_bytes = 0
+            if self.journal is not None:
+                self.journal.add(None)
+
+    # A request handled in another process (the asyncio process pool) works
+    # on that process's copy of the cache. The copy keeps a journal of the
+    # request's invalidations & lookups, which the server process then
+    # applies to its own cache with apply_journal.
+
+    def start_journal(self):
+        with self.lock:
+            self.journal = set()
+            self.journal_start = (self.hits, self.misses)
+
+    def stop_journal(self):
+        # (invalidated categories, hits, misses) since start_journal
+        with self.lock:
+            journal = (self.journal, self.hits - self.journal_start[0], self.misses - self.journal_start[1])
+            self.journal = None
+            return journal
+
+    def apply_journal(self, journal):
+        categories, hits, misses = journal
+        for category in categories:
+            if category is None:
+                self.clear()
+            else:
+                self.invalidate(category)
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+def file_validator(file_paths):
+    # (path, mtime, size) of every backing file; None if any of them is missing
+    validator = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        validator.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(validator)
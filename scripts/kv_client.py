@@ -0,0 +1,140 @@
+import socket
+import threading
+import logging
+
+from scripts.framing import send_msg, recv_msg, recv_stream, negotiate_compression, WireCompression, STREAM_MARKER
+
+class KVClient:
+    # Pooled client for the KV store shared by the master, mappers, reducers
+    # and the Flask app.
+    #
+    # Connections are opened lazily, kept open across requests and reused, so
+    # a worker pays for TCP setup once per task instead of once per request.
+    # Requests are the same payload tuples the server has always accepted,
+    # e.g. client.request("get", "input", "mapper1").
+    #
+    # With a WireCompression whose codec is not "none", every new connection
+    # negotiates compression with the server first; the transfer stats of all
+    # connections are summed in self.wire.stats.
+    #
+    # With a job_id, every request is sent as ("job", job_id, payload), so the
+    # KV store keeps the objects of each job apart (see kv_store_server).
+
+    def __init__(self, kv_store_addr, pool_size=4, timeout=None, wire=None, job_id=None):
+        self.kv_store_addr = kv_store_addr
+        self.job_id = job_id
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.wire = wire if wire is not None else WireCompression()
+        self.idle_connections = [] # (connection, negotiated WireCompression)
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = socket.create_connection(self.kv_store_addr, timeout=self.timeout)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.wire.codec == "none":
+            return conn, self.wire
+        try:
+            return conn, negotiate_compression(conn, self.wire)
+        except:
+            conn.close()
+            raise
+
+    def _acquire(self):
+        # returns (connection, wire, reused) where reused means it came from the pool
+        with self.lock:
+            if self.idle_connections:
+                return self.idle_connections.pop() + (True,)
+        return self._connect() + (False,)
+
+    def _release(self, conn, wire):
+        with self.lock:
+            if len(self.idle_connections) < self.pool_size:
+                self.idle_connections.append((conn, wire))
+                return
+        conn.close()
+
+    def _send_requests(self, payloads):
+        # write every request, then wait for the first reply; returns (conn, wire, reply)
+        conn, wire, reused = self._acquire()
+        try:
+            for payload in payloads:
+                send_msg(conn, ("job", self.job_id, payload) if self.job_id is not None else payload, wire)
+            return conn, wire, recv_msg(conn, wire)
+        except (ConnectionError, OSError):
+            conn.close()
+            if not reused:
+                raise
+        # the server may have dropped an idle pooled connection; every KV
+        # request is idempotent, so retry once on a fresh connection
+        logging.info(f"Pooled KV connection to {self.kv_store_addr} was stale, reconnecting")
+        conn, wire = self._connect()
+        try:
+            for payload in payloads:
+                send_msg(conn, ("job", self.job_id, payload) if self.job_id is not None else payload, wire)
+            return conn, wire, recv_msg(conn, wire)
+        except:
+            conn.close()
+            raise
+
+    def _exchange(self, payloads):
+        # pipelining: all requests go out before the replies are read in order
+        conn, wire, response = self._send_requests(payloads)
+        try:
+            responses = [response] + [recv_msg(conn, wire) for _ in payloads[1:]]
+        except:
+            conn.close()
+            raise
+
+        if STREAM_MARKER in responses:
+            # streamed replies must be read with stream(); drop the connection
+            # since unread chunks are still pending on it
+            conn.close()
+            raise ValueError("Streamed KV replies must be requested with KVClient.stream()")
+        self._release(conn, wire)
+        return responses
+
+    def request(self, *payload):
+        return self._exchange([payload])[0]
+
+    def pipeline(self, payloads):
+        # several requests on one connection without waiting for each reply
+        return self._exchange(payloads)
+
+    def multi(self, payloads):
+        # several requests in a single message and a single reply
+        return self.request("multi", list(payloads))
+
+    def multi_get(self, keys):
+        # keys: iterable of (category, *args) tuples, e.g. ("input", "mapper1")
+        return self.multi(("get",) + tuple(key) for key in keys)
+
+    def multi_set(self, items):
+        # items: iterable of (category, *args) tuples, e.g. ("reducer-output", id, output)
+        return self.multi(("set",) + tuple(item) for item in items)
+
+    def stream(self, *payload):
+        # generator over the chunks of a streamed reply; yields a regular
+        # reply (e.g. an error string) as is if the server did not stream
+        conn, wire, response = self._send_requests([payload])
+        if response != STREAM_MARKER:
+            self._release(conn, wire)
+            yield response
+            return
+        try:
+            for chunk in recv_stream(conn, wire):
+                yield chunk
+        except:
+            # includes the caller abandoning the generator mid-stream
+            conn.close()
+            raise
+        self._release(conn, wire)
+
+    def transfer_stats(self):
+        return self.wire.stats.stats()
+
+    def close(self):
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, []
+        for conn, _ in idle_connections:
+            conn.close()
@@ -1,197 +1,415 @@
 import socket
+import signal
+import asyncio
 import threading
 import json
-import pickle
 import os
+import sys
 import glob
 import logging
-
-SIZE = 4096
-
-def count_lines_in_dataset(dataset):
-    count = 0
-    for doc in dataset:
-        count += len(dataset[doc])
-    return count
-
-def create_partitioned_dataset(dataset, mapper_count):
-    result_dataset = {}
-    for mapper_num in range(mapper_count):
-        mapper_id = "mapper" + str(mapper_num+1)
-        result_dataset[mapper_id] = {}
-
-    total_lines = count_lines_in_dataset(dataset)
-    mapper_chunk_size = total_lines // mapper_count
-
-    mapper_num = 1
-    mapper_id = "mapper" + str(mapper_num)
-    curr_chunk_size = mapper_chunk_size
-    start = 0
-    mapper_lines_count = 0
-    doc_names = list(dataset.keys())
-
-    i = 0
-    while i < len(doc_names):
-
-        doc = doc_names[i]
-        end = start + curr_chunk_size
-
-        # if end is within doc size limits and this is not the last mapper
-        if end < len(dataset[doc]) and mapper_num != mapper_count:
-            result_dataset[mapper_id][doc] = dataset[doc][start:end]
-            mapper_lines_count += len(dataset[doc][start:end])
-            curr_chunk_size = mapper_chunk_size
-            start = end
-        else:
-            result_dataset[mapper_id][doc] = dataset[doc][start:]
-            curr_chunk_size = mapper_chunk_size - len(dataset[doc][start:])
-            mapper_lines_count += len(dataset[doc][start:])
-            start = 0
-            i += 1
-
-        if mapper_lines_count >= mapper_chunk_size:
-            mapper_num += 1
-            mapper_id = "mapper" + str(mapper_num)
-            mapper_lines_count = 0
-    
-    logging.info("\n\n\n-- [INFO] Partitioned Dataset Summary --")
-    for mapper_id in result_dataset:
-        logging.info(f"\n[{mapper_id}]")
-        logging.info(f"Total lines in mapper: {count_lines_in_dataset(result_dataset[mapper_id])}")
-        logging.info(f"Docs in mapper: {result_dataset[mapper_id].keys()}")
-    logging.info("\n-- End of Partitioned Dataset Summary --\n\n\n")
-        
-    return result_dataset
-
-
-def generate_reducer_input_wordcount(group, config, reducer_id):
-    category_path = config["mapper_output_path"]
-    response = {}
-    for i in range(config["mapper_count"]):
-        filename = "mapper" + str(i+1) + ".json"
-        file_path = os.path.join(category_path, filename)
-        print(f"[KV] Generating {reducer_id} input. Reading mapper input from {file_path}")
-        logging.info(f"Generating {reducer_id} input. Reading mapper input from {file_path}")
-        try:
-            with open(file_path, "r") as fp:
-                curr_mapper_dict = json.load(fp)
-                for key, val in curr_mapper_dict.items():
-                    if key[0].lower() in group:
-                        if key not in response:
-                            response[key] = val
-                        else:
-                            response[key].extend(val)
-        except:
-            response = "INVALID_MAPPER_FILE_PARAMETERS"
-            logging.error(f"[{reducer_id}] INVALID_MAPPER_FILE_PARAMETERS")
-    return response
-
-def generate_reducer_input_invertedindex(group, config, reducer_id):
-    category_path = config["mapper_output_path"]
-    response = []
-    for i in range(config["mapper_count"]):
-        filename = "mapper" + str(i+1) + ".json"
-        file_path = os.path.join(category_path, filename)
-        print(f"[KV] Generating {reducer_id} input. Reading mapper input from {file_path}")
-        logging.info(f"Generating {reducer_id} input. Reading mapper input from {file_path}")
-        try:
-            with open(file_path, "r") as fp:
-                token_to_doc_pairs = json.load(fp)["default_mapper_key"]
-                
-                for item in token_to_doc_pairs:
-                    token, doc_name = item
-                    if token[0].lower() in group:
-                        response.append(item)
-        except:
-            response = "INVALID_MAPPER_FILE_PARAMETERS"
-            logging.error(f"[{reducer_id}] INVALID_MAPPER_FILE_PARAMETERS")
+import pickle
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# make the repo root importable when this file is run directly as a script on a VM
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.framing import recv_frame, send_msg, send_stream, read_file_chunks, encode_frame, answer_negotiation
+from scripts.framing import HEADER, FLAG_CHUNK, FLAG_ZLIB, FLAG_LZMA, FLAG_HELLO, STREAM_MARKER, Pickled
+from scripts.framing import WireCompression
+from scripts.kv_cache import LRUCache, file_validator
+from scripts.input_splits import read_split_bytes
+from scripts.sorted_runs import merge_run_files, iter_record_chunks
+from scripts.storage_codecs import get_record_codec, get_storage_compression, compress_bytes
+from scripts.task_commit import get_attempt_id, COMMITTED, DISCARDED
+from scripts.postings import IndexWriter, IndexReader
+from scripts.final_output import iter_query_output
+from scripts.text_cleanup import get_text_normalizer
+from scripts.map_cache import lookup_cache_entries, restore_cache_entry, store_cache_entry, evict_cache_entries
+
+# decoded & pre-serialized objects served from memory; the byte budget is set
+# from kv_cache_max_bytes when the server starts
+object_cache = LRUCache(0)
+
+# compression offered to clients that negotiate it, and the transfer stats of
+# all connections; set from the wire_compression keys when the server starts
+server_wire = WireCompression()
+
+# the objects of a job are kept under <path>/<job_id> for each of these paths
+JOB_PATH_KEYS = ["input_data_path", "mapper_output_path", "reducer_output_path", "final_output_path"]
+JOB_CONFIG_FILENAME = "job-config.json"
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+
+# memory-mapped final output indexes of this process, by file path:
+# file path -> (validator, IndexReader); reopened when the index is rewritten
+index_readers = {}
+
+def get_run_part_filename(task_id, part_index, config, category, partition=None):
+    # mapperN-partP-K.<codec> for mapper runs, reducerN-K.<codec> for reducer
+    # runs, plus the compression as a second extension (e.g. .binary.zlib)
+    extension = "." + config["storage_codecs"][category]
+    if get_storage_compression(config, category) != "none":
+        extension += "." + get_storage_compression(config, category)
+    if partition is None:
+        return str(task_id) + "-" + str(part_index) + extension
+    return str(task_id) + "-part" + str(partition) + "-" + str(part_index) + extension
+
+def get_commit_marker_path(category_path, task_id):
+    return os.path.join(category_path, "commit-" + str(task_id))
+
+def get_committed_attempts(category_path):
+    # task id -> attempt whose output is the task's output
+    committed_attempts = {}
+    for marker_path in glob.glob(os.path.join(category_path, "commit-*")):
+        if marker_path.endswith(".tmp"):
+            continue
+        with open(marker_path, "r") as fp:
+            committed_attempts[os.path.basename(marker_path)[len("commit-"):]] = int(fp.read())
+    return committed_attempts
+
+def commit_attempt(category_path, task_id, attempt):
+    # the first attempt of a task to commit wins. os.link() fails if the marker
+    # exists, which also holds across the asyncio server's worker processes;
+    # committing the winner again is a no-op, so retried commits are safe
+    marker_path = get_commit_marker_path(category_path, task_id)
+    temp_path = marker_path + "." + str(attempt) + ".tmp"
+    with open(temp_path, "w") as fp:
+        fp.write(str(attempt))
+    try:
+        os.link(temp_path, marker_path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+
+    with open(marker_path, "r") as fp:
+        committed_attempt = int(fp.read())
+    if committed_attempt == attempt:
+        return COMMITTED
+
+    # a slower attempt: its output is never read, so drop it right away
+    attempt_id = get_attempt_id(task_id, attempt)
+    file_paths = glob.glob(os.path.join(category_path, attempt_id + "-*"))
+    file_paths += glob.glob(os.path.join(category_path, "stats-" + attempt_id + ".json"))
+    for file_path in file_paths:
+        os.remove(file_path)
+    print(f"[KV] Discarded {len(file_paths)} files of {attempt_id}, {task_id} was committed by attempt {committed_attempt}")
+    logging.info(f"Discarded {len(file_paths)} files of {attempt_id}, {task_id} was committed by attempt {committed_attempt}")
+    return DISCARDED
+
+def get_commit_category_path(category, config):
+    # the categories whose task output is committed, None for any other
+    category_paths = {"mapper-output": config["mapper_output_path"], "reducer-output": config["reducer_output_path"]}
+    return category_paths.get(category)
+
+def wait_for_commits(category_path, known_task_ids, wait_seconds, poll_interval=0.05):
+    # long poll: task id -> attempt of the committed tasks not in
+    # known_task_ids, as soon as there is one or after wait_seconds
+    deadline = time.time() + wait_seconds
+    while True:
+        committed_attempts = {task_id: attempt for task_id, attempt in get_committed_attempts(category_path).items() if task_id not in known_task_ids}
+        if committed_attempts or time.time() >= deadline:
+            return committed_attempts
+        time.sleep(poll_interval)
+
+def get_partition_run_file_paths(partition, config, task_ids=None):
+    # every run part of every committed mapper attempt (of task_ids, if
+    # given) for one partition
+    file_paths = []
+    for task_id, attempt in sorted(get_committed_attempts(config["mapper_output_path"]).items()):
+        if task_ids is not None and task_id not in task_ids:
+            continue
+        pattern = get_attempt_id(task_id, attempt) + "-part" + str(partition) + "-*"
+        file_paths += sorted(glob.glob(os.path.join(config["mapper_output_path"], pattern)))
+    return file_paths
+
+def write_run_part(file_path, run_bytes, config, category):
+    # run parts arrive encoded with the category's record codec; compression
+    # is applied here, so workers never pay for it
+    try:
+        run_bytes = compress_bytes(run_bytes, get_storage_compression(config, category), config["storage_compression_level"])
+        with open(file_path, "wb") as fp:
+            fp.write(run_bytes)
+        return "STORED\r\n"
+    except:
+        print(f"[KV] Error in writing run to {file_path}. Response: NOT_STORED")
+        logging.error(f"Error in writing run to {file_path}. Response: NOT_STORED")
+        return "NOT_STORED\r\n"
+
+def write_final_output(final_output_file_path, reducer_file_paths, config):
+    # k-way merge of the sorted reducer runs into the final JSON object,
+    # written key by key in the layout of json.dump(..., indent=4). The
+    # postings of invertedindex also go to the positional index next to it,
+    # while the JSON object keeps listing each token's documents
+    codec = get_record_codec(config, "reducer-output")
+    records = merge_run_files(reducer_file_paths, codec, get_storage_compression(config, "reducer-output"))
+    index_writer = None
+    if config["operation_name"] == "invertedindex":
+        index_writer = IndexWriter(get_index_file_path(config))
+    record_count = 0
+    with open(final_output_file_path, "w") as fp:
+        fp.write("{")
+        for key, val in codec.iter_records(records):
+            if index_writer is not None:
+                index_writer.add(key, val)
+                val = [doc_name for doc_name, _ in val]
+            fp.write(("\n" if record_count == 0 else ",\n") + "    " + json.dumps(key) + ": " + json.dumps(val, indent=4).replace("\n", "\n    "))
+            record_count += 1
+        fp.write("\n}" if record_count else "}")
+    if index_writer is not None:
+        index_writer.close()
+    return record_count
+
+def get_index_file_path(config):
+    return os.path.join(config["final_output_path"], "final-output-" + config["operation_name"] + ".index")
+
+def get_index_reader(file_path):
+    validator = file_validator([file_path])
+    if validator is None:
+        return None
+    cached = index_readers.get(file_path)
+    if cached is not None and cached[0] == validator:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    index_readers[file_path] = (validator, IndexReader(file_path))
+    return index_readers[file_path][1]
+
+def query_index(index_reader, query_type, terms, config):
+    # terms are normalized like the mapper input, so queries match the
+    # tokens the index was built from
+    normalizer = get_text_normalizer(config)
+    tokens = [token for line in normalizer.normalize_bytes(" ".join(terms).encode("utf-8")) for token in line.split()]
+    if query_type == "and":
+        return {"terms": tokens, "documents": index_reader.all_of(tokens)}
+    if query_type == "or":
+        return {"terms": tokens, "documents": index_reader.any_of(tokens)}
+    if query_type == "phrase":
+        return {"terms": tokens, "matches": index_reader.phrase(tokens)}
+    if query_type == "prefix":
+        # a prefix may end in the middle of a token, so it is only lowercased
+        prefix = " ".join(terms).strip().lower()
+        return {"prefix": prefix, "terms": index_reader.prefix(prefix, config["query_prefix_limit"])}
+    return "[KV] CLIENT_ERROR Invalid Query Type\r\n"
+
+def iter_response_chunks(response_stream):
+    # a streamed reply is a file path, an in-memory body or an iterator of chunks
+    if isinstance(response_stream, (str, bytes, bytearray)):
+        return read_file_chunks(response_stream)
+    return response_stream
+
+def load_json_cached(category, file_path):
+    # decoded contents of a stored JSON file, re-read only when the file changed
+    validator = file_validator([file_path])
+    value = object_cache.get((category, file_path), validator) if validator else None
+    if value is None:
+        with open(file_path, "r") as fp:
+            value = json.load(fp)
+        if validator:
+            # the file size is used as the (approximate) cost of the decoded object
+            object_cache.put((category, file_path), value, validator[0][2], validator)
+    return value
+
+def get_preserialized(key, file_paths, build_response):
+    # pickled response for key, rebuilt only when one of file_paths changed;
+    # error strings are returned as is and never cached
+    validator = file_validator(file_paths)
+    if validator is not None:
+        response = object_cache.get(key, validator)
+        if response is not None:
+            return response
+    response = build_response()
+    if validator is None or isinstance(response, str):
+        return response
+    response = Pickled(pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL))
+    object_cache.put(key, response, len(response), validator)
     return response
 
-def client_handler(conn, client_addr, config):
-    print(f"[KV] Client {client_addr} has connected.")
-    logging.info(f"Client {client_addr} has connected.")
+def generate_skew_report(config):
+    # keys, records and bytes routed to each partition, summed over the
+    # per-mapper stats written alongside the partition files
+    # (keys are distinct per mapper, so a key seen by two mappers counts twice)
+    report = []
+    for partition in range(config["reducer_count"]):
+        report.append({"partition": partition, "keys": 0, "records": 0, "bytes": 0})
+
+    for task_id, attempt in sorted(get_committed_attempts(config["mapper_output_path"]).items()):
+        filename = "stats-" + get_attempt_id(task_id, attempt) + ".json"
+        mapper_stats = load_json_cached("mapper-stats", os.path.join(config["mapper_output_path"], filename))
+        for partition, partition_stats in enumerate(mapper_stats):
+            for field in ["keys", "records", "bytes"]:
+                report[partition][field] += partition_stats[field]
+    return report
+
+def get_job_config(config, job_id):
+    # config of the requests of a job: the config the job registered with
+    # "start-job", with this host's paths & KV server settings, and the job's
+    # own directories
+    job_config = dict(config)
+    try:
+        registered_config = load_json_cached("job-config", os.path.join(config["final_output_path"], job_id, JOB_CONFIG_FILENAME))
+    except OSError:
+        registered_config = {}
+    for key, val in registered_config.items():
+        if not key.endswith("_path") and not key.startswith(("kv_", "wire_")):
+            job_config[key] = val
+    for key in JOB_PATH_KEYS:
+        job_config[key] = os.path.join(config[key], job_id)
+    job_config["job_id"] = job_id
+    return job_config
+
+def get_job_dirs(config):
+    # job id -> its directories on this host
+    job_dirs = {}
+    for key in JOB_PATH_KEYS:
+        for dir_path in glob.glob(os.path.join(config[key], "*")):
+            if os.path.isdir(dir_path):
+                job_dirs.setdefault(os.path.basename(dir_path), []).append(dir_path)
+    return job_dirs
+
+def expire_jobs(config, current_job_id):
+    # retention: deletes the jobs last changed more than
+    # kv_job_retention_seconds ago, and the finished jobs (those with a final
+    # output) beyond the kv_job_retention_count most recent ones. Running
+    # jobs keep changing their directories, so they are never deleted
+    now = time.time()
+    job_dirs = get_job_dirs(config)
+    expired_job_ids = []
+    finished_jobs = []
+    for job_id, dir_paths in job_dirs.items():
+        if job_id == current_job_id:
+            continue
+        changed = max(os.path.getmtime(dir_path) for dir_path in dir_paths)
+        if now - changed > config["kv_job_retention_seconds"]:
+            expired_job_ids.append(job_id)
+        elif glob.glob(os.path.join(config["final_output_path"], job_id, "final-output-*.json")):
+            finished_jobs.append((changed, job_id))
+    finished_jobs.sort(reverse=True)
+    expired_job_ids += [job_id for _, job_id in finished_jobs[config["kv_job_retention_count"]:]]
+    for job_id in expired_job_ids:
+        for dir_path in job_dirs[job_id]:
+            shutil.rmtree(dir_path, ignore_errors=True)
+    if expired_job_ids:
+        print(f"[KV] Deleted the data of expired jobs {expired_job_ids}")
+        logging.info(f"Deleted the data of expired jobs {expired_job_ids}")
+    return expired_job_ids
+
+def start_job(config, job_id, registered_config):
+    # creates the job's directories and records its config (operation,
+    # partitioner, codecs, ...) for its requests, then applies the retention
+    # policy to the other jobs
+    for key in JOB_PATH_KEYS:
+        os.makedirs(os.path.join(config[key], job_id), exist_ok=True)
+    file_path = os.path.join(config["final_output_path"], job_id, JOB_CONFIG_FILENAME)
+    with open(file_path + ".tmp", "w") as fp:
+        json.dump(registered_config, fp)
+    os.replace(file_path + ".tmp", file_path)
+    expire_jobs(config, job_id)
+    return "STORED\r\n"
+
+def remove_contents(dir_path, pattern="*"):
+    for file_path in glob.glob(os.path.join(dir_path, pattern)):
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path, ignore_errors=True)
+        else:
+            os.remove(file_path)
+
+def get_final_output_file_path(config, filename):
+    # the job's own file; for requests not scoped to a job, the newest one of
+    # any job (or of the unscoped final output directory)
+    file_path = os.path.join(config["final_output_path"], filename)
+    if config["job_id"] is not None:
+        return file_path
+    file_paths = [path for path in glob.glob(os.path.join(config["final_output_path"], "*", filename)) + [file_path] if os.path.exists(path)]
+    return max(file_paths, key=os.path.getmtime) if file_paths else file_path
+
+def handle_request(payload, client_addr, config):
     response = "DONE"
-
-    serialized_msg = b""
-    while True:
-        packet = conn.recv(SIZE)
-        serialized_msg += packet
-
-        if b"ENDOFDATA" in packet:
-            logging.info(f"ENDOFDATA received. Breaking...")
-            break
-
-    serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-    payload = pickle.loads(serialized_msg)
+    # set instead of response for streamed replies: a file path or in-memory bytes
+    response_stream = None
+
+    if payload[0] == "job":
+        # a request of one job: ("job", job_id, payload). Its objects live in
+        # a directory named after the job under each of JOB_PATH_KEYS
+        job_id, job_payload = payload[1:3]
+        if not isinstance(job_id, str) or not JOB_ID_PATTERN.match(job_id):
+            return "[KV] CLIENT_ERROR Invalid Job Id\r\n", None
+        if job_payload[0] == "start-job":
+            print(f"[KV] Job {job_id} started by client {client_addr}")
+            logging.info(f"Job {job_id} started by client {client_addr}")
+            return start_job(config, job_id, job_payload[1]), None
+        return handle_request(job_payload, client_addr, get_job_config(config, job_id))
+
+    if payload[0] == "multi":
+        # a batch of requests answered with one list of responses
+        print(f"[KV] Batch of {len(payload[1])} requests received from client {client_addr}")
+        logging.info(f"Batch of {len(payload[1])} requests received from client {client_addr}")
+        response = []
+        for sub_payload in payload[1]:
+            sub_response, sub_file_path = handle_request(sub_payload, client_addr, config)
+            if sub_file_path is not None:
+                sub_response = "[KV] CLIENT_ERROR Streamed replies cannot be batched\r\n"
+            elif isinstance(sub_response, Pickled):
+                # a cached reply goes into the batch's reply as the object it encodes
+                sub_response = pickle.loads(sub_response)
+            response.append(sub_response)
+        return response, response_stream
 
     print(f"[KV] Command & category received from client {client_addr}:\n", payload[:2])
     logging.info(f"Command & category received from client {client_addr}: {payload[:2]}")
 
     if payload[0] == "set":
         category = payload[1] # input/mapper/reducer
+        object_cache.invalidate(category)
         
         if category == "input":
-            dataset = payload[2]
-            mapper_count = payload[3]
-            logging.info(f"set input's mapper count: {mapper_count}")
-            partitioned_dataset = create_partitioned_dataset(dataset, mapper_count)
-
+            # byte-range split descriptors per mapper, not the data itself
+            input_splits = payload[2]
             category_path = config["input_data_path"]
 
-            # open file for writing, create file if doesn't exist
-            for mapper_id in partitioned_dataset:
-            
+            for mapper_id in input_splits:
                 filename = "input-" + str(mapper_id) + ".json"
                 file_path = os.path.join(category_path, filename)
-                print(f"[KV] Generating {mapper_id} input & writing to {file_path}")
-                logging.info(f"Generating {mapper_id} input & writing to {file_path}")
-                with open(file_path, 'w') as fp:
-                    try:
-                        json.dump(partitioned_dataset[mapper_id], fp, indent=4)
-                        response = "STORED\r\n"
-                    except:
-                        response = "NOT_STORED\r\n"
-                        print(f"[KV] Error in writing mapper input to {file_path}. Response: {response}")
-                        logging.error(f"Error in writing mapper input to {file_path}. Response: {response}")
+                print(f"[KV] Writing {mapper_id} input splits to {file_path}")
+                logging.info(f"Writing {mapper_id} input splits to {file_path}")
+                try:
+                    with open(file_path, 'w') as fp:
+                        json.dump(input_splits[mapper_id], fp)
+                    response = "STORED\r\n"
+                except:
+                    response = "NOT_STORED\r\n"
+                    print(f"[KV] Error in writing mapper input to {file_path}. Response: {response}")
+                    logging.error(f"Error in writing mapper input to {file_path}. Response: {response}")
 
         elif category == "mapper-output":
-            mapper_id = payload[2]
-            mapper_output = payload[3]
-
-            category_path = config["mapper_output_path"]
-
-            filename = str(mapper_id) + ".json"
-            file_path = os.path.join(category_path, filename)
-            print(f"[KV] Generating {mapper_id} output & writing to {file_path}")
-            logging.info(f"Generating {mapper_id} output & writing to {file_path}")
-
+            # one part of the sorted run a mapper produced for a partition
+            mapper_id, partition, part_index, run_bytes, attempt = payload[2:7]
+            filename = get_run_part_filename(get_attempt_id(mapper_id, attempt), part_index, config, category, partition)
+            file_path = os.path.join(config["mapper_output_path"], filename)
+            logging.info(f"Writing {len(run_bytes)} bytes of {mapper_id} partition {partition} run to {file_path}")
+            response = write_run_part(file_path, run_bytes, config, category)
+
+        elif category == "mapper-stats":
+            # keys, records and bytes per partition, for the skew report
+            mapper_id, mapper_stats, attempt = payload[2:5]
+            file_path = os.path.join(config["mapper_output_path"], "stats-" + get_attempt_id(mapper_id, attempt) + ".json")
             try:
                 with open(file_path, 'w') as fp:
-                    json.dump(mapper_output, fp)
-                    response = "STORED\r\n"
+                    json.dump(mapper_stats, fp)
+                response = "STORED\r\n"
             except:
                 response = "NOT_STORED\r\n"
-                print(f"[KV] Error in writing mapper_output to {file_path}. Response: {response}")
-                logging.info(f"Error in writing mapper_output to {file_path}. Response: {response}")
+                print(f"[KV] Error in writing {mapper_id} stats to {file_path}. Response: {response}")
+                logging.error(f"Error in writing {mapper_id} stats to {file_path}. Response: {response}")
 
         elif category == "reducer-output":
-            reducer_id = payload[2]
-            reducer_output = payload[3]
-
-            category_path = config["reducer_output_path"]
-            filename = str(reducer_id) + ".json"
-            file_path = os.path.join(category_path, filename)
-            print(f"[KV] Generating {reducer_id} output & writing to {file_path}")
-            logging.info(f"Generating {reducer_id} output & writing to {file_path}")
-
-            try:
-                with open(file_path, 'w') as fp:
-                    json.dump(reducer_output, fp)
-                    response = "STORED\r\n"
-            except:
-                response = "NOT_STORED\r\n"
-                print(f"[KV] Error in writing reducer output to {file_path}. Response: {response}")
-                logging.error(f"Error in writing reducer output to {file_path}. Response: {response}")
+            # one part of a reducer's sorted output run
+            reducer_id, part_index, run_bytes, attempt = payload[2:6]
+            file_path = os.path.join(config["reducer_output_path"], get_run_part_filename(get_attempt_id(reducer_id, attempt), part_index, config, category))
+            print(f"[KV] Writing {reducer_id} output part {part_index} to {file_path}")
+            logging.info(f"Writing {reducer_id} output part {part_index} to {file_path}")
+            response = write_run_part(file_path, run_bytes, config, category)
 
         
     elif payload[0] == "get":
@@ -207,110 +425,398 @@ def client_handler(conn, client_addr, config):
             file_path = os.path.join(category_path, filename)
             print(f"[KV] Retrieving {mapper_id} input from {file_path}")
             logging.info(f"Retrieving {mapper_id} input from {file_path}")
-            try:
+            def load_mapper_input():
                 with open(file_path, "r") as fp:
-                    response = json.load(fp)
+                    return json.load(fp)
+            try:
+                response = get_preserialized(("input", file_path), [file_path], load_mapper_input)
             except:
                 response = "INVALID_MAPPER_ID"
                 print(f"[KV] Error in retrieving mapper input from {file_path}. Response: {response}")
                 logging.error(f"Error in retrieving mapper input from {file_path}. Response: {response}")
             
+        elif category == "input-range":
+            # ranged read of a raw input file for mappers that don't have a local copy
+            filename, offset, length = payload[2:5]
+            file_path = os.path.join(config["mapper_raw_input_data_path"], os.path.basename(filename))
+            logging.info(f"Reading {length} bytes at offset {offset} of {file_path}")
+            try:
+                response = read_split_bytes(file_path, offset, length)
+            except:
+                response = "INVALID_INPUT_RANGE"
+                logging.error(f"Error in reading input range of {file_path}. Response: {response}")
+
         elif category == "mapper-output":
-            group = set(payload[2])
+            partition = payload[2]
             reducer_id = payload[3]
-            print(f"\n[KV] Alphabet group for {reducer_id}: {group}\n")
-            logging.info(f"Alphabet group for {reducer_id}: {group}\n")
-
-            if config["operation_name"] == "wordcount":
-                response = generate_reducer_input_wordcount(group, config, reducer_id)
-            elif config["operation_name"] == "invertedindex":
-                response = generate_reducer_input_invertedindex(group, config, reducer_id)
-            else:
-                response = "INVALID_OPERATION_NAME"
-                print(f"[KV] Error in retrieving mapper output from {file_path}. Response: {response}")
-                logging.error(f"Error in retrieving mapper output from {file_path}. Response: {response}")
+            # a pipelined reducer fetches one committed mapper's run at a time
+            task_ids = [payload[4]] if len(payload) > 4 else None
+            print(f"\n[KV] Partition for {reducer_id}: {partition}\n")
+            logging.info(f"Partition for {reducer_id}: {partition} (mappers: {task_ids or 'all'})\n")
+
+            # stream a k-way merge of the mapper runs of the partition, so
+            # neither side ever holds the whole partition in memory
+            file_paths = get_partition_run_file_paths(partition, config, task_ids)
+            logging.info(f"Merging {len(file_paths)} runs for {reducer_id}: {file_paths}")
+            # records are streamed in the mapper-output record codec, uncompressed
+            codec = get_record_codec(config, "mapper-output")
+            records = merge_run_files(file_paths, codec, get_storage_compression(config, "mapper-output"))
+            response_stream = iter_record_chunks(records)
         
-        elif category == "final-output":
-            operation = payload[2]
-            category_path = config["final_output_path"]
-            filename = "final-output-" + str(operation) + ".json"
-            file_path = os.path.join(category_path, filename)
-            logging.info(f"Retrieving {filename} from {category_path}")
+        elif category == "committed":
+            # tasks committed since the client's last poll, for pipelined reducers
+            commit_category, known_task_ids, wait_seconds = payload[2:5]
+            category_path = get_commit_category_path(commit_category, config)
+            if category_path is None:
+                response = "[KV] CLIENT_ERROR Invalid Commit Category\r\n"
+            else:
+                response = wait_for_commits(category_path, set(known_task_ids), wait_seconds)
 
+        elif category == "skew-report":
             try:
-                with open(file_path, "r") as fp:
-                    response = json.load(fp)
+                response = generate_skew_report(config)
             except:
+                response = "SKEW_REPORT_ERROR"
+                logging.error(f"Error in generating partition skew report. Response: {response}")
+
+        elif category == "final-output":
+            # operation None: the job's own operation
+            operation = payload[2] or config["operation_name"]
+            # optional filters, see scripts/final_output.py
+            query = payload[3] if len(payload) > 3 else None
+            filename = "final-output-" + str(operation) + ".json"
+            file_path = get_final_output_file_path(config, filename)
+            logging.info(f"Retrieving {file_path}" + (f" for query {query}" if query else ""))
+
+            # stream the stored JSON as is instead of parsing & re-pickling it,
+            # from memory when it fits in the cache
+            validator = file_validator([file_path])
+            if validator is None:
                 response = "File not found."
+            elif query:
+                # matching records are read from the file as they are sent
+                response_stream = iter_query_output(file_path, query)
+            elif validator[0][2] > object_cache.max_bytes:
+                response_stream = file_path
+            else:
+                response_stream = object_cache.get(("final-output", file_path), validator)
+                if response_stream is None:
+                    with open(file_path, "rb") as fp:
+                        response_stream = fp.read()
+                    object_cache.put(("final-output", file_path), response_stream, len(response_stream), validator)
+
+        elif category == "index-query":
+            # term lookups on the memory-mapped index of the final output
+            operation, query_type, terms = payload[2:5]
+            file_path = get_final_output_file_path(config, "final-output-" + str(operation or config["operation_name"]) + ".index")
+            logging.info(f"{query_type} query for {terms} on {file_path}")
+            index_reader = get_index_reader(file_path)
+            if index_reader is None:
+                response = "File not found."
+            else:
+                response = query_index(index_reader, query_type, terms, config)
+
+        elif category == "cache-stats":
+            response = object_cache.stats()
+
+        elif category == "transfer-stats":
+            response = server_wire.stats.stats()
             
     elif payload[0] == "combine":
         category = payload[1]
+        object_cache.invalidate(category)
         if category == "final-output":
             category_path = config["final_output_path"]
             
-            final_output = {}
-            reducer_file_paths = glob.glob(os.path.join(config["reducer_output_path"], "reducer*.json"))
+            reducer_file_paths = []
+            for task_id, attempt in sorted(get_committed_attempts(config["reducer_output_path"]).items()):
+                reducer_file_paths += glob.glob(os.path.join(config["reducer_output_path"], get_attempt_id(task_id, attempt) + "-*"))
             print(f"\n[KV] Combining reducer output files into a single file. Reading below reducer files:\n{reducer_file_paths}\n")
             logging.info(f"Combining reducer output files into a single file. Reading below reducer files:\n{reducer_file_paths}\n")
-            for reducer_file in reducer_file_paths:
-                try:
-                    with open(reducer_file, "r") as fp:
-                        curr_reducer_output = json.load(fp)
-                        for key, val in curr_reducer_output.items():
-                            final_output[key] = val
-                except:
-                    response = "REDUCER_OUTPUT_READ_ERROR"
-                    print(f"[KV] Error in combining reducer output files. Read error for {file_path}. Response: {response}")
-                    logging.error(f"Error in combining reducer output files. Read error for {file_path}. Response: {response}")
 
-
-            final_output = dict(sorted(final_output.items()))
             final_output_filename = "final-output-" + config["operation_name"] + ".json"
             final_output_file_path = os.path.join(category_path, final_output_filename)
             try:
-                with open(final_output_file_path, "w") as fp:
-                    json.dump(final_output, fp, indent=4)
-                    response = "STORED\r\n"
+                record_count = write_final_output(final_output_file_path, reducer_file_paths, config)
+                logging.info(f"Wrote {record_count} keys to {final_output_file_path}")
+                response = "STORED\r\n"
             except:
                 response = "NOT_STORED\r\n"
-                print(f"[KV] Error in combining reducer output files. Error while writing to file {file_path}. Response: {response}")
-                logging.info(f"Error in combining reducer output files. Error while writing to file {file_path}. Response: {response}")
+                print(f"[KV] Error in combining reducer output files into {final_output_file_path}. Response: {response}")
+                logging.error(f"Error in combining reducer output files into {final_output_file_path}. Response: {response}")
+
+    elif payload[0] == "commit":
+        # make one attempt's output the task's output (first commit wins)
+        category, task_id, attempt = payload[1:4]
+        category_path = get_commit_category_path(category, config)
+        if category_path is not None:
+            try:
+                response = commit_attempt(category_path, task_id, attempt)
+            except:
+                response = "COMMIT_ERROR\r\n"
+                logging.error(f"Error in committing attempt {attempt} of {task_id}. Response: {response}")
+        else:
+            response = "[KV] CLIENT_ERROR Invalid Commit Category\r\n"
+
+    elif payload[0] == "map-cache":
+        # cached output of input blocks (see scripts/map_cache.py):
+        #   ("map-cache", "lookup", keys)                                      -> cached keys
+        #   ("map-cache", "restore", mapper_id, attempt, block_tag, key)       -> block stats or None
+        #   ("map-cache", "store", mapper_id, attempt, block_tag, key, stats)  -> STORED
+        operation = payload[1]
+        try:
+            if operation == "lookup":
+                response = lookup_cache_entries(config, payload[2])
+            elif operation == "restore":
+                mapper_id, attempt, block_tag, key = payload[2:6]
+                object_cache.invalidate("mapper-output")
+                response = restore_cache_entry(config, get_attempt_id(mapper_id, attempt), block_tag, key)
+                logging.info(f"Map cache {'hit' if response is not None else 'miss'} for {mapper_id} block {block_tag} ({key})")
+            elif operation == "store":
+                mapper_id, attempt, block_tag, key, block_stats = payload[2:7]
+                store_cache_entry(config, get_attempt_id(mapper_id, attempt), block_tag, key, block_stats)
+                response = "STORED\r\n"
+            else:
+                response = "[KV] CLIENT_ERROR Invalid Map Cache Operation\r\n"
+        except:
+            response = "MAP_CACHE_ERROR\r\n"
+            logging.exception(f"Error in map cache {operation} request")
 
     elif payload[0] == "cleanup":
+        # "all": any previous data of the job (of every job when not scoped to
+        # one); "intermediate": the job's input splits and mapper & reducer
+        # output, once its final output is written
+        category = payload[1]
+        if category == "intermediate":
+            for key in ["input_data_path", "mapper_output_path", "reducer_output_path"]:
+                remove_contents(config[key])
+            logging.info(f"Intermediate files of job {config['job_id']} deleted")
+            return response, response_stream
+
         print("\n[KV] Cleaning up KV Store's data from previous runs\n")
         logging.info("Cleaning up KV Store's data from previous runs\n")
-        # delete any previous mapper input files
-        folder_files = glob.glob(os.path.join(config["input_data_path"], "*"))
-        for f in folder_files:
-            os.remove(f)
-
-        # delete any previous mapper output files if present
-        folder_files = glob.glob(os.path.join(config["mapper_output_path"], "*"))
-        for f in folder_files:
-            os.remove(f)
-
-        # delete any previous reducer output files if present
-        folder_files = glob.glob(os.path.join(config["reducer_output_path"], "*"))
-        for f in folder_files:
-            os.remove(f)
+        logging.info(f"Object cache stats before cleanup: {object_cache.stats()}")
+        object_cache.clear()
+        # delete any previous mapper input, mapper output & reducer output files
+        for key in ["input_data_path", "mapper_output_path", "reducer_output_path"]:
+            remove_contents(config[key])
 
         # delete any previous final output files if present
-        curr_operation_pattern = "final-output-" + config["operation_name"] + "*.json"
-        folder_files = glob.glob(os.path.join(config["final_output_path"], curr_operation_pattern))
-        for f in folder_files:
-            os.remove(f)
+        curr_operation_pattern = "final-output-" + config["operation_name"] + ".*"
+        remove_contents(config["final_output_path"], curr_operation_pattern)
+
+        # the map cache is kept across jobs, within its size limit
+        if config["map_cache"]:
+            evict_cache_entries(config)
 
         print("\n[KV] All intermediate files from previous sessions cleaned\n")
         logging.info("All intermediate files from previous sessions cleaned\n")
     else:
         response = "[KV] CLIENT_ERROR Invalid Command Received\r\n"
 
-    conn.send(pickle.dumps(response) + b"ENDOFDATA")
+    return response, response_stream
+
+def client_handler(conn, client_addr, config):
+    print(f"[KV] Client {client_addr} has connected.")
+    logging.info(f"Client {client_addr} has connected.")
+
+    # connections are persistent: serve requests until the client hangs up
+    # (KVClient keeps pooled connections open across requests and pipelines them)
+    request_count = 0
+    wire = server_wire
+    while True:
+        try:
+            flags, body = recv_frame(conn, wire)
+        except (ConnectionError, OSError):
+            break
+
+        if flags & FLAG_HELLO:
+            # compression negotiation, answered on the connection itself
+            wire, reply = answer_negotiation(body, server_wire)
+            conn.sendall(reply)
+            logging.info(f"Negotiated {wire.codec} wire compression with {client_addr}")
+            continue
+
+        payload = pickle.loads(body)
+        response, response_stream = handle_request(payload, client_addr, config)
+        if response_stream is not None:
+            send_stream(conn, iter_response_chunks(response_stream), wire)
+        else:
+            send_msg(conn, response, wire)
+        request_count += 1
     
-    print(f"[KV] Connection to {client_addr} closed.")
+    print(f"[KV] Connection to {client_addr} closed after {request_count} requests.")
+    logging.info(f"Connection to {client_addr} closed after {request_count} requests.")
     conn.close()
 
-def start_kv_server(config):
+def process_request(body, client_addr, config):
+    # asyncio mode: decode, execute and encode one request away from the event
+    # loop (in the process pool for large requests); streamed replies only
+    # answer small get requests, so their iterators never cross processes
+    payload = pickle.loads(body)
+    response, response_stream = handle_request(payload, client_addr, config)
+    if response_stream is not None:
+        return None, response_stream
+    if isinstance(response, Pickled):
+        return bytes(response), None
+    return pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL), None
+
+def init_offload_worker():
+    # process pool workers start with a copy of the server's cache, which the
+    # server goes on changing: they don't cache at all, and their
+    # invalidations & lookups go back to the server (see offload_request)
+    object_cache.clear()
+    object_cache.max_bytes = 0
+
+def offload_request(body, client_addr, config):
+    # process_request in a process pool worker; also returns the journal of
+    # the worker's cache for the server's cache
+    object_cache.start_journal()
+    try:
+        response_body, response_stream = process_request(body, client_addr, config)
+    except Exception as e:
+        # answered here, so the journal of a failed request still gets back
+        logging.error(f"Error while processing request from {client_addr}: {e!r}")
+        response_body, response_stream = pickle.dumps(f"[KV] SERVER_ERROR {e!r}\r\n"), None
+    return response_body, response_stream, object_cache.stop_journal()
+
+def encode_chunk_frame(chunk, wire):
+    body, flags = wire.compress(chunk, FLAG_CHUNK)
+    return encode_frame(body, flags)
+
+def next_chunk_frame(chunks, wire):
+    # next chunk of a streamed reply as an encoded frame, None at the end
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    return encode_chunk_frame(chunk, wire)
+
+async def async_encode_frame(body, flags, wire):
+    # compression is CPU work (zlib and lzma release the GIL while they run),
+    # so large bodies are compressed in a thread instead of the event loop
+    if wire.codec != "none" and len(body) >= wire.min_bytes:
+        body, flags = await asyncio.get_running_loop().run_in_executor(None, wire.compress, body, flags)
+    else:
+        body, flags = wire.compress(body, flags)
+    return encode_frame(body, flags)
+
+async def async_send_stream(writer, response_stream, wire):
+    loop = asyncio.get_running_loop()
+    writer.write(encode_frame(pickle.dumps(STREAM_MARKER)))
+    if isinstance(response_stream, (bytes, bytearray)):
+        # cached body: already in memory
+        for chunk in read_file_chunks(response_stream):
+            writer.write(await async_encode_frame(chunk, FLAG_CHUNK, wire))
+            await writer.drain()
+        writer.write(encode_frame(b"", FLAG_CHUNK))
+        return
+    # file reads, merges and compression block, so every chunk is produced in a thread
+    chunks = iter_response_chunks(response_stream)
+    while True:
+        frame = await loop.run_in_executor(None, next_chunk_frame, chunks, wire)
+        if frame is None:
+            break
+        writer.write(frame)
+        # wait for slow readers instead of buffering the whole reply
+        await writer.drain()
+    writer.write(encode_frame(b"", FLAG_CHUNK))
+
+async def async_client_handler(reader, writer, config, executor, request_slots):
+    loop = asyncio.get_running_loop()
+    client_addr = writer.get_extra_info("peername")
+    logging.info(f"Client {client_addr} has connected.")
+
+    # requests on one connection are answered in order (pipelining), requests
+    # on different connections run concurrently
+    request_count = 0
+    wire = server_wire
+    try:
+        while True:
+            try:
+                flags, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+
+            if length > config["kv_max_request_bytes"]:
+                # refuse oversized requests before buffering their body
+                response = f"[KV] CLIENT_ERROR Request of {length} bytes exceeds kv_max_request_bytes\r\n"
+                logging.error(f"Rejected request of {length} bytes from {client_addr}")
+                writer.write(encode_frame(pickle.dumps(response)))
+                await writer.drain()
+                break
+
+            if flags & FLAG_HELLO:
+                # compression negotiation, answered on the connection itself
+                wire, reply = answer_negotiation(await reader.readexactly(length), server_wire)
+                writer.write(reply)
+                await writer.drain()
+                logging.info(f"Negotiated {wire.codec} wire compression with {client_addr}")
+                continue
+
+            # backpressure: while all request slots are busy, request bodies stay
+            # unread in the socket buffers and TCP slows the clients down
+            async with request_slots:
+                body = await reader.readexactly(length)
+                if flags & (FLAG_ZLIB | FLAG_LZMA):
+                    # the limit holds for the decompressed body too
+                    try:
+                        body, flags = await loop.run_in_executor(None, wire.decompress, body, flags, config["kv_max_request_bytes"])
+                    except ValueError as e:
+                        response = f"[KV] CLIENT_ERROR Request of {length} compressed bytes rejected: {e}\r\n"
+                        logging.error(f"Rejected compressed request of {length} bytes from {client_addr}: {e}")
+                        writer.write(encode_frame(pickle.dumps(response)))
+                        await writer.drain()
+                        break
+                else:
+                    wire.stats.record_received(len(body), len(body))
+                # small requests are cheap to decode; large ones go to the process pool
+                try:
+                    if len(body) >= config["kv_offload_min_bytes"]:
+                        response_body, response_stream, journal = await loop.run_in_executor(executor, offload_request, body, client_addr, config)
+                        object_cache.apply_journal(journal)
+                    else:
+                        response_body, response_stream = await loop.run_in_executor(None, process_request, body, client_addr, config)
+                except Exception as e:
+                    logging.error(f"Error while processing request from {client_addr}: {e!r}")
+                    response_body, response_stream = pickle.dumps(f"[KV] SERVER_ERROR {e!r}\r\n"), None
+
+            if response_stream is not None:
+                await async_send_stream(writer, response_stream, wire)
+            else:
+                writer.write(await async_encode_frame(response_body, 0, wire))
+            await writer.drain()
+            request_count += 1
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        logging.info(f"Connection to {client_addr} closed after {request_count} requests.")
+        writer.close()
+
+async def serve_kv_async(config, kv_store_addr):
+    executor = ProcessPoolExecutor(config["kv_process_pool_workers"] or None, initializer=init_offload_worker)
+    request_slots = asyncio.Semaphore(config["kv_max_inflight_requests"])
+    # one thread per request slot, so long polls (which wait in a thread)
+    # never hold up the other requests
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(config["kv_max_inflight_requests"]))
+
+    def on_connect(reader, writer):
+        return async_client_handler(reader, writer, config, executor, request_slots)
+
+    server = await asyncio.start_server(on_connect, kv_store_addr[0], kv_store_addr[1], reuse_address=True, backlog=4096)
+    print(f"[KV] Server listening for connections at address {kv_store_addr[0]}:{kv_store_addr[1]} (asyncio)")
+    logging.info(f"Server listening for connections at address {kv_store_addr[0]}:{kv_store_addr[1]} (asyncio)")
+
+    # stop cleanly on SIGTERM so the process pool workers are not orphaned
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def start_kv_server(config, kv_store_ip=None):
 
     # initialize logging configurations
     logging.basicConfig(
@@ -321,13 +827,27 @@ def start_kv_server(config):
         level=logging.DEBUG
         )
 
-    kv_store_ip = socket.gethostbyname(socket.gethostname())
+    object_cache.max_bytes = config["kv_cache_max_bytes"]
+    # the server's own config belongs to no job, whichever job started it
+    config["job_id"] = None
+    server_wire.codec = config["wire_compression"]
+    server_wire.level = config["wire_compression_level"]
+    server_wire.min_bytes = config["wire_compression_min_bytes"]
+
+    if kv_store_ip is None:
+        kv_store_ip = socket.gethostbyname(socket.gethostname())
     kv_store_port = config["kv_store_port"]
     kv_store_addr = (kv_store_ip, kv_store_port)
     
     print("[KV] KV Store Server started...")
     logging.info("[KV] KV Store Server started...")
+
+    if config["kv_server_mode"] == "asyncio":
+        asyncio.run(serve_kv_async(config, kv_store_addr))
+        return
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(kv_store_addr)
     server.listen()
     print(f"[KV] Server listening for connections at address {kv_store_ip}:{kv_store_port}")
@@ -344,7 +864,10 @@ def start_kv_server(config):
 
 if __name__ == "__main__":
     print("curr dir", os.getcwd())
-    with open("./gcp-map-reduce/config.json", "r") as fp:
+    # usage: kv_store_server.py [config_path] [listen_ip]; defaults match the VM layout
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "./gcp-map-reduce/config.json"
+    kv_store_ip = sys.argv[2] if len(sys.argv) > 2 else None
+    with open(config_path, "r") as fp:
         config = json.load(fp)
 
-    start_kv_server(config)
\ No newline at end of file
+    start_kv_server(config, kv_store_ip)
\ No newline at end of file
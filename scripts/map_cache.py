@@ -0,0 +1,146 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import logging
+
+# Map output cache. With map_cache on, the input splits are cut into blocks
+# of map_cache_block_bytes at fixed offsets of every raw file, and mappers map
+# and ship each block separately. The output of a block (one sorted run part
+# per partition, plus its stats) is kept by the KV store under a key derived
+# from the block's content and offset, the map function's identity and the
+# config that shapes map output. The cleanup before a job leaves the cache
+# alone, so when a job runs again on a mostly unchanged corpus, every block
+# whose key is cached is linked into the mapper output instead of being mapped
+# again, and mappers whose blocks are all cached are not run at all. An edit
+# only costs the blocks of the edited file from the edit onwards.
+#
+# Range partition boundaries are sampled from the input, so any change to the
+# corpus invalidates the whole cache under the range partitioner.
+
+# config that changes what a block maps to
+MAP_CONFIG_KEYS = ["operation_name", "mapper_function", "combiner_function", "normalize_ascii_folding",
+    "normalize_stopwords", "normalize_min_token_length", "partitioner", "reducer_count", "partition_boundaries"]
+# the code that maps, partitions & encodes a block besides the map & combine functions
+MAP_CODE_MODULES = ["mapper", "input_splits", "text_cleanup", "partitioner", "sorted_runs", "storage_codecs"]
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# a store takes well under a second, so an older staging dir was abandoned
+STALE_STAGING_SECONDS = 3600
+
+def get_map_identity(config):
+    # digest of the map config and of the source of the map code
+    sha = hashlib.sha256()
+    map_config = {key: config[key] for key in MAP_CONFIG_KEYS}
+    map_config["storage_codec"] = config["storage_codecs"]["mapper-output"]
+    map_config["storage_compression"] = config["storage_compression"]["mapper-output"]
+    sha.update(json.dumps(map_config, sort_keys=True).encode())
+    module_names = MAP_CODE_MODULES + [config["mapper_function"], config["combiner_function"]]
+    for module_name in module_names:
+        if not module_name:
+            continue
+        module_path = os.path.join(SCRIPTS_DIR, module_name.split(".")[-1] + ".py")
+        with open(module_path, "rb") as fp:
+            sha.update(module_name.encode() + b"\0" + fp.read())
+    return sha.hexdigest()
+
+def get_block_cache_key(map_identity, filename, offset, block_bytes):
+    # block_bytes are the lines the block owns (see scripts/input_splits.py);
+    # map output may depend on the block's offset too, e.g. the token
+    # positions of invertedindex_map count from it
+    sha = hashlib.sha256()
+    sha.update(map_identity.encode() + b"\0" + filename.encode() + b"\0" + str(offset).encode() + b"\0")
+    sha.update(block_bytes)
+    return sha.hexdigest()
+
+def get_cache_entry_path(config, key):
+    return os.path.join(config["map_cache_path"], key)
+
+def link_file(source_path, target_path):
+    # cache entries share the run files with the mapper output they came from
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+def store_cache_entry(config, attempt_id, block_tag, key, block_stats):
+    # links the block's run parts of a mapper attempt into the cache; the
+    # entry appears atomically, and an entry stored first is kept
+    entry_path = get_cache_entry_path(config, key)
+    if os.path.isdir(entry_path):
+        return False
+    os.makedirs(config["map_cache_path"], exist_ok=True)
+    # jobs running side by side have the same attempt ids
+    temp_path = f"{entry_path}.{config['job_id']}-{attempt_id}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    prefix = attempt_id + "-part"
+    for file_path in glob.glob(os.path.join(config["mapper_output_path"], prefix + "*-" + block_tag + "-*")):
+        # mapperN-aK-partP-bB-I.<ext> -> partP-I.<ext>
+        partition, _, part_name = os.path.basename(file_path)[len(prefix):].partition("-" + block_tag + "-")
+        link_file(file_path, os.path.join(temp_path, "part" + partition + "-" + part_name))
+    with open(os.path.join(temp_path, "stats.json"), "w") as fp:
+        json.dump(block_stats, fp)
+    try:
+        os.rename(temp_path, entry_path)
+        return True
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        return False
+
+def restore_cache_entry(config, attempt_id, block_tag, key):
+    # links a cached block into a mapper attempt's output as if the attempt
+    # had just mapped it; returns the block's stats, None if it isn't cached
+    entry_path = get_cache_entry_path(config, key)
+    try:
+        with open(os.path.join(entry_path, "stats.json"), "r") as fp:
+            block_stats = json.load(fp)
+    except OSError:
+        return None
+    for filename in os.listdir(entry_path):
+        if not filename.startswith("part"):
+            continue
+        # partP-I.<ext> -> mapperN-aK-partP-bB-I.<ext>
+        partition, _, part_name = filename[len("part"):].partition("-")
+        link_file(os.path.join(entry_path, filename),
+            os.path.join(config["mapper_output_path"], attempt_id + "-part" + partition + "-" + block_tag + "-" + part_name))
+    # entries are evicted least recently used first
+    os.utime(entry_path)
+    return block_stats
+
+def lookup_cache_entries(config, keys):
+    return [key for key in keys if os.path.isdir(get_cache_entry_path(config, key))]
+
+def evict_cache_entries(config):
+    # drops the least recently used entries until the cache fits in
+    # map_cache_max_bytes; returns the number of entries dropped
+    if not os.path.isdir(config["map_cache_path"]):
+        return 0
+    entries = []
+    now = time.time()
+    for key in os.listdir(config["map_cache_path"]):
+        entry_path = get_cache_entry_path(config, key)
+        # entries of other jobs may be stored or evicted meanwhile
+        try:
+            if key.endswith(".tmp"):
+                # a staging dir of a store that never finished; a younger one
+                # may belong to a job that is storing it right now
+                if now - os.path.getmtime(entry_path) > STALE_STAGING_SECONDS:
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                continue
+            entry_bytes = sum(os.path.getsize(os.path.join(entry_path, filename)) for filename in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), entry_bytes, entry_path))
+        except OSError:
+            continue
+    total_bytes = sum(entry_bytes for _, entry_bytes, _ in entries)
+    evicted = 0
+    for _, entry_bytes, entry_path in sorted(entries):
+        if total_bytes <= config["map_cache_max_bytes"]:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_bytes -= entry_bytes
+        evicted += 1
+    logging.info(f"Map cache: {len(entries) - evicted} entries, {total_bytes} bytes ({evicted} evicted)")
+    return evicted
@@ -1,10 +1,22 @@
 import json
+import os
+import sys
 import socket
-import pickle
 import logging
 from importlib import import_module
 
-SIZE = 4096
+# make the repo root importable when this file is run directly as a script on a VM
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.partitioner import get_partition_spec, get_partition_func
+from scripts.framing import send_msg, get_wire_compression
+from scripts.kv_client import KVClient
+from scripts.input_splits import read_split_bytes, DocumentLines
+from scripts.text_cleanup import get_text_normalizer
+from scripts.sorted_runs import RunWriter
+from scripts.storage_codecs import get_record_codec
+from scripts.task_commit import commit_task_output, inject_task_delay, inject_task_failure
+from scripts.heartbeat import HeartbeatSender
+from scripts.worker_daemon import run_worker_daemon
 
 def import_map_reduce_functions(config):
     # import the map/reduce functions as specified in config.json
@@ -24,43 +36,168 @@ def import_map_reduce_functions(config):
         reduce_func = reducer_app_module.invertedindex_reduce_init
     return map_func, reduce_func
 
-def get_dataset_from_kvstore(mapper_id, kv_store_addr):
-    logging.info(f"[{mapper_id}] Retrieving mapper input dataset from KV store...")
+def import_combiner_function(config):
+    # the combiner is optional; an empty combiner_function disables it.
+    # by convention the function is named <module>_init like map/reduce functions
+    combiner_module_name = config["combiner_function"]
+    if not combiner_module_name:
+        return None
+    combiner_app_module = import_module(combiner_module_name)
+    return getattr(combiner_app_module, combiner_module_name.split(".")[-1] + "_init")
 
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
+def get_input_splits_from_kvstore(mapper_id, kv_client):
+    logging.info(f"[{mapper_id}] Retrieving mapper input splits from KV store...")
+    input_splits = kv_client.request("get", "input", mapper_id)
+    logging.info(f"[{mapper_id}] Input splits: {input_splits}")
+    return input_splits
 
-    payload = ("get", "input", mapper_id)
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
+def get_dataset_from_kvstore(input_splits, kv_client, config):
+    # read each byte range through mmap when the raw files are on this host,
+    # otherwise ask the KV store for the range. A split is [filename, offset,
+    # length], plus its map cache key with map_cache on
+    normalizer = get_text_normalizer(config)
+    dataset = {}
+    for filename, offset, length in (input_split[:3] for input_split in input_splits):
+        if filename not in dataset:
+            dataset[filename] = DocumentLines(offset)
+        file_path = os.path.join(config["mapper_raw_input_data_path"], filename)
+        if os.path.isfile(file_path):
+            split_bytes = read_split_bytes(file_path, offset, length)
+        else:
+            split_bytes = kv_client.request("get", "input-range", filename, offset, length)
+            if not isinstance(split_bytes, (bytes, bytearray)):
+                raise RuntimeError(f"Error in reading {filename} [{offset}, {offset + length}) from KV store: {split_bytes}")
+        dataset[filename].extend(normalizer.normalize_bytes(split_bytes))
+    return dataset
 
-    serialized_msg = b""
-    while True:
-        packet = client.recv(SIZE)
-        serialized_msg += packet
-        if b"ENDOFDATA" in packet:
-            logging.info(f"ENDOFDATA received. Breaking...")
-            break
+def partition_mapper_output(mapper_output, config):
+    # split the output into one {key: values} part per reducer so that each
+    # reducer later reads only its own bytes from the KV store
+    partition_func = get_partition_func(get_partition_spec(config))
+    reducer_count = config["reducer_count"]
+    mapper_partitions = [{} for _ in range(reducer_count)]
+    for key, val in mapper_output.items():
+        mapper_partitions[partition_func(key)][key] = val
+    return mapper_partitions
 
-    serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-    dataset = pickle.loads(serialized_msg)
-    return dataset
+def send_mapper_output_to_kvstore(mapper_id, mapper_partitions, kv_client, config, attempt=0, block_tag=None):
+    # every partition is sent as a sorted run, in parts of about
+    # sort_buffer_bytes, for the KV store to merge with the other mappers' runs.
+    # The runs of a cached block are told apart by its block_tag (b<index>);
+    # returns keys, records and bytes per partition
+    codec = get_record_codec(config, "mapper-output")
+    mapper_stats = []
+    for partition, partition_output in enumerate(mapper_partitions):
+        def send_run_part(part_index, run_bytes):
+            if block_tag is not None:
+                part_index = block_tag + "-" + str(part_index)
+            response = kv_client.request("set", "mapper-output", mapper_id, partition, part_index, run_bytes, attempt)
+            if response != "STORED\r\n":
+                # a missing part must fail the attempt before it commits
+                raise RuntimeError(f"Error in sending {mapper_id} partition {partition} run part {part_index} to KV store: {response}")
 
-def send_mapper_output_to_kvstore(mapper_id, mapper_output, kv_store_addr):
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
-    payload = ("set", "mapper-output", mapper_id, mapper_output)
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
-    response = client.recv(SIZE)
-    # response = pickle.loads(response)
+        run_writer = RunWriter(send_run_part, config["sort_buffer_bytes"], codec)
+        for key in sorted(partition_output):
+            run_writer.add(key, partition_output[key], len(partition_output[key]))
+        run_writer.flush()
+        mapper_stats.append(run_writer.stats())
+    return mapper_stats
+
+def send_mapper_stats_to_kvstore(mapper_id, mapper_stats, kv_client, attempt=0):
+    response = kv_client.request("set", "mapper-stats", mapper_id, mapper_stats, attempt)
     logging.info(f"[{mapper_id}] Response for sending mapper output to KV store: {response}")
 
-def send_ack_to_master(mapper_id, master_addr):
+def get_empty_mapper_stats(config):
+    return [{"keys": 0, "records": 0, "bytes": 0} for _ in range(config["reducer_count"])]
+
+def add_mapper_stats(mapper_stats, block_stats):
+    return [{field: partition_stats[field] + partition_block_stats[field] for field in partition_stats}
+        for partition_stats, partition_block_stats in zip(mapper_stats, block_stats)]
+
+def restore_cached_block(mapper_id, kv_client, attempt, block_tag, cache_key):
+    # the block's stats if the KV store linked its cached output into this attempt, else None
+    block_stats = kv_client.request("map-cache", "restore", mapper_id, attempt, block_tag, cache_key)
+    if isinstance(block_stats, str):
+        raise RuntimeError(f"Error in restoring cached block {block_tag} of {mapper_id}: {block_stats}")
+    return block_stats
+
+def commit_cached_map_task(mapper_id, input_splits, kv_client, config, attempt=0):
+    # run by the master for a task whose blocks are all cached: the task's
+    # output is restored & committed without running a mapper; True if it was
+    mapper_stats = get_empty_mapper_stats(config)
+    for block_index, input_split in enumerate(input_splits):
+        block_stats = restore_cached_block(mapper_id, kv_client, attempt, f"b{block_index}", input_split[3])
+        if block_stats is None:
+            # evicted since the lookup
+            return False
+        mapper_stats = add_mapper_stats(mapper_stats, block_stats)
+    send_mapper_stats_to_kvstore(mapper_id, mapper_stats, kv_client, attempt)
+    commit_task_output(kv_client, "mapper-output", mapper_id, attempt)
+    return True
+
+def map_input(mapper_id, input_splits, map_func, combine_func, kv_client, config, attempt, block_tag=None):
+    # map, combine, partition & send some splits; returns the mapper stats
+    dataset = get_dataset_from_kvstore(input_splits, kv_client, config)
+    mapper_output = map_func(dataset, mapper_id)
+
+    # run the combiner locally before shipping intermediate output
+    if combine_func is not None:
+        value_count = sum(len(val) for val in mapper_output.values())
+        mapper_output = combine_func(mapper_output, mapper_id)
+        combined_value_count = sum(len(val) for val in mapper_output.values())
+        logging.info(f"[{mapper_id}] Combiner reduced intermediate values from {value_count} to {combined_value_count}")
+
+    # send intermediate output to kvstore, one partition per reducer
+    mapper_partitions = partition_mapper_output(mapper_output, config)
+    return send_mapper_output_to_kvstore(mapper_id, mapper_partitions, kv_client, config, attempt, block_tag)
+
+def send_ack_to_master(mapper_id, master_addr, attempt=0, status="DONE"):
+    # status is STARTED when the attempt begins and HEARTBEAT while it runs;
+    # DONE, DISCARDED if another attempt of the task committed first, or
+    # FAILED when it ends
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client.connect(master_addr)
-    payload = (mapper_id, "DONE")
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
+    payload = (mapper_id, status, attempt)
+    send_msg(client, payload)
+    client.close()
 
-def mapper_init(mapper_id, map_func, config):
+def run_map_task(mapper_id, map_func, config, combine_func, attempt, heartbeat):
+    # map, partition and commit the task's input split; True if this attempt's
+    # output is the task's output
+    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
+
+    # one pooled client (and connection) for the whole task
+    kv_client = KVClient(kv_store_addr, config["kv_pool_size"], config["kv_timeout"], get_wire_compression(config), config["job_id"])
+    
+    input_splits = get_input_splits_from_kvstore(mapper_id, kv_client)
+    if config["map_cache"]:
+        # every split is a block with a cache key: cached blocks are linked
+        # in by the KV store, the others are mapped one by one and cached
+        mapper_stats = get_empty_mapper_stats(config)
+        cached_blocks = 0
+        for block_index, input_split in enumerate(input_splits):
+            block_tag = f"b{block_index}"
+            block_stats = restore_cached_block(mapper_id, kv_client, attempt, block_tag, input_split[3])
+            if block_stats is not None:
+                cached_blocks += 1
+            else:
+                block_stats = map_input(mapper_id, [input_split], map_func, combine_func, kv_client, config, attempt, block_tag)
+                kv_client.request("map-cache", "store", mapper_id, attempt, block_tag, input_split[3], block_stats)
+            mapper_stats = add_mapper_stats(mapper_stats, block_stats)
+        logging.info(f"[{mapper_id}] {cached_blocks} of {len(input_splits)} blocks restored from the map cache")
+    else:
+        mapper_stats = map_input(mapper_id, input_splits, map_func, combine_func, kv_client, config, attempt)
+    send_mapper_stats_to_kvstore(mapper_id, mapper_stats, kv_client, attempt)
+    inject_task_delay(mapper_id, attempt, config)
+    inject_task_failure(mapper_id, attempt, config, heartbeat)
+
+    # make this attempt's output the task's output, unless another attempt won
+    committed = commit_task_output(kv_client, "mapper-output", mapper_id, attempt)
+    logging.info(f"[{mapper_id}] KV transfer stats: {kv_client.transfer_stats()}")
+    kv_client.close()
+    return committed
+
+def mapper_init(mapper_id, map_func, config, combine_func=None, attempt=0):
     logging.basicConfig(
         filename=config["mapper_log_path"], 
         filemode='w', 
@@ -69,28 +206,59 @@ def mapper_init(mapper_id, map_func, config):
         level=logging.DEBUG
         )
 
-    print(f"[MAPPER - {mapper_id}] {mapper_id} has started...")
-    logging.info(f"{mapper_id} has started...")
+    print(f"[MAPPER - {mapper_id}] {mapper_id} (attempt {attempt}) has started...")
+    logging.info(f"{mapper_id} (attempt {attempt}) has started...")
 
     # read config params
     master_addr = (config["master_host"], config["master_port"])
-    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
-    
-    # retrieve dataset from kv store
-    dataset = get_dataset_from_kvstore(mapper_id, kv_store_addr)
-
-    # perform map operation
-    mapper_output = map_func(dataset, mapper_id)
+    send_ack_to_master(mapper_id, master_addr, attempt, "STARTED")
 
-    # send intermediate output to kvstore
-    send_mapper_output_to_kvstore(mapper_id, mapper_output, kv_store_addr)
+    # heartbeats tell the master this attempt is alive until it reports back
+    heartbeat = HeartbeatSender(lambda: send_ack_to_master(mapper_id, master_addr, attempt, "HEARTBEAT"), config["heartbeat_interval"])
+    heartbeat.start()
+    try:
+        committed = run_map_task(mapper_id, map_func, config, combine_func, attempt, heartbeat)
+    except Exception:
+        # report the failure so that the master re-executes the task right away
+        logging.exception(f"[{mapper_id}] Attempt {attempt} failed")
+        send_ack_to_master(mapper_id, master_addr, attempt, "FAILED")
+        raise
+    finally:
+        heartbeat.stop()
 
     # notify master that task is complete
-    send_ack_to_master(mapper_id, master_addr)
+    send_ack_to_master(mapper_id, master_addr, attempt, "DONE" if committed else "DISCARDED")
+
+def run_mapper(mapper_id, config, attempt=0):
+    # entry point of a task pulled by a worker daemon
+    map_func, _ = import_map_reduce_functions(config)
+    combine_func = import_combiner_function(config)
+    mapper_init(mapper_id, map_func, config, combine_func, attempt)
 
 if __name__ == "__main__":
-    mapper_id = socket.gethostname()
-    with open("./gcp-map-reduce/config.json", "r") as fp:
+    if len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        # usage: mapper.py --daemon [worker_id] [config_path]
+        worker_id = sys.argv[2] if len(sys.argv) > 2 else socket.gethostname()
+        config_path = sys.argv[3] if len(sys.argv) > 3 else "./gcp-map-reduce/config.json"
+        with open(config_path, "r") as fp:
+            config = json.load(fp)
+        logging.basicConfig(
+            filename=config["mapper_log_path"],
+            filemode='w',
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%d-%b-%y %H:%M:%S',
+            level=logging.DEBUG
+            )
+        run_worker_daemon("mapper", worker_id, config, run_mapper)
+        sys.exit()
+
+    # usage: mapper.py [mapper_id] [config_path] [attempt]
+    # defaults match the VM layout, where the hostname is the mapper id
+    mapper_id = sys.argv[1] if len(sys.argv) > 1 else socket.gethostname()
+    config_path = sys.argv[2] if len(sys.argv) > 2 else "./gcp-map-reduce/config.json"
+    attempt = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    with open(config_path, "r") as fp:
         config = json.load(fp)
     map_func, _ = import_map_reduce_functions(config)
-    mapper_init(mapper_id, map_func, config)
\ No newline at end of file
+    combine_func = import_combiner_function(config)
+    mapper_init(mapper_id, map_func, config, combine_func, attempt)
\ No newline at end of file
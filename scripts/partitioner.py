@@ -0,0 +1,67 @@
+import bisect
+import random
+import zlib
+
+# A partitioner maps an intermediate key to a reducer partition in
+# [0, reducer_count). The partitioner is described by a small "partition spec"
+# dict so it can travel inside config.json and KV store requests:
+#
+#   {"partitioner": "hash" | "range", "reducer_count": n, "boundaries": [...]}
+
+def hash_partition(key, reducer_count):
+    # crc32 is stable across processes and hosts, unlike the salted built-in hash()
+    return zlib.crc32(key.encode("utf-8")) % reducer_count
+
+def range_partition(key, boundaries):
+    # boundaries are the sorted upper split points; partition i holds keys in
+    # [boundaries[i-1], boundaries[i]) so concatenated partitions stay sorted
+    return bisect.bisect_right(boundaries, key)
+
+def sample_keys(dataset, sample_size, seed=0):
+    # reservoir sample of the tokens in {doc: [lines]}; tokens are the map keys
+    # of both built-in jobs, so they approximate the intermediate key distribution
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for doc in dataset:
+        for line in dataset[doc]:
+            for token in line.split():
+                seen += 1
+                if len(sample) < sample_size:
+                    sample.append(token)
+                else:
+                    i = rng.randrange(seen)
+                    if i < sample_size:
+                        sample[i] = token
+    return sample
+
+def compute_range_boundaries(sample, reducer_count):
+    # pick reducer_count-1 evenly spaced quantiles of the distinct sampled keys;
+    # after combining, reduce work is per distinct key rather than per occurrence
+    sample = sorted(set(sample))
+    boundaries = []
+    for i in range(1, reducer_count):
+        if not sample:
+            break
+        boundary = sample[(i * len(sample)) // reducer_count]
+        # a very frequent key must not produce duplicate (empty) partitions
+        if not boundaries or boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    return boundaries
+
+def get_partition_spec(config):
+    return {
+        "partitioner": config["partitioner"],
+        "reducer_count": config["reducer_count"],
+        "boundaries": config["partition_boundaries"],
+    }
+
+def get_partition_func(partition_spec):
+    # returns key -> partition index for the given spec
+    reducer_count = partition_spec["reducer_count"]
+    if partition_spec["partitioner"] == "hash":
+        return lambda key: hash_partition(key, reducer_count)
+    elif partition_spec["partitioner"] == "range":
+        boundaries = partition_spec["boundaries"]
+        return lambda key: range_partition(key, boundaries)
+    raise ValueError(f"Unknown partitioner: {partition_spec['partitioner']}")
@@ -0,0 +1,250 @@
+import mmap
+import os
+import struct
+
+from scripts.storage_codecs import encode_varint, decode_varint
+
+# Positional inverted index, written by the KV store when it combines the
+# invertedindex reducer output. For every term it stores the documents the
+# term occurs in, with the term's frequency and positions in each of them:
+#
+#   "MRINDEX2"
+#   postings of every term, in term order:
+#       varint document count, then per document (in doc id order):
+#       varint doc id delta, varint frequency, frequency x varint position delta
+#   document dictionary: varint count, then per doc id: varint length + UTF-8 name
+#   term dictionary: per term (in term order):
+#       varint length + UTF-8 term, varint offset of its postings
+#   term table: per term (in term order): offset of its term dictionary entry, 8 bytes
+#   footer: offsets of the document & term dictionaries and of the term table,
+#       term count, "MRINDEX2"
+#
+# Doc ids and positions are delta encoded, so most of them fit in one byte.
+# A position counts tokens from the byte offset of the split the document
+# was mapped in (see invertedindex_map), so positions of consecutive tokens
+# are consecutive unless a split boundary lies between them.
+#
+# Terms are sorted by code point, which is the byte order of their UTF-8
+# encoding, and the term table has fixed width entries, so a reader memory
+# maps the file and binary searches the term table: a lookup touches
+# O(log terms) pages of the file and nothing is loaded up front except the
+# document names.
+
+MAGIC = b"MRINDEX2"
+FOOTER = struct.Struct("!QQQQ8s")
+TERM_ENTRY = struct.Struct("!Q")
+
+def encode_postings(postings, doc_ids, out):
+    # postings: (doc name, positions) pairs; doc_ids maps doc names to ids,
+    # and gets an id for every doc name it hasn't seen yet
+    entries = []
+    for doc_name, positions in postings:
+        if doc_name not in doc_ids:
+            doc_ids[doc_name] = len(doc_ids)
+        entries.append((doc_ids[doc_name], positions))
+    entries.sort()
+    encode_varint(len(entries), out)
+    previous_doc_id = 0
+    for doc_id, positions in entries:
+        encode_varint(doc_id - previous_doc_id, out)
+        previous_doc_id = doc_id
+        encode_varint(len(positions), out)
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, out)
+            previous_position = position
+
+def decode_postings(data, pos=0):
+    # [(doc id, positions)] of the postings starting at data[pos]
+    doc_count, pos = decode_varint(data, pos)
+    postings = []
+    doc_id = 0
+    for _ in range(doc_count):
+        doc_id_delta, pos = decode_varint(data, pos)
+        doc_id += doc_id_delta
+        frequency, pos = decode_varint(data, pos)
+        positions = []
+        position = 0
+        for _ in range(frequency):
+            position_delta, pos = decode_varint(data, pos)
+            position += position_delta
+            positions.append(position)
+        postings.append((doc_id, positions))
+    return postings
+
+def encode_string(value, out):
+    value_bytes = value.encode("utf-8")
+    encode_varint(len(value_bytes), out)
+    out += value_bytes
+
+def decode_string(data, pos):
+    length, pos = decode_varint(data, pos)
+    return bytes(data[pos:pos + length]).decode("utf-8"), pos + length
+
+class IndexWriter:
+    # Writes an index file from (term, postings) pairs added in term order,
+    # e.g. straight out of the merge of the reducer runs
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fp = open(file_path + ".tmp", "wb")
+        self.fp.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.doc_ids = {}
+        self.term_dictionary = bytearray()
+        self.term_table = []
+        self.previous_term = None
+
+    def add(self, term, postings):
+        # the term table is only searchable if the terms come in order
+        if self.previous_term is not None and term <= self.previous_term:
+            self.fp.close()
+            os.remove(self.file_path + ".tmp")
+            raise ValueError(f"Index terms out of order: {term!r} after {self.previous_term!r}")
+        self.previous_term = term
+        out = bytearray()
+        encode_postings(postings, self.doc_ids, out)
+        self.fp.write(out)
+        self.term_table.append(len(self.term_dictionary))
+        encode_string(term, self.term_dictionary)
+        encode_varint(self.offset, self.term_dictionary)
+        self.offset += len(out)
+
+    def close(self):
+        # dictionaries, term table & footer; the index replaces an older one atomically
+        doc_dictionary = bytearray()
+        encode_varint(len(self.doc_ids), doc_dictionary)
+        for doc_name in sorted(self.doc_ids, key=self.doc_ids.get):
+            encode_string(doc_name, doc_dictionary)
+        doc_dictionary_offset = self.offset
+        self.fp.write(doc_dictionary)
+        term_dictionary_offset = doc_dictionary_offset + len(doc_dictionary)
+        self.fp.write(self.term_dictionary)
+        term_table_offset = term_dictionary_offset + len(self.term_dictionary)
+        term_table = bytearray()
+        for term_offset in self.term_table:
+            term_table += TERM_ENTRY.pack(term_dictionary_offset + term_offset)
+        self.fp.write(term_table)
+        self.fp.write(FOOTER.pack(doc_dictionary_offset, term_dictionary_offset, term_table_offset, len(self.term_table), MAGIC))
+        self.fp.close()
+        os.replace(self.file_path + ".tmp", self.file_path)
+        return len(self.term_table)
+
+class IndexReader:
+    # Memory maps an index file; terms are binary searched in the term table
+    # and their postings decoded on demand. The pages of the file are shared
+    # by every process that has it open, so a reader's own memory is the
+    # document names and the postings it decodes.
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size < len(MAGIC) + FOOTER.size:
+                raise ValueError(f"{file_path} is not an inverted index file")
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        doc_dictionary_offset, _, self.term_table_offset, self.term_count, magic = FOOTER.unpack_from(self.data, size - FOOTER.size)
+        if self.data[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.data.close()
+            raise ValueError(f"{file_path} is not an inverted index file")
+
+        doc_count, pos = decode_varint(self.data, doc_dictionary_offset)
+        self.doc_names = []
+        for _ in range(doc_count):
+            doc_name, pos = decode_string(self.data, pos)
+            self.doc_names.append(doc_name)
+
+    def close(self):
+        self.data.close()
+
+    def term_entry(self, term_index):
+        # (UTF-8 term, position of its postings offset) of the term_index-th term
+        term_offset, = TERM_ENTRY.unpack_from(self.data, self.term_table_offset + term_index * TERM_ENTRY.size)
+        length, pos = decode_varint(self.data, term_offset)
+        return self.data[pos:pos + length], pos + length
+
+    def lower_bound(self, term_bytes):
+        # index of the first term not smaller than term_bytes
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term_entry(middle)[0] < term_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def postings_offset(self, term):
+        term_bytes = term.encode("utf-8")
+        term_index = self.lower_bound(term_bytes)
+        if term_index < self.term_count:
+            found_bytes, pos = self.term_entry(term_index)
+            if found_bytes == term_bytes:
+                return decode_varint(self.data, pos)[0]
+        return None
+
+    def decode_postings_at(self, postings_offset):
+        return {self.doc_names[doc_id]: positions for doc_id, positions in decode_postings(self.data, postings_offset)}
+
+    def postings(self, term):
+        # {doc name: positions} of term
+        postings_offset = self.postings_offset(term)
+        if postings_offset is None:
+            return {}
+        return self.decode_postings_at(postings_offset)
+
+    def documents(self, term):
+        return sorted(self.postings(term))
+
+    def frequencies(self, term):
+        return {doc_name: len(positions) for doc_name, positions in self.postings(term).items()}
+
+    def all_of(self, terms):
+        # {doc name: summed frequency of terms} of the documents containing every term
+        if not terms:
+            return {}
+        matches = self.frequencies(terms[0])
+        for term in terms[1:]:
+            if not matches:
+                break
+            term_frequencies = self.frequencies(term)
+            matches = {doc_name: frequency + term_frequencies[doc_name]
+                for doc_name, frequency in matches.items() if doc_name in term_frequencies}
+        return matches
+
+    def any_of(self, terms):
+        # {doc name: summed frequency of terms} of the documents containing any of terms
+        matches = {}
+        for term in set(terms):
+            for doc_name, frequency in self.frequencies(term).items():
+                matches[doc_name] = matches.get(doc_name, 0) + frequency
+        return matches
+
+    def prefix(self, prefix, limit):
+        # {term: doc names} of the first limit terms starting with prefix,
+        # in term order
+        prefix_bytes = prefix.encode("utf-8")
+        matches = {}
+        term_index = self.lower_bound(prefix_bytes)
+        while term_index < self.term_count and len(matches) < limit:
+            term_bytes, pos = self.term_entry(term_index)
+            if not term_bytes.startswith(prefix_bytes):
+                break
+            matches[term_bytes.decode("utf-8")] = sorted(self.decode_postings_at(decode_varint(self.data, pos)[0]))
+            term_index += 1
+        return matches
+
+    def phrase(self, terms):
+        # {doc name: positions of the phrase's first term} of the documents
+        # containing terms as consecutive tokens
+        if not terms:
+            return {}
+        matches = {doc_name: set(positions) for doc_name, positions in self.postings(terms[0]).items()}
+        for offset, term in enumerate(terms[1:], start=1):
+            term_postings = self.postings(term)
+            matches = {doc_name: {start for start in starts if start + offset in term_positions}
+                for doc_name, starts in matches.items()
+                for term_positions in [set(term_postings.get(doc_name, ()))]}
+            matches = {doc_name: starts for doc_name, starts in matches.items() if starts}
+            if not matches:
+                break
+        return {doc_name: sorted(starts) for doc_name, starts in matches.items()}
@@ -1,10 +1,21 @@
 import json
+import os
+import shutil
+import sys
 import socket
-import pickle
 import logging
 from importlib import import_module
 
-SIZE = 4096
+# make the repo root importable when this file is run directly as a script on a VM
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.partitioner import get_partition_spec
+from scripts.framing import send_msg, get_wire_compression
+from scripts.kv_client import KVClient
+from scripts.sorted_runs import RunWriter, iter_grouped_records, merge_run_files
+from scripts.storage_codecs import get_record_codec
+from scripts.task_commit import get_attempt_id, commit_task_output, inject_task_delay, inject_task_failure
+from scripts.heartbeat import HeartbeatSender
+from scripts.worker_daemon import run_worker_daemon
 
 def import_map_reduce_functions(config):
     # import the map/reduce functions as specified in config.json
@@ -24,51 +35,115 @@ def import_map_reduce_functions(config):
         reduce_func = reducer_app_module.invertedindex_reduce_init
     return map_func, reduce_func
 
-def group_by_alphabet(reducer_count):
-    letters = "abcdefghijklmnopqrstuvwxyz"
-    groups = [""] * reducer_count
-    i = 0
-    for c in letters:
-        groups[i % reducer_count] += c
-        i += 1
-    return groups
-
-def get_reducer_input_from_kvstore(kv_store_addr, group, reducer_id):
+def get_reducer_input_from_kvstore(kv_client, partition, reducer_id, config):
+    # the KV store streams the mapper runs of this partition merged in key
+    # order; they are grouped into (key, values) one key at a time
+    def partition_chunks():
+        for chunk in kv_client.stream("get", "mapper-output", partition, reducer_id):
+            if not isinstance(chunk, (bytes, bytearray)):
+                raise RuntimeError(f"Error in retrieving partition {partition} from KV store: {chunk}")
+            yield chunk
+    return iter_grouped_records(partition_chunks(), get_record_codec(config, "mapper-output"))
+
+def fetch_partition_runs(kv_client, partition, reducer_id, spill_path, config):
+    # pipelined shuffle: the reducer starts while mappers still run, and copies
+    # each mapper's run of this partition to a local file as soon as that
+    # mapper commits; returns the run files once every mapper has committed
+    os.makedirs(spill_path, exist_ok=True)
+    codec = get_record_codec(config, "mapper-output")
+    mapper_count = config["mapper_count"]
+    run_file_paths = {}
+    while len(run_file_paths) < mapper_count:
+        # long poll, answered as soon as another mapper commits
+        committed = kv_client.request("get", "committed", "mapper-output", sorted(run_file_paths), config["shuffle_poll_seconds"])
+        if not isinstance(committed, dict):
+            raise RuntimeError(f"Error in polling committed mappers from KV store: {committed}")
+        for mapper_id in sorted(committed):
+            file_path = os.path.join(spill_path, mapper_id + "." + codec.name)
+            with open(file_path, "wb") as fp:
+                for chunk in kv_client.stream("get", "mapper-output", partition, reducer_id, mapper_id):
+                    if not isinstance(chunk, (bytes, bytearray)):
+                        raise RuntimeError(f"Error in retrieving {mapper_id} partition {partition} from KV store: {chunk}")
+                    fp.write(chunk)
+            run_file_paths[mapper_id] = file_path
+            print(f"[REDUCER - {reducer_id}] Fetched {mapper_id} output ({len(run_file_paths)}/{mapper_count} mappers)")
+            logging.info(f"[{reducer_id}] Fetched {mapper_id} output to {file_path} ({len(run_file_paths)}/{mapper_count} mappers)")
+    return sorted(run_file_paths.values())
+
+def send_reducer_output_to_kvstore(reducer_id, reducer_output, kv_client, config, attempt=0):
+    # reducer output arrives in key order and is sent as a sorted run, spilled
+    # to the KV store in parts whenever sort_buffer_bytes of it are buffered
+    def send_run_part(part_index, run_bytes):
+        response = kv_client.request("set", "reducer-output", reducer_id, part_index, run_bytes, attempt)
+        if response != "STORED\r\n":
+            # a missing part must fail the attempt before it commits
+            raise RuntimeError(f"Error in sending {reducer_id} output part {part_index} to KV store: {response}")
+        logging.info(f"[{reducer_id}] Response for sending reducer output part {part_index} to KV store: {response}")
+
+    run_writer = RunWriter(send_run_part, config["sort_buffer_bytes"], get_record_codec(config, "reducer-output"))
+    for key, val in reducer_output:
+        run_writer.add(key, val)
+    run_writer.flush()
+    logging.info(f"[{reducer_id}] Reducer output: {run_writer.stats()} in {run_writer.part_count} parts")
+
+def send_ack_to_master(reducer_id, master_addr, attempt=0, status="DONE"):
+    # status is STARTED when the attempt begins and HEARTBEAT while it runs;
+    # DONE, DISCARDED if another attempt of the task committed first, or
+    # FAILED when it ends
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
+    client.connect(master_addr)
+    payload = (reducer_id, status, attempt)
+    send_msg(client, payload)
+    client.close()
 
-    payload = ("get", "mapper-output", group, reducer_id)
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
+def run_reduce_task(reducer_id, reduce_func, config, attempt, heartbeat):
+    # reduce and commit the task's partition; True if this attempt's output is
+    # the task's output
+    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
 
-    serialized_msg = b""
-    while True:
-        packet = client.recv(SIZE)
-        serialized_msg += packet
-        if b"ENDOFDATA" in packet:
-            logging.info(f"ENDOFDATA received. Breaking...")
-            break
+    # one pooled client (and connection) for the whole task
+    kv_client = KVClient(kv_store_addr, config["kv_pool_size"], config["kv_timeout"], get_wire_compression(config), config["job_id"])
 
-    serialized_msg = serialized_msg[:-9] # exclude ENDOFDATA
-    reducer_input = pickle.loads(serialized_msg)
-    return reducer_input
+    # reducerN owns partition N-1 of the configured partitioner
+    partition_spec = get_partition_spec(config)
+    partition_spec["partition"] = int(reducer_id[7:]) - 1
+    print(f"[REDUCER - {reducer_id}] partition: {partition_spec['partition']} ({partition_spec['partitioner']} partitioner)")
+    logging.info(f"[{reducer_id}] partition: {partition_spec['partition']} ({partition_spec['partitioner']} partitioner)")
+    
+    # retrieve intermediate output of this partition from mappers as a
+    # streamed, grouped iterator; a pipelined reducer merges the runs it
+    # fetched while the mappers ran instead (spilled per job, since jobs
+    # running side by side have the same attempt ids)
+    spill_path = os.path.join(config["shuffle_spill_path"], config["job_id"], get_attempt_id(reducer_id, attempt))
+    if config["pipelined_shuffle"]:
+        run_file_paths = fetch_partition_runs(kv_client, partition_spec["partition"], reducer_id, spill_path, config)
+        codec = get_record_codec(config, "mapper-output")
+        reducer_input = iter_grouped_records(merge_run_files(run_file_paths, codec, "none"), codec)
+    else:
+        reducer_input = get_reducer_input_from_kvstore(kv_client, partition_spec["partition"], reducer_id, config)
 
-def send_reducer_output_to_kvstore(reducer_id, reducer_output, kv_store_addr):
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(kv_store_addr)
-    payload = ("set", "reducer-output", reducer_id, reducer_output)
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
-    response = client.recv(SIZE)
-    # response = pickle.loads(response)
-    print(f"[REDUCER - {reducer_id}] Response for sending mapper output to KV store: {response}")
-    logging.info(f"[{reducer_id}] Response for sending mapper output to KV store: {response}")
-
-def send_ack_to_master(reducer_id, master_addr):
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(master_addr)
-    payload = (reducer_id, "DONE")
-    client.sendall(pickle.dumps(payload) + b"ENDOFDATA")
+    # perform reduce operation; the reduce function yields (key, value) pairs
+    # while it consumes its input, so neither is ever held in memory whole
+    reducer_output = reduce_func(reducer_input, reducer_id)
 
-def reducer_init(reducer_id, reduce_func, config):
+    # send reducer output to kvstore
+    send_reducer_output_to_kvstore(reducer_id, reducer_output, kv_client, config, attempt)
+    shutil.rmtree(spill_path, ignore_errors=True)
+    try:
+        # the job's spill dir, once its last reducer is done
+        os.rmdir(os.path.dirname(spill_path))
+    except OSError:
+        pass
+    inject_task_delay(reducer_id, attempt, config)
+    inject_task_failure(reducer_id, attempt, config, heartbeat)
+
+    # make this attempt's output the task's output, unless another attempt won
+    committed = commit_task_output(kv_client, "reducer-output", reducer_id, attempt)
+    logging.info(f"[{reducer_id}] KV transfer stats: {kv_client.transfer_stats()}")
+    kv_client.close()
+    return committed
+
+def reducer_init(reducer_id, reduce_func, config, attempt=0):
 
     # initialize logging configurations
     logging.basicConfig(
@@ -79,37 +154,57 @@ def reducer_init(reducer_id, reduce_func, config):
         level=logging.DEBUG
         )
 
-    print(f"{reducer_id} has started...")
-    logging.info(f"{reducer_id} has started...")
+    print(f"{reducer_id} (attempt {attempt}) has started...")
+    logging.info(f"{reducer_id} (attempt {attempt}) has started...")
 
     # read config params
     master_addr = (config["master_host"], config["master_port"])
-    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
-
-    # groupby alphabet and reducer count
-    groups = group_by_alphabet(config["reducer_count"])
-    reducer_num = int(reducer_id[7:])
-    curr_reducer_group = groups[reducer_num-1]
-    print(f"[REDUCER - {reducer_id}] group string: {curr_reducer_group}")
-    logging.info(f"[{reducer_id}] group string: {curr_reducer_group}")
-    
-    # retrieve intermediate output as per groupby strategy from mappers
-    reducer_input = get_reducer_input_from_kvstore(kv_store_addr, curr_reducer_group, reducer_id)
-    
-    # perform reduce operation
-    reducer_output = reduce_func(reducer_input, reducer_id)
-
-    # send reducer output to kvstore
-    send_reducer_output_to_kvstore(reducer_id, reducer_output, kv_store_addr)
+    send_ack_to_master(reducer_id, master_addr, attempt, "STARTED")
+
+    # heartbeats tell the master this attempt is alive until it reports back
+    heartbeat = HeartbeatSender(lambda: send_ack_to_master(reducer_id, master_addr, attempt, "HEARTBEAT"), config["heartbeat_interval"])
+    heartbeat.start()
+    try:
+        committed = run_reduce_task(reducer_id, reduce_func, config, attempt, heartbeat)
+    except Exception:
+        # report the failure so that the master re-executes the task right away
+        logging.exception(f"[{reducer_id}] Attempt {attempt} failed")
+        send_ack_to_master(reducer_id, master_addr, attempt, "FAILED")
+        raise
+    finally:
+        heartbeat.stop()
 
     # notify master that task is complete
-    send_ack_to_master(reducer_id, master_addr)
+    send_ack_to_master(reducer_id, master_addr, attempt, "DONE" if committed else "DISCARDED")
+
+def run_reducer(reducer_id, config, attempt=0):
+    # entry point of a task pulled by a worker daemon
+    _, reduce_func = import_map_reduce_functions(config)
+    reducer_init(reducer_id, reduce_func, config, attempt)
 
 if __name__ == "__main__":
-    reducer_id = socket.gethostname()
-    with open("./gcp-map-reduce/config.json", "r") as fp:
+    if len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        # usage: reducer.py --daemon [worker_id] [config_path]
+        worker_id = sys.argv[2] if len(sys.argv) > 2 else socket.gethostname()
+        config_path = sys.argv[3] if len(sys.argv) > 3 else "./gcp-map-reduce/config.json"
+        with open(config_path, "r") as fp:
+            config = json.load(fp)
+        logging.basicConfig(
+            filename=config["reducer_log_path"],
+            filemode='w',
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%d-%b-%y %H:%M:%S',
+            level=logging.DEBUG
+            )
+        run_worker_daemon("reducer", worker_id, config, run_reducer)
+        sys.exit()
+
+    # usage: reducer.py [reducer_id] [config_path] [attempt]
+    # defaults match the VM layout, where the hostname is the reducer id
+    reducer_id = sys.argv[1] if len(sys.argv) > 1 else socket.gethostname()
+    config_path = sys.argv[2] if len(sys.argv) > 2 else "./gcp-map-reduce/config.json"
+    attempt = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    with open(config_path, "r") as fp:
         config = json.load(fp)
     _, reduce_func = import_map_reduce_functions(config)
-    reducer_init(reducer_id, reduce_func, config)
-    
-
+    reducer_init(reducer_id, reduce_func, config, attempt)
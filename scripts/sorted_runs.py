@@ -0,0 +1,88 @@
+import heapq
+import itertools
+from operator import itemgetter
+
+from scripts.framing import STREAM_CHUNK_SIZE, read_file_chunks
+from scripts.storage_codecs import iter_decompressed_chunks
+
+# Intermediate and reducer output is stored as sorted runs: files of
+# (key, value) records in ascending key order, encoded with the record codec
+# and compression configured for their KV category (scripts/storage_codecs.py).
+#
+# Runs are combined with a streaming k-way merge (heapq.merge) that decodes
+# only the key of each record, so merging never holds more than one record per
+# run in memory, and records with equal keys come out next to each other.
+
+def iter_run_file(file_path, codec, compression):
+    # (key, record bytes) of every record of a stored run
+    chunks = iter_decompressed_chunks(read_file_chunks(file_path), compression)
+    return codec.iter_keyed_records(chunks)
+
+def merge_run_files(file_paths, codec, compression):
+    # record bytes of all runs in key order
+    runs = [iter_run_file(file_path, codec, compression) for file_path in file_paths]
+    for _, record in heapq.merge(*runs, key=itemgetter(0)):
+        yield record
+
+def iter_record_chunks(records, chunk_size=STREAM_CHUNK_SIZE):
+    # batches records into chunks of about chunk_size bytes for send_stream
+    chunk = []
+    chunk_bytes = 0
+    for record in records:
+        chunk.append(record)
+        chunk_bytes += len(record)
+        if chunk_bytes >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+            chunk_bytes = 0
+    if chunk:
+        yield b"".join(chunk)
+
+def group_records(records):
+    # (key, values) for every run of equal keys in a sorted stream of
+    # (key, value) records; values is an iterator over the values, each of
+    # which is itself a list (e.g. one partial list per mapper)
+    for key, group in itertools.groupby(records, key=itemgetter(0)):
+        yield key, itertools.chain.from_iterable(value for _, value in group)
+
+def iter_grouped_records(chunks, codec):
+    # grouped reducer input from the chunks of a merged, streamed partition
+    return group_records(codec.iter_records(chunks))
+
+class RunWriter:
+    # Buffers encoded records of one sorted run and hands them to flush_func
+    # as numbered parts whenever the buffer exceeds buffer_bytes, so the
+    # writer never holds more than about buffer_bytes of a run in memory.
+    # Records must be added in key order; every part is then a sorted run too.
+
+    def __init__(self, flush_func, buffer_bytes, codec):
+        self.flush_func = flush_func # flush_func(part_index, run_bytes)
+        self.buffer_bytes = buffer_bytes
+        self.codec = codec
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.part_count = 0
+        self.keys = 0
+        self.records = 0
+        self.bytes = 0
+
+    def add(self, key, value, record_count=1):
+        record = self.codec.encode_record(key, value)
+        self.buffer.append(record)
+        self.buffered_bytes += len(record)
+        self.keys += 1
+        self.records += record_count
+        self.bytes += len(record)
+        if self.buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.flush_func(self.part_count, b"".join(self.buffer))
+        self.part_count += 1
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def stats(self):
+        return {"keys": self.keys, "records": self.records, "bytes": self.bytes}
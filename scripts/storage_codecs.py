@@ -0,0 +1,232 @@
+import json
+import lzma
+import struct
+import zlib
+
+# Storage codecs of the KV store's sorted runs (mapper and reducer output).
+#
+# A record codec turns (key, value) records into bytes and back:
+#   "jsonl"   <key json>\t<value json>\n per record
+#   "binary"  varint record length, then key and value in a tagged binary
+#             encoding (varint ints, length-prefixed UTF-8 strings, ...)
+# Both are self-delimiting, so a codec can split a stream of chunks back into
+# records and merges can read just the key of a record.
+#
+# Every run part is also compressed as a whole with "zlib", "lzma" or "none".
+# Record codec and compression are chosen per KV category in config.json:
+#   "storage_codecs":      {"mapper-output": "binary", ...}
+#   "storage_compression": {"mapper-output": "zlib", ...}
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_LIST = 6
+TAG_DICT = 7
+TAG_BYTE_LIST = 8 # list of ints in [0, 256), one byte per item
+FLOAT = struct.Struct("!d")
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def decode_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def encode_value(value, out):
+    value_type = type(value)
+    if value_type is str:
+        value_bytes = value.encode("utf-8")
+        out.append(TAG_STR)
+        encode_varint(len(value_bytes), out)
+        out += value_bytes
+    elif value_type is int:
+        out.append(TAG_INT)
+        # zigzag, so small negative numbers stay short
+        encode_varint(value << 1 if value >= 0 else ((-value) << 1) - 1, out)
+    elif value_type is list or value_type is tuple:
+        if value and all(type(item) is int for item in value):
+            try:
+                # e.g. the [1, 1, 1, ...] word counts of an uncombined mapper
+                value_bytes = bytes(value)
+                out.append(TAG_BYTE_LIST)
+                encode_varint(len(value_bytes), out)
+                out += value_bytes
+                return
+            except ValueError:
+                pass
+        out.append(TAG_LIST)
+        encode_varint(len(value), out)
+        for item in value:
+            encode_value(item, out)
+    elif value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif value_type is float:
+        out.append(TAG_FLOAT)
+        out += FLOAT.pack(value)
+    elif value_type is dict:
+        out.append(TAG_DICT)
+        encode_varint(len(value), out)
+        for key, item in value.items():
+            encode_value(key, out)
+            encode_value(item, out)
+    else:
+        raise TypeError(f"Cannot encode {value_type.__name__} in a binary record")
+
+def decode_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == TAG_STR:
+        length, pos = decode_varint(data, pos)
+        return str(data[pos:pos + length], "utf-8"), pos + length
+    elif tag == TAG_INT:
+        n, pos = decode_varint(data, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    elif tag == TAG_BYTE_LIST:
+        length, pos = decode_varint(data, pos)
+        return list(data[pos:pos + length]), pos + length
+    elif tag == TAG_LIST:
+        length, pos = decode_varint(data, pos)
+        value = []
+        for _ in range(length):
+            item, pos = decode_value(data, pos)
+            value.append(item)
+        return value, pos
+    elif tag == TAG_NONE:
+        return None, pos
+    elif tag == TAG_TRUE:
+        return True, pos
+    elif tag == TAG_FALSE:
+        return False, pos
+    elif tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, pos)[0], pos + FLOAT.size
+    elif tag == TAG_DICT:
+        length, pos = decode_varint(data, pos)
+        value = {}
+        for _ in range(length):
+            key, pos = decode_value(data, pos)
+            value[key], pos = decode_value(data, pos)
+        return value, pos
+    raise ValueError(f"Unknown binary record tag {tag}")
+
+class JsonLinesCodec:
+    name = "jsonl"
+
+    def encode_record(self, key, value):
+        return (json.dumps(key) + "\t" + json.dumps(value) + "\n").encode("utf-8")
+
+    def iter_raw_records(self, chunks):
+        # record bytes of a stream of chunks; a record may span several chunks
+        partial_line = b""
+        for chunk in chunks:
+            lines = (partial_line + chunk).split(b"\n")
+            partial_line = lines.pop()
+            for line in lines:
+                if line:
+                    yield line + b"\n"
+        if partial_line:
+            yield partial_line + b"\n"
+
+    def iter_keyed_records(self, chunks):
+        # (key, record bytes); JSON escapes tabs inside strings, so the first
+        # tab always ends the key and only the key is decoded
+        for record in self.iter_raw_records(chunks):
+            yield json.loads(record[:record.index(b"\t")]), record
+
+    def iter_records(self, chunks):
+        for record in self.iter_raw_records(chunks):
+            key, value = record.split(b"\t", 1)
+            yield json.loads(key), json.loads(value)
+
+class BinaryCodec:
+    name = "binary"
+
+    def encode_record(self, key, value):
+        body = bytearray()
+        encode_value(key, body)
+        encode_value(value, body)
+        record = bytearray()
+        encode_varint(len(body), record)
+        record += body
+        return bytes(record)
+
+    def iter_record_spans(self, chunks):
+        # (buffer, start, end) of every record body of a stream of chunks;
+        # the buffer is only valid until the next span is requested
+        buffer = b""
+        for chunk in chunks:
+            buffer = buffer + chunk if buffer else bytes(chunk)
+            pos = 0
+            while pos < len(buffer):
+                # the length varint itself may be cut off by the chunk boundary
+                if buffer[pos] & 0x80 and not any(byte < 0x80 for byte in buffer[pos:pos + 10]):
+                    break
+                length, start = decode_varint(buffer, pos)
+                if start + length > len(buffer):
+                    break
+                yield buffer, pos, start, start + length
+                pos = start + length
+            buffer = buffer[pos:]
+        if buffer:
+            raise ValueError(f"Truncated binary record ({len(buffer)} bytes left)")
+
+    def iter_keyed_records(self, chunks):
+        for buffer, record_start, start, end in self.iter_record_spans(chunks):
+            yield decode_value(buffer, start)[0], buffer[record_start:end]
+
+    def iter_records(self, chunks):
+        for buffer, record_start, start, end in self.iter_record_spans(chunks):
+            key, pos = decode_value(buffer, start)
+            yield key, decode_value(buffer, pos)[0]
+
+RECORD_CODECS = {
+    "jsonl": JsonLinesCodec(),
+    "binary": BinaryCodec(),
+}
+
+def compress_bytes(data, compression, level):
+    if compression == "zlib":
+        return zlib.compress(data, level)
+    elif compression == "lzma":
+        return lzma.compress(data, preset=level)
+    elif compression == "none":
+        return data
+    raise ValueError(f"Unknown storage compression: {compression}")
+
+def iter_decompressed_chunks(chunks, compression):
+    # incremental, so a compressed run is never held in memory whole
+    if compression == "none":
+        yield from chunks
+        return
+    if compression == "zlib":
+        decompressor = zlib.decompressobj()
+    elif compression == "lzma":
+        decompressor = lzma.LZMADecompressor()
+    else:
+        raise ValueError(f"Unknown storage compression: {compression}")
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+
+def get_record_codec(config, category):
+    return RECORD_CODECS[config["storage_codecs"][category]]
+
+def get_storage_compression(config, category):
+    return config["storage_compression"][category]
@@ -0,0 +1,49 @@
+import os
+import time
+import logging
+
+# A task (mapperN / reducerN) may run as several attempts when the master
+# starts backups for stragglers. Every attempt writes its output under
+# attempt-specific names (<task_id>-a<attempt>) and then asks the KV store to
+# commit it. The first attempt to commit wins; the output of every other
+# attempt of the task is discarded by the KV store, and readers only ever see
+# committed attempts.
+
+COMMITTED = "COMMITTED\r\n"
+DISCARDED = "DISCARDED\r\n"
+
+def get_attempt_id(task_id, attempt):
+    return str(task_id) + "-a" + str(attempt)
+
+def commit_task_output(kv_client, category, task_id, attempt):
+    # True if this attempt's output is the task's output
+    response = kv_client.request("commit", category, task_id, attempt)
+    print(f"[{task_id}] Commit of attempt {attempt}: {response.strip()}")
+    logging.info(f"[{task_id}] Commit of attempt {attempt}: {response.strip()}")
+    if response not in (COMMITTED, DISCARDED):
+        raise RuntimeError(f"Commit of {get_attempt_id(task_id, attempt)} failed: {response}")
+    return response == COMMITTED
+
+def inject_task_delay(task_id, attempt, config):
+    # testing aid: turn the first attempt of the tasks listed in
+    # inject_task_delays (task id -> seconds) into a straggler
+    delay = config["inject_task_delays"].get(task_id, 0)
+    if delay and attempt == 0:
+        print(f"[{task_id}] Injected delay of {delay} seconds")
+        logging.info(f"[{task_id}] Injected delay of {delay} seconds")
+        time.sleep(delay)
+
+def inject_task_failure(task_id, attempt, config, heartbeat):
+    # testing aid: make the first attempt of the tasks listed in
+    # inject_task_failures (task id -> "crash" or "hang") die before it
+    # commits; a hung attempt stops sending heartbeats but never exits
+    failure = config["inject_task_failures"].get(task_id)
+    if not failure or attempt != 0:
+        return
+    print(f"[{task_id}] Injected failure: {failure}")
+    logging.info(f"[{task_id}] Injected failure: {failure}")
+    if failure == "crash":
+        os._exit(1)
+    heartbeat.stop()
+    while True:
+        time.sleep(60)
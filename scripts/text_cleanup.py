@@ -0,0 +1,94 @@
+import string
+
+def cleanup_lines_list(doc_lines_list):
+    # legacy multi-pass cleanup, kept as the reference TextNormalizer is
+    # checked and benchmarked against (benchmarks/bench_text_cleanup.py)
+
+    # remove punctuations
+    punctuation_set = set(string.punctuation)
+    for i in range(len(doc_lines_list)):
+        doc_lines_list[i] = doc_lines_list[i].translate(str.maketrans('', '', string.punctuation))
+
+    # strip whitespaces and newline chars
+    doc_lines_list = [doc_lines_list[i].strip() for i in range(len(doc_lines_list))]
+
+    # remove blank lines
+    doc_lines_list = [doc_lines_list[i] for i in range(len(doc_lines_list)) if doc_lines_list[i]]
+
+    # convert all words to lower case
+    for i in range(len(doc_lines_list)):
+            doc_lines_list[i] = doc_lines_list[i].lower()
+            line_encode = doc_lines_list[i].encode("ascii", "ignore")
+            doc_lines_list[i] = line_encode.decode()
+    return doc_lines_list
+
+# Translation tables are built once at import time. A single bytes.translate()
+# call then lowercases ASCII letters, maps the ASCII control separators that
+# str.split() treats as whitespace to spaces and deletes punctuation (and,
+# with ASCII folding, every non-ASCII byte) in one pass over the input.
+LOWER_TABLE = bytes.maketrans(
+    string.ascii_uppercase.encode() + b"\x1c\x1d\x1e\x1f",
+    string.ascii_lowercase.encode() + b"    "
+)
+PUNCTUATION_BYTES = string.punctuation.encode()
+NON_ASCII_BYTES = bytes(range(0x80, 0x100))
+
+class TextNormalizer:
+    # Single-pass replacement for cleanup_lines_list that runs in the mappers.
+    #
+    # Input is raw UTF-8 bytes, either a whole split or a stream of chunks.
+    # Output is the same list of lowercased, punctuation-free, non-blank lines
+    # the map functions have always received. With ascii_folding every
+    # non-ASCII byte is dropped (as the legacy encode("ascii", "ignore") did);
+    # without it non-ASCII text is kept and lowercased. Tokens in stopwords or
+    # shorter than min_token_length are removed from each line.
+
+    def __init__(self, ascii_folding=True, stopwords=(), min_token_length=1):
+        self.ascii_folding = ascii_folding
+        self.delete_bytes = PUNCTUATION_BYTES + (NON_ASCII_BYTES if ascii_folding else b"")
+        self.stopwords = frozenset(word.lower() for word in stopwords)
+        self.min_token_length = min_token_length
+        self.filter_tokens = bool(self.stopwords) or min_token_length > 1
+
+    def normalize_bytes(self, data):
+        # list of normalized lines of a complete body of text
+        data = bytes(data).translate(LOWER_TABLE, self.delete_bytes)
+        if self.ascii_folding:
+            text = data.decode("ascii")
+        else:
+            # only non-ASCII letters are left to lowercase
+            text = data.decode("utf-8", "ignore").lower()
+
+        if not self.filter_tokens:
+            return [line for line in map(str.strip, text.split("\n")) if line]
+
+        lines = []
+        stopwords = self.stopwords
+        min_token_length = self.min_token_length
+        for line in text.split("\n"):
+            tokens = [token for token in line.split() if len(token) >= min_token_length and token not in stopwords]
+            if tokens:
+                lines.append(" ".join(tokens))
+        return lines
+
+    def normalize_chunks(self, chunks):
+        # generator over the normalized lines of a stream of byte chunks
+        # (e.g. KVClient.stream()); a line split across chunks is carried over
+        # to the next chunk, and "\n" never occurs inside a multi-byte character
+        partial_line = b""
+        for chunk in chunks:
+            last_newline = chunk.rfind(b"\n")
+            if last_newline == -1:
+                partial_line += chunk
+                continue
+            yield from self.normalize_bytes(partial_line + chunk[:last_newline])
+            partial_line = bytes(chunk[last_newline + 1:])
+        if partial_line:
+            yield from self.normalize_bytes(partial_line)
+
+def get_text_normalizer(config):
+    return TextNormalizer(
+        ascii_folding=config["normalize_ascii_folding"],
+        stopwords=config["normalize_stopwords"],
+        min_token_length=config["normalize_min_token_length"],
+    )
@@ -0,0 +1,13 @@
+import logging
+
+def wordcount_combine_init(mapper_output, mapper_id):
+    print(f"[MAPPER - {mapper_id}] Word count combining started...")
+    logging.info(f"[{mapper_id}] Word count combining started...")
+
+    # collapse [1, 1, 1, ...] into a single partial count per token so that the
+    # shuffle moves one value per distinct token instead of one per occurrence
+    combiner_output = {}
+    for key, val in mapper_output.items():
+        combiner_output[key] = [sum(val)]
+
+    return combiner_output
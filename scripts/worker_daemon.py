@@ -0,0 +1,74 @@
+import multiprocessing as mp
+import socket
+import time
+import logging
+
+from scripts.framing import send_msg, recv_msg
+
+# Worker daemon mode of scripts/mapper.py and scripts/reducer.py: instead of
+# running one task and exiting, the process registers with the master's task
+# dispatcher (utils/dispatcher.py) once and then pulls tasks of its role,
+# across jobs, until it is stopped. Every task runs in a child process, so a
+# crashing or hanging task never takes the daemon down, and carries the
+# config of its job.
+
+def dispatcher_request(dispatcher_addr, payload, timeout):
+    client = socket.create_connection(dispatcher_addr, timeout=timeout)
+    try:
+        send_msg(client, payload)
+        return recv_msg(client)
+    finally:
+        client.close()
+
+def register_worker(dispatcher_addr, worker_id, role, retry_seconds):
+    # the master may not be up yet (or be restarting between jobs)
+    while True:
+        try:
+            return dispatcher_request(dispatcher_addr, ("register", worker_id, role), retry_seconds)
+        except OSError as e:
+            logging.info(f"[{worker_id}] Dispatcher at {dispatcher_addr} unavailable ({e!r}), retrying...")
+            time.sleep(retry_seconds)
+
+def run_task(worker_id, dispatcher_addr, task, task_func, poll_seconds):
+    # runs task in a child process; the task is stopped once its job has
+    # finished (e.g. a straggler whose backup won) or the master is gone
+    process = mp.Process(target=task_func, args=(task["task_id"], task["config"], task["attempt"]))
+    process.start()
+    while True:
+        process.join(poll_seconds)
+        if not process.is_alive():
+            return process.exitcode
+        try:
+            job_active = dispatcher_request(dispatcher_addr, ("job-active", task["job_id"], worker_id), poll_seconds * 2)
+        except OSError:
+            job_active = False
+        if not job_active:
+            print(f"[{worker_id}] {task['job_id']} has finished, stopping {task['task_id']} attempt {task['attempt']}")
+            logging.info(f"[{worker_id}] {task['job_id']} has finished, stopping {task['task_id']} attempt {task['attempt']}")
+            process.terminate()
+            process.join()
+            return process.exitcode
+
+def run_worker_daemon(role, worker_id, config, task_func):
+    # task_func(task_id, config, attempt) runs one task of role
+    dispatcher_addr = (config["master_host"], config["dispatcher_port"])
+    poll_seconds = config["daemon_poll_seconds"]
+    print(f"[{worker_id}] {role} worker daemon started, dispatcher at {dispatcher_addr}")
+    logging.info(f"[{worker_id}] {role} worker daemon started, dispatcher at {dispatcher_addr}")
+    register_worker(dispatcher_addr, worker_id, role, poll_seconds)
+
+    while True:
+        try:
+            # long poll, answered as soon as a task of this role is queued
+            task = dispatcher_request(dispatcher_addr, ("pull", worker_id, role, poll_seconds), poll_seconds * 2)
+        except OSError:
+            register_worker(dispatcher_addr, worker_id, role, poll_seconds)
+            continue
+        if task is None:
+            continue
+
+        print(f"[{worker_id}] Running {task['task_id']} attempt {task['attempt']} of {task['job_id']}")
+        logging.info(f"[{worker_id}] Running {task['task_id']} attempt {task['attempt']} of {task['job_id']}")
+        start_time = time.time()
+        exitcode = run_task(worker_id, dispatcher_addr, task, task_func, poll_seconds)
+        logging.info(f"[{worker_id}] {task['task_id']} attempt {task['attempt']} exited with {exitcode} after {time.time() - start_time:.2f} seconds")
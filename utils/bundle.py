@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import logging
+
+from utils.local_backend import REPO_ROOT, VM_PATH_PREFIX
+
+# Deployment bundle of the VMs: instead of copying the whole repo (dataset
+# copies, KV data, results, .git) and pip installing requirements.txt on every
+# VM, each role gets one gzipped tar of what its processes actually run:
+#   - the scripts package and the job's config.json
+#   - the raw dataset, for the roles that read it from disk: only the KV
+#     store, which serves mappers their splits as "input-range" reads, so a
+#     mapper bundle doesn't grow with the corpus
+#   - the empty KV data & log directories the processes write to
+#   - the packages of bundle_vendor_requirements under _vendor/ (the workers
+#     only use the standard library, so this is empty by default)
+# A bundle is named after the SHA-256 of its contents, which is also written
+# to ~/gcp-map-reduce/.bundle-digest on the VM, so a VM that already has the
+# same bundle is not uploaded to again.
+
+REMOTE_DIR = "gcp-map-reduce"
+DIGEST_FILENAME = ".bundle-digest"
+VENDOR_DIR = "_vendor"
+VENDOR_PYTHONPATH = f"{REMOTE_DIR}/{VENDOR_DIR}"
+DATASET_ROLES = ("kv-store",)
+
+def to_bundle_path(vm_path):
+    # "./gcp-map-reduce/logs/mapper.log" -> "logs/mapper.log"
+    return os.path.normpath(vm_path[len(VM_PATH_PREFIX):]) if vm_path.startswith(VM_PATH_PREFIX) else None
+
+def list_files(local_dir, bundle_dir):
+    members = []
+    for dirpath, dirnames, filenames in os.walk(local_dir):
+        dirnames[:] = sorted(name for name in dirnames if name != "__pycache__")
+        for filename in sorted(filenames):
+            if filename.endswith(".pyc"):
+                continue
+            file_path = os.path.join(dirpath, filename)
+            members.append((os.path.join(bundle_dir, os.path.relpath(file_path, local_dir)), file_path))
+    return members
+
+def vendor_requirements(config):
+    # pip installs the requirements once per distinct list; they have to be
+    # pure Python as they are installed on the master, not on the VMs
+    requirements = sorted(config["bundle_vendor_requirements"])
+    if not requirements:
+        return None
+    requirements_digest = hashlib.sha256("\n".join(requirements).encode()).hexdigest()[:16]
+    vendor_path = os.path.join(config["bundle_path"], f"vendor-{requirements_digest}")
+    if not os.path.isdir(vendor_path):
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "-q", "--no-compile", "--target", vendor_path] + requirements)
+    return vendor_path
+
+def get_bundle_members(config, role):
+    # sorted (bundle path, local file path or bytes) pairs; None marks a directory
+    members = [("__init__.py", os.path.join(REPO_ROOT, "__init__.py"))]
+    members += list_files(os.path.join(REPO_ROOT, "scripts"), "scripts")
+    members.append(("config.json", json.dumps(config, indent=4).encode()))
+    if role in DATASET_ROLES:
+        members += list_files(config["raw_input_data_path"], to_bundle_path(config["mapper_raw_input_data_path"]))
+    vendor_path = vendor_requirements(config)
+    if vendor_path is not None:
+        members += list_files(vendor_path, VENDOR_DIR)
+
+    dir_paths = [config[key] for key in ["input_data_path", "mapper_output_path", "reducer_output_path", "final_output_path"]]
+    dir_paths += [os.path.dirname(config[key]) for key in ["mapper_log_path", "reducer_log_path", "kvstore_log_path"]]
+    members += [(bundle_dir, None) for bundle_dir in {to_bundle_path(path) for path in dir_paths} - {None}]
+    return sorted(members, key=lambda member: member[0])
+
+def read_member(source):
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as fp:
+        return fp.read()
+
+def compute_bundle_digest(members):
+    sha = hashlib.sha256()
+    for bundle_path, source in members:
+        sha.update(bundle_path.encode() + b"\0")
+        if source is not None:
+            data = read_member(source)
+            sha.update(len(data).to_bytes(8, "big") + data)
+    return sha.hexdigest()
+
+def write_bundle_archive(archive_path, members, digest):
+    # fixed mtimes & owners, so the archive only depends on the contents
+    def add_member(tar, bundle_path, data):
+        tarinfo = tarfile.TarInfo(bundle_path)
+        if data is None:
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            tar.addfile(tarinfo)
+        else:
+            tarinfo.size = len(data)
+            tarinfo.mode = 0o644
+            tar.addfile(tarinfo, io.BytesIO(data))
+
+    tmp_path = archive_path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        with gzip.GzipFile(fileobj=fp, mode="wb", mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for bundle_path, source in members:
+                    add_member(tar, bundle_path, None if source is None else read_member(source))
+                add_member(tar, DIGEST_FILENAME, digest.encode() + b"\n")
+    os.replace(tmp_path, archive_path)
+
+def build_bundle(config, role):
+    # returns (archive_path, digest) of role's bundle, reusing an already
+    # built archive with the same contents
+    members = get_bundle_members(config, role)
+    digest = compute_bundle_digest(members)
+    os.makedirs(config["bundle_path"], exist_ok=True)
+    archive_path = os.path.join(config["bundle_path"], f"{digest}.tar.gz")
+    if not os.path.isfile(archive_path):
+        write_bundle_archive(archive_path, members, digest)
+    size = os.path.getsize(archive_path)
+    print(f"[MASTER] {role} bundle {digest[:12]}: {len(members)} entries, {size / 1024:.1f} KB")
+    logging.info(f"{role} bundle {archive_path}: {len(members)} entries, {size} bytes")
+    return archive_path, digest
+
+def deploy_bundle(provisioner, instance_name, bundle):
+    # uploads and unpacks the bundle into ~/gcp-map-reduce unless the VM
+    # already has it; existing KV data & logs are left in place
+    archive_path, digest = bundle
+    if provisioner.shell.ssh(instance_name, f'test "$(cat {REMOTE_DIR}/{DIGEST_FILENAME} 2>/dev/null)" = {digest}') == 0:
+        logging.info(f"{instance_name} already has bundle {digest}")
+        return False
+    remote_archive = os.path.basename(archive_path)
+    returncode = provisioner.shell.scp(instance_name, archive_path, f"~/{remote_archive}")
+    if returncode != 0:
+        raise RuntimeError(f"Copying bundle {digest} to {instance_name} failed with exit code {returncode}")
+    provisioner.run_ssh(instance_name, f"mkdir -p {REMOTE_DIR} && tar -xzf {remote_archive} -C {REMOTE_DIR} && rm {remote_archive}")
+    logging.info(f"Deployed bundle {digest} to {instance_name}")
+    return True
@@ -0,0 +1,128 @@
+import collections
+import socket
+import threading
+import time
+import logging
+
+from scripts.framing import send_msg, recv_msg
+
+class TaskDispatcher:
+    # Task queue of the worker daemons (worker_mode "daemon"). It lives as
+    # long as the master process (the Flask app on the master VM), across
+    # jobs: daemons register once and then long-poll it for tasks of their
+    # role, while every job's master only submits tasks.
+    #
+    # Requests, one per connection, answered with one message:
+    #   ("register", worker_id, role)        -> "REGISTERED"
+    #   ("pull", worker_id, role, wait)      -> task dict or None after wait seconds
+    #   ("job-active", job_id, worker_id)    -> False once the job has finished
+    # A task is {"job_id", "role", "task_id", "attempt", "config"}.
+
+    def __init__(self, dispatcher_addr, worker_timeout):
+        self.dispatcher_addr = dispatcher_addr
+        self.worker_timeout = worker_timeout
+        self.queues = {"mapper": collections.deque(), "reducer": collections.deque()}
+        self.workers = {} # worker_id -> {"role", "registered", "seen", "tasks"}
+        self.active_jobs = set()
+        self.condition = threading.Condition()
+        self.server = None
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.dispatcher_addr)
+        self.server.listen()
+        threading.Thread(target=self.run, daemon=True).start()
+        print(f"[MASTER] Task dispatcher listening at address {self.dispatcher_addr}...")
+        logging.info(f"Task dispatcher listening at address {self.dispatcher_addr}...")
+
+    def run(self):
+        while True:
+            try:
+                conn, client_addr = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.client_handler, args=(conn, client_addr), daemon=True).start()
+
+    def client_handler(self, conn, client_addr):
+        try:
+            send_msg(conn, self.handle_request(recv_msg(conn)))
+        except Exception as e:
+            logging.error(f"Invalid request from worker daemon {client_addr}: {e!r}")
+        finally:
+            conn.close()
+
+    def handle_request(self, payload):
+        if payload[0] == "register":
+            worker_id, role = payload[1:3]
+            with self.condition:
+                self.workers[worker_id] = {"role": role, "registered": time.time(), "seen": time.time(), "tasks": 0}
+            print(f"[MASTER] Worker daemon {worker_id} registered ({role})")
+            logging.info(f"Worker daemon {worker_id} registered ({role})")
+            return "REGISTERED"
+        elif payload[0] == "pull":
+            worker_id, role, wait_seconds = payload[1:4]
+            return self.pull(worker_id, role, wait_seconds)
+        elif payload[0] == "job-active":
+            # asked by daemons while they run a task of the job
+            job_id, worker_id = payload[1:3]
+            with self.condition:
+                if worker_id in self.workers:
+                    self.workers[worker_id]["seen"] = time.time()
+                return job_id in self.active_jobs
+        return "[MASTER] CLIENT_ERROR Invalid Command Received"
+
+    def pull(self, worker_id, role, wait_seconds):
+        deadline = time.time() + wait_seconds
+        with self.condition:
+            if worker_id not in self.workers:
+                # e.g. registered with a previous master process
+                self.workers[worker_id] = {"role": role, "registered": time.time(), "seen": time.time(), "tasks": 0}
+            while True:
+                self.workers[worker_id]["seen"] = time.time()
+                queue = self.queues[role]
+                while queue and queue[0]["job_id"] not in self.active_jobs:
+                    queue.popleft()
+                if queue:
+                    task = queue.popleft()
+                    self.workers[worker_id]["tasks"] += 1
+                    logging.info(f"{task['task_id']} attempt {task['attempt']} of {task['job_id']} pulled by {worker_id}")
+                    return task
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def start_job(self, job_id):
+        with self.condition:
+            self.active_jobs.add(job_id)
+
+    def submit(self, job_id, role, task_id, attempt, config):
+        with self.condition:
+            self.queues[role].append({"job_id": job_id, "role": role, "task_id": task_id, "attempt": attempt, "config": config})
+            self.condition.notify_all()
+
+    def finish_job(self, job_id):
+        # queued tasks of the job are dropped; daemons stop its running ones
+        # the next time they ask whether the job is still active
+        with self.condition:
+            self.active_jobs.discard(job_id)
+            for role in self.queues:
+                self.queues[role] = collections.deque(task for task in self.queues[role] if task["job_id"] != job_id)
+
+    def live_workers(self, role=None):
+        # daemons heard from within worker_timeout seconds
+        now = time.time()
+        with self.condition:
+            return {worker_id: dict(worker) for worker_id, worker in self.workers.items()
+                if now - worker["seen"] <= self.worker_timeout and role in (None, worker["role"])}
+
+# one dispatcher per master process, shared by all of its jobs
+dispatcher = None
+
+def get_dispatcher(config):
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = TaskDispatcher((config["master_host"], config["dispatcher_port"]), config["daemon_poll_seconds"] * 3)
+        dispatcher.start()
+    return dispatcher
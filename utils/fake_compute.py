@@ -0,0 +1,178 @@
+import itertools
+import os
+import re
+import threading
+import time
+
+from utils.bundle import DIGEST_FILENAME
+
+# In-process stand-in for googleapiclient's compute resource
+# (discovery.build('compute', 'v1')) and for the gcloud ssh/scp shell of
+# utils/provisioner.py, with configurable latencies. Used to exercise VM
+# provisioning offline, e.g. by benchmarks/bench_provisioning.py; only the
+# calls made by utils/instance_utils.py are implemented.
+
+class FakeRequest:
+
+    def __init__(self, func):
+        self.func = func
+
+    def execute(self):
+        return self.func()
+
+class FakeCompute:
+    # an instance is PROVISIONING for create_seconds after its insert request,
+    # then RUNNING; its insert operation is DONE at the same time
+
+    def __init__(self, create_seconds=0.0):
+        self.create_seconds = create_seconds
+        self.instances_by_name = {}
+        self.operations = {}
+        self.operation_ids = itertools.count(1)
+        self.ip_suffixes = itertools.count(2)
+        self.lock = threading.Lock()
+
+    def instances(self):
+        return FakeInstances(self)
+
+    def zoneOperations(self):
+        return FakeZoneOperations(self)
+
+    def images(self):
+        return FakeImages()
+
+    def instance_status(self, instance):
+        return "RUNNING" if time.time() >= instance["running_at"] else "PROVISIONING"
+
+    def running_since(self, name):
+        # seconds since the instance is RUNNING, None if it is not (yet)
+        with self.lock:
+            instance = self.instances_by_name.get(name)
+            if instance is None or self.instance_status(instance) != "RUNNING":
+                return None
+            return time.time() - instance["running_at"]
+
+    def instance_obj(self, instance):
+        obj = {key: value for key, value in instance.items() if key != "running_at"}
+        obj["status"] = self.instance_status(instance)
+        return obj
+
+    def insert(self, body):
+        with self.lock:
+            operation_name = f"operation-{next(self.operation_ids)}"
+            done_at = time.time() + self.create_seconds
+            operation = {"name": operation_name, "done_at": done_at}
+            if body["name"] in self.instances_by_name:
+                operation["error"] = {"errors": [{"code": "RESOURCE_ALREADY_EXISTS",
+                    "message": f"The resource '{body['name']}' already exists"}]}
+            else:
+                suffix = next(self.ip_suffixes)
+                self.instances_by_name[body["name"]] = {
+                    "name": body["name"],
+                    "machineType": body["machineType"],
+                    "networkInterfaces": [{
+                        "networkIP": f"10.132.0.{suffix}",
+                        "accessConfigs": [{"type": "ONE_TO_ONE_NAT", "name": "External NAT", "natIP": f"203.0.113.{suffix}"}],
+                    }],
+                    "running_at": done_at,
+                }
+            self.operations[operation_name] = operation
+            return {"name": operation_name, "status": "RUNNING"}
+
+    def get_operation(self, operation_name):
+        with self.lock:
+            operation = self.operations[operation_name]
+            result = {"name": operation_name, "status": "DONE" if time.time() >= operation["done_at"] else "RUNNING"}
+            if result["status"] == "DONE" and "error" in operation:
+                result["error"] = operation["error"]
+            return result
+
+class FakeInstances:
+
+    def __init__(self, compute):
+        self.compute = compute
+
+    def insert(self, project, zone, body):
+        return FakeRequest(lambda: self.compute.insert(body))
+
+    def get(self, project, zone, instance):
+        def get_instance():
+            with self.compute.lock:
+                if instance not in self.compute.instances_by_name:
+                    raise KeyError(f"The resource '{instance}' was not found")
+                return self.compute.instance_obj(self.compute.instances_by_name[instance])
+        return FakeRequest(get_instance)
+
+    def list(self, project, zone):
+        def list_instances():
+            with self.compute.lock:
+                items = [self.compute.instance_obj(instance) for instance in self.compute.instances_by_name.values()]
+            return {"items": items} if items else {}
+        return FakeRequest(list_instances)
+
+    def delete(self, project, zone, instance):
+        def delete_instance():
+            with self.compute.lock:
+                self.compute.instances_by_name.pop(instance, None)
+            return {"name": f"delete-{instance}", "status": "DONE"}
+        return FakeRequest(delete_instance)
+
+class FakeZoneOperations:
+
+    def __init__(self, compute):
+        self.compute = compute
+
+    def get(self, project, zone, operation):
+        return FakeRequest(lambda: self.compute.get_operation(operation))
+
+class FakeImages:
+
+    def getFromFamily(self, project, family):
+        return FakeRequest(lambda: {"selfLink": f"projects/{project}/global/images/family/{family}"})
+
+class FakeShell:
+    # ssh fails (exit code 255, like gcloud) until the VM has been RUNNING for
+    # ssh_ready_seconds; after that every command takes command_seconds and
+    # every copy scp_seconds plus its size over scp_bytes_per_second. Commands succeed without running, except the
+    # bundle digest check of utils/bundle.py, which only succeeds once the
+    # bundle was unpacked on the VM.
+
+    def __init__(self, compute, ssh_ready_seconds=0.0, command_seconds=0.0, scp_seconds=0.0, scp_bytes_per_second=None):
+        self.compute = compute
+        self.ssh_ready_seconds = ssh_ready_seconds
+        self.command_seconds = command_seconds
+        self.scp_seconds = scp_seconds
+        self.scp_bytes_per_second = scp_bytes_per_second
+        self.commands = [] # (instance_name, command) of every successful ssh
+        self.copied_bytes = 0
+        self.bundles = {} # instance_name -> digest of the unpacked bundle
+        self.lock = threading.Lock()
+
+    def is_reachable(self, instance_name):
+        running_since = self.compute.running_since(instance_name)
+        return running_since is not None and running_since >= self.ssh_ready_seconds
+
+    def ssh(self, instance_name, command):
+        if not self.is_reachable(instance_name):
+            return 255
+        time.sleep(self.command_seconds)
+        with self.lock:
+            self.commands.append((instance_name, command))
+            if command.startswith("test ") and DIGEST_FILENAME in command:
+                return 0 if self.bundles.get(instance_name) in command.split() else 1
+            for archive_name in re.findall(r"tar -xzf (\S+)\.tar\.gz", command):
+                self.bundles[instance_name] = archive_name
+        return 0
+
+    def scp(self, instance_name, local_path, remote_path):
+        if not self.is_reachable(instance_name):
+            return 255
+        if not os.path.exists(local_path):
+            return 1
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(local_path) if os.path.isdir(local_path) else [("", [], [local_path])]:
+            size += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+        time.sleep(self.scp_seconds + (size / self.scp_bytes_per_second if self.scp_bytes_per_second else 0))
+        with self.lock:
+            self.copied_bytes += size
+        return 0
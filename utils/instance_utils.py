@@ -39,7 +39,7 @@ def create_instance(compute, project, zone, name):
         body=config).execute()
 
 
-def wait_for_operation(compute, project, zone, operation):
+def wait_for_operation(compute, project, zone, operation, poll_interval=1):
     print('Waiting for operation to finish...')
     while True:
         result = compute.zoneOperations().get(
@@ -53,7 +53,7 @@ def wait_for_operation(compute, project, zone, operation):
                 raise Exception(result['error'])
             return result
 
-        time.sleep(1)
+        time.sleep(poll_interval)
 
 def get_instance_obj(compute, project, zone, instance_name):
     instances = list_instances(compute, project, zone)
@@ -61,6 +61,10 @@ def get_instance_obj(compute, project, zone, instance_name):
         if instance_obj["name"] == instance_name:
             return instance_obj
 
+def get_instance(compute, project, zone, instance_name):
+    # one instance by name, without listing the whole zone
+    return compute.instances().get(project=project, zone=zone, instance=instance_name).execute()
+
 def get_instance_internal_ip(instance_obj):
     return instance_obj["networkInterfaces"][0]["networkIP"]
 
@@ -0,0 +1,188 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+import logging
+
+from utils.task_tracker import JobCancelled
+
+# Background job runner of the Flask app: submitted jobs are queued and run
+# by job_max_concurrent runner threads, so a submission returns a job ID at
+# once and the job's progress is polled through GET /jobs/<id>.
+#
+# Every job's master (master_init) reports its phase, input and task
+# trackers to the job's JobProgress, and stops at the next phase boundary or
+# wait loop iteration once the job is cancelled; its workers are released
+# as when a job fails.
+#
+# Jobs run side by side on the same KV store and worker fleet, their KV
+# objects kept apart by job ID. An exclusive job (see
+# master.runs_exclusively) waits until no other job runs, and no job starts
+# while it runs.
+
+FINISHED_STATES = ["succeeded", "failed", "cancelled"]
+
+class JobProgress:
+
+    def __init__(self, job_id, overrides, exclusive=False):
+        self.job_id = job_id
+        self.overrides = overrides
+        self.exclusive = exclusive
+        self.state = "queued" # running, then succeeded, failed or cancelled
+        self.phase = "queued" # provisioning, splitting, map, reduce, combine, done
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.phase_started = {}
+        self.input_bytes = {} # mapper id -> bytes of its input splits
+        self.trackers = [] # TaskTracker of the mappers & reducers, once created
+        self.cancelled = threading.Event()
+
+    def set_phase(self, phase):
+        # a job that got to "done" has its output, cancelled or not
+        if phase != "done":
+            self.check_cancelled()
+        self.phase = phase
+        self.phase_started[phase] = time.time()
+        print(f"[MASTER] Job {self.job_id}: {phase}")
+        logging.info(f"Job {self.job_id}: {phase}")
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise JobCancelled(f"job {self.job_id} was cancelled")
+
+    def status(self):
+        now = time.time()
+        status = {
+            "job_id": self.job_id,
+            "state": self.state,
+            "phase": self.phase,
+            "overrides": self.overrides,
+            "error": self.error,
+            "cancel_requested": self.cancelled.is_set(),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed_seconds": ((self.finished or now) - self.started) if self.started else None,
+        }
+        tasks = {}
+        for tracker in self.trackers:
+            tasks.update(tracker.task_states())
+        status["tasks"] = tasks
+
+        # throughput since the map phase started, and a linear ETA over the
+        # map & reduce tasks (the combine phase is not included)
+        tasks_done = sum(1 for task in tasks.values() if task["state"] in ("completed", "cached"))
+        map_started = self.phase_started.get("map")
+        map_elapsed = ((self.finished or now) - map_started) if map_started else None
+        mapper_tasks = self.trackers[0].task_states() if self.trackers else {}
+        bytes_done = sum(self.input_bytes.get(task_id, 0) for task_id, task in mapper_tasks.items() if task["state"] in ("completed", "cached"))
+        status["progress"] = {"tasks_done": tasks_done, "tasks_total": len(tasks),
+            "input_bytes_done": bytes_done, "input_bytes_total": sum(self.input_bytes.values())}
+        status["throughput"] = None
+        status["eta_seconds"] = None
+        if map_elapsed:
+            status["throughput"] = {"tasks_per_second": tasks_done / map_elapsed, "input_bytes_per_second": bytes_done / map_elapsed}
+            if tasks_done and self.state == "running":
+                status["eta_seconds"] = map_elapsed * (len(tasks) - tasks_done) / tasks_done
+        return status
+
+class JobScheduler:
+    # run_job(overrides, progress) runs one job (master.master_init)
+
+    def __init__(self, run_job, max_concurrent, history_size):
+        self.run_job = run_job
+        self.history_size = history_size
+        self.jobs = collections.OrderedDict() # job_id -> JobProgress, in submission order
+        self.pending = queue.Queue()
+        self.job_numbers = itertools.count(1)
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.running_jobs = 0
+        self.running_exclusive = False
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(max_concurrent)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, operation_name, overrides, exclusive=False):
+        with self.lock:
+            # jobs submitted within the same millisecond differ in the counter
+            job_id = f"{operation_name}-{int(time.time() * 1000)}-{next(self.job_numbers)}"
+            self.jobs[job_id] = JobProgress(job_id, overrides, exclusive)
+            self.drop_finished_jobs()
+        self.pending.put(job_id)
+        print(f"[MASTER] Job {job_id} queued ({self.pending.qsize()} queued)")
+        logging.info(f"Job {job_id} queued with overrides {overrides}")
+        return job_id
+
+    def drop_finished_jobs(self):
+        # keeps the status of the last history_size finished jobs
+        finished = [job_id for job_id, progress in self.jobs.items() if progress.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self.jobs[job_id]
+
+    def run(self):
+        while True:
+            job_id = self.pending.get()
+            with self.lock:
+                progress = self.jobs.get(job_id)
+                if progress is None:
+                    continue
+                while self.running_exclusive or (progress.exclusive and self.running_jobs):
+                    self.slot_freed.wait()
+                if progress.state != "queued":
+                    # cancelled while queued
+                    continue
+                progress.state = "running"
+                progress.started = time.time()
+                self.running_jobs += 1
+                self.running_exclusive = progress.exclusive
+            try:
+                self.run_job(progress.overrides, progress)
+                progress.state = "succeeded"
+            except JobCancelled:
+                progress.state = "cancelled"
+            except Exception as e:
+                progress.state = "failed"
+                progress.error = repr(e)
+                logging.exception(f"Job {job_id} failed")
+            progress.finished = time.time()
+            with self.lock:
+                self.running_jobs -= 1
+                self.running_exclusive = False
+                self.slot_freed.notify_all()
+            print(f"[MASTER] Job {job_id} {progress.state} after {progress.finished - progress.started:.2f} seconds")
+            logging.info(f"Job {job_id} {progress.state} after {progress.finished - progress.started:.2f} seconds")
+
+    def status(self, job_id):
+        progress = self.jobs.get(job_id)
+        return progress.status() if progress is not None else None
+
+    def list_jobs(self):
+        return [{"job_id": job_id, "state": progress.state, "phase": progress.phase} for job_id, progress in list(self.jobs.items())]
+
+    def cancel(self, job_id):
+        # returns the job's state after the request, None for an unknown job
+        with self.lock:
+            progress = self.jobs.get(job_id)
+            if progress is None:
+                return None
+            if progress.state == "queued":
+                progress.state = "cancelled"
+                progress.finished = time.time()
+            elif progress.state == "running":
+                progress.cancelled.set()
+            state = progress.state
+        logging.info(f"Cancellation of job {job_id} requested ({state})")
+        return state
+
+# one scheduler per master process
+scheduler = None
+
+def get_job_scheduler(config, run_job):
+    global scheduler
+    if scheduler is None:
+        scheduler = JobScheduler(run_job, config["job_max_concurrent"], config["job_history_size"])
+    return scheduler
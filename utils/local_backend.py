@@ -0,0 +1,133 @@
+import atexit
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import logging
+
+from scripts import mapper
+from scripts import reducer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_ROOT, "scripts")
+
+# On the VMs every process runs from the home directory with the repo copied to
+# ~/gcp-map-reduce, so the KV/worker paths in config.json carry this prefix.
+# Locally everything runs from the repo root instead.
+VM_PATH_PREFIX = "./gcp-map-reduce/"
+LOCAL_HOST = "127.0.0.1"
+
+# local KV store shared by the jobs of a long-lived master (the Flask app's
+# job scheduler), which run side by side against the one KV store port
+shared_kv_process = None
+shared_kv_lock = threading.Lock()
+
+def localize_config(config):
+    # return a copy of config that points every component at this host
+    local_config = dict(config)
+    for key, val in config.items():
+        if key.endswith("_path") and isinstance(val, str) and val.startswith(VM_PATH_PREFIX):
+            local_config[key] = "./" + val[len(VM_PATH_PREFIX):]
+    local_config["master_host"] = LOCAL_HOST
+    local_config["kv_store_host"] = LOCAL_HOST
+
+    for key in ["input_data_path", "mapper_output_path", "reducer_output_path", "final_output_path"]:
+        os.makedirs(local_config[key], exist_ok=True)
+    return local_config
+
+def write_local_config(config):
+    # the KV store and subprocess workers read their config from disk, just like the VMs do
+    with open(config["local_config_path"], "w") as fp:
+        json.dump(config, fp, indent=4)
+
+def get_local_worker_count(config):
+    return config["local_worker_processes"] or os.cpu_count()
+
+def wait_for_kv_store(kv_store_addr, timeout=30):
+    # poll the port instead of sleeping for a fixed amount of time
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with socket.create_connection(kv_store_addr, timeout=1):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+def launch_local_kv_store(config):
+    # separate process (not a multiprocessing child) so that the KV store can
+    # run its own process pool; stopped at exit even if the job fails
+    kv_store_addr = (config["kv_store_host"], config["kv_store_port"])
+    write_local_config(config)
+    script_path = os.path.join(SCRIPTS_DIR, "kv_store_server.py")
+    kv_process = subprocess.Popen([sys.executable, script_path, config["local_config_path"], config["kv_store_host"]])
+    atexit.register(kv_process.terminate)
+    wait_for_kv_store(kv_store_addr)
+    print(f"[MASTER] Local KV Store started at {kv_store_addr} (pid {kv_process.pid})")
+    logging.info(f"Local KV Store started at {kv_store_addr} (pid {kv_process.pid})")
+    return kv_process
+
+def get_shared_local_kv_store(config):
+    # the running shared KV store, started by the first job that needs it
+    global shared_kv_process
+    with shared_kv_lock:
+        if shared_kv_process is None or shared_kv_process.poll() is not None:
+            shared_kv_process = launch_local_kv_store(config)
+    return shared_kv_process
+
+def run_local_mapper(mapper_id, config, attempt=0):
+    # entry point of a pool worker: same steps as scripts/mapper.py on a VM
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    map_func, _ = mapper.import_map_reduce_functions(config)
+    combine_func = mapper.import_combiner_function(config)
+    mapper.mapper_init(mapper_id, map_func, config, combine_func, attempt)
+
+def run_local_reducer(reducer_id, config, attempt=0):
+    # entry point of a pool worker: same steps as scripts/reducer.py on a VM
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    _, reduce_func = reducer.import_map_reduce_functions(config)
+    reducer.reducer_init(reducer_id, reduce_func, config, attempt)
+
+def log_worker_error(error):
+    print(f"[MASTER] Local worker failed: {error!r}")
+    logging.error(f"Local worker failed: {error!r}")
+
+def launch_local_task(pool, config, role, task_id, attempt=0):
+    # one attempt of a task; returns a handle to cleanup
+    if config["execution_backend"] == "local-subprocess":
+        script_path = os.path.join(SCRIPTS_DIR, f"{role}.py")
+        return subprocess.Popen([sys.executable, script_path, task_id, config["local_config_path"], str(attempt)])
+    target = run_local_mapper if role == "mapper" else run_local_reducer
+    return pool.apply_async(target, (task_id, config, attempt), error_callback=log_worker_error)
+
+def launch_local_workers(pool, config, role, task_ids=None):
+    # role is "mapper" or "reducer"; every task of role unless task_ids are
+    # given. Returns handles to cleanup
+    if task_ids is None:
+        task_ids = [f"{role}{i}" for i in range(1, config[f"{role}_count"]+1)]
+    handles = []
+    for task_id in task_ids:
+        handles.append(launch_local_task(pool, config, role, task_id))
+    print(f"[MASTER] Launched {len(task_ids)} local {role} tasks ({config['execution_backend']})")
+    logging.info(f"Launched {len(task_ids)} local {role} tasks ({config['execution_backend']})")
+    return handles
+
+def stop_local_backend(pool, kv_process, handles):
+    # every task has a committed attempt by now; attempts still running are
+    # stragglers whose output would be discarded, so they are stopped
+    for handle in handles:
+        if isinstance(handle, subprocess.Popen) and handle.poll() is None:
+            handle.terminate()
+            handle.wait()
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    if kv_process is not None:
+        kv_process.terminate()
+        kv_process.wait()
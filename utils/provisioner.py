@@ -0,0 +1,105 @@
+import subprocess
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.instance_utils import create_instance, get_instance
+from utils.bundle import deploy_bundle, REMOTE_DIR, VENDOR_PYTHONPATH
+
+# Concurrent VM provisioning. Every VM of a group goes through its own
+# pipeline on a worker thread:
+#   create -> wait for the create operation -> wait until it accepts SSH -> setup
+# so a group of N VMs is up after about one VM boot instead of N, and every
+# step polls for readiness instead of sleeping for a fixed time.
+#
+# The compute resource is googleapiclient's, or utils/fake_compute.py's for
+# offline tests and benchmarks. googleapiclient's HTTP transport is not
+# thread-safe, so API calls are serialized; only the waiting runs in parallel.
+
+class GcloudShell:
+    # ssh/scp to the VMs through the gcloud CLI; both return the exit code
+
+    def __init__(self, zone):
+        self.zone = zone
+
+    def ssh(self, instance_name, command):
+        return subprocess.call(["gcloud", "compute", "ssh", instance_name, f"--zone={self.zone}", "--", command],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def scp(self, instance_name, local_path, remote_path):
+        return subprocess.call(["gcloud", "compute", "scp", "--recurse", local_path, f"{instance_name}:{remote_path}", f"--zone={self.zone}"])
+
+class Provisioner:
+
+    def __init__(self, compute, config, shell=None):
+        self.compute = compute
+        self.project = config["project_id"]
+        self.zone = config["zone"]
+        self.max_workers = config["provision_max_workers"]
+        self.poll_interval = config["provision_poll_seconds"]
+        self.ready_timeout = config["provision_ready_timeout"]
+        self.shell = shell or GcloudShell(self.zone)
+        self.api_lock = threading.Lock()
+
+    def call_api(self, request_func):
+        with self.api_lock:
+            return request_func()
+
+    def wait_until(self, is_ready, description):
+        deadline = time.time() + self.ready_timeout
+        while not is_ready():
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out after {self.ready_timeout} seconds waiting for {description}")
+            time.sleep(self.poll_interval)
+
+    def wait_for_operation(self, operation_name):
+        def is_done():
+            result = self.call_api(lambda: self.compute.zoneOperations().get(
+                project=self.project, zone=self.zone, operation=operation_name).execute())
+            if result["status"] == "DONE" and "error" in result:
+                raise RuntimeError(f"Operation {operation_name} failed: {result['error']}")
+            return result["status"] == "DONE"
+        self.wait_until(is_done, f"operation {operation_name}")
+
+    def run_ssh(self, instance_name, command):
+        returncode = self.shell.ssh(instance_name, command)
+        if returncode != 0:
+            raise RuntimeError(f"'{command}' failed on {instance_name} with exit code {returncode}")
+
+    def provision_instance(self, instance_name, setup_func):
+        start_time = time.time()
+        operation = self.call_api(lambda: create_instance(compute=self.compute, project=self.project, zone=self.zone, name=instance_name))
+        self.wait_for_operation(operation["name"])
+        # a RUNNING VM still needs a while before sshd accepts connections
+        self.wait_until(lambda: self.shell.ssh(instance_name, "true") == 0, f"SSH on {instance_name}")
+        ready_time = time.time()
+        if setup_func is not None:
+            setup_func(self, instance_name)
+        instance_obj = self.call_api(lambda: get_instance(self.compute, self.project, self.zone, instance_name))
+        logging.info(f"Provisioned {instance_name}: ready after {ready_time - start_time:.2f}s, set up after {time.time() - start_time:.2f}s")
+        return instance_obj
+
+    def provision(self, instance_names, setup_func=None):
+        # creates the VMs concurrently and runs setup_func(provisioner, name)
+        # on each as soon as it accepts SSH; returns name -> instance object
+        start_time = time.time()
+        max_workers = self.max_workers or len(instance_names)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {name: executor.submit(self.provision_instance, name, setup_func) for name in instance_names}
+            instance_objs = {name: future.result() for name, future in futures.items()}
+        print(f"[MASTER] Provisioned {len(instance_names)} VMs in {time.time() - start_time:.2f} seconds: {instance_names}")
+        logging.info(f"Provisioned {len(instance_names)} VMs in {time.time() - start_time:.2f} seconds: {instance_names}")
+        return instance_objs
+
+def start_script(bundle, script, *args):
+    # setup_func that deploys the bundle (see utils/bundle.py) and starts
+    # script in the background, outliving the ssh session; its output goes to
+    # ~/<script name>.log
+    log_name = script.split("/")[-1].replace(".py", ".log")
+    command = " ".join([f"PYTHONPATH={VENDOR_PYTHONPATH}", "nohup", "python3", f"{REMOTE_DIR}/scripts/{script}"] + [str(arg) for arg in args]) + f" > {log_name} 2>&1 &"
+
+    def setup(provisioner, instance_name):
+        deploy_bundle(provisioner, instance_name, bundle)
+        provisioner.run_ssh(instance_name, command)
+    return setup
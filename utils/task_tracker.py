@@ -0,0 +1,285 @@
+import queue
+import socket
+import statistics
+import threading
+import time
+import logging
+
+from scripts.framing import recv_msg
+
+class AckListener:
+    # Accepts worker connections on the master socket in a background thread
+    # and queues their messages, e.g. ("mapper1", "DONE", 0). The master then
+    # waits on the queue with a timeout instead of blocking in accept(), so it
+    # can act (start backup attempts) while tasks are still running.
+
+    def __init__(self, master_server):
+        self.master_server = master_server
+        self.messages = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        self.master_server.settimeout(0.5)
+        while not self.stopped.is_set():
+            try:
+                conn, client_addr = self.master_server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                conn.settimeout(30)
+                self.messages.put(recv_msg(conn))
+            except Exception as e:
+                logging.error(f"Invalid message from worker {client_addr}: {e!r}")
+            finally:
+                conn.close()
+
+    def get(self, timeout):
+        # next worker message; raises queue.Empty after timeout seconds
+        return self.messages.get(timeout=timeout)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+class JobCancelled(Exception):
+    # raised in the master when its job is cancelled through the job scheduler
+    pass
+
+class TaskTracker:
+    # Attempts of the tasks of one phase (all mappers or all reducers).
+    #
+    # Workers report STARTED when an attempt begins running (it may sit in a
+    # queue before that), HEARTBEAT every heartbeat_interval seconds while it
+    # runs, and DONE/DISCARDED/FAILED when it ends. The first attempt of a task
+    # to report DONE completes it; any later report for the task is ignored
+    # (its output was discarded by the KV store's commit).
+    #
+    # An attempt is lost when it reports FAILED, when it goes heartbeat_timeout
+    # seconds without a message, or when it has not started task_start_timeout
+    # seconds after it was launched. A task without a live attempt is
+    # re-executed, on another worker where workers are tracked; the job fails
+    # once a task has lost task_max_failures attempts or no worker is left.
+    #
+    # Once some tasks have completed, an attempt that has been running for
+    # speculative_slowdown x the median task duration (and at least
+    # speculative_min_seconds) gets a backup attempt, up to
+    # speculative_max_attempts attempts per task besides lost ones.
+    #
+    # launch_attempt(task_id, attempt, workers) starts an attempt on the first
+    # usable worker of workers and returns it ("" when workers are not
+    # tracked, e.g. the local backends) or None if it could not be started.
+    # Once the optional cancelled event is set, wait() raises JobCancelled.
+
+    def __init__(self, role, task_ids, config, launch_attempt, cancelled=None):
+        self.role = role
+        self.task_ids = list(task_ids)
+        self.launch_attempt = launch_attempt
+        self.cancelled = cancelled
+        self.speculative_execution = config["speculative_execution"]
+        self.slowdown = config["speculative_slowdown"]
+        self.min_seconds = config["speculative_min_seconds"]
+        self.max_attempts = config["speculative_max_attempts"]
+        self.heartbeat_timeout = config["heartbeat_timeout"]
+        self.start_timeout = config["task_start_timeout"]
+        self.max_failures = config["task_max_failures"]
+
+        self.attempts = {task_id: [] for task_id in self.task_ids} # [{"launched", "start", "seen", "worker", "backup", "finished", "lost"}]
+        self.completed = {} # task_id -> {"attempt", "duration"}
+        self.failed_workers = set()
+        self.backups_launched = 0
+        self.reexecutions = 0
+
+    def start_attempt(self, task_id, worker="", backup=False):
+        # records a launched attempt; its clock starts when it reports STARTED
+        now = time.time()
+        self.attempts[task_id].append({"launched": now, "start": None, "seen": now, "worker": worker, "backup": backup, "finished": False, "lost": False})
+        return len(self.attempts[task_id]) - 1
+
+    def complete_cached(self, task_id):
+        # a task whose output was restored from the map cache, never run
+        self.completed[task_id] = {"attempt": None, "duration": None}
+
+    def task_states(self):
+        # {task_id: {"state", "attempts", "duration"}}, state being pending
+        # (not launched yet), queued (launched, not started), running,
+        # completed or cached (restored from the map cache)
+        states = {}
+        for task_id in self.task_ids:
+            task_attempts = self.attempts[task_id]
+            live_attempts = [task_attempt for task_attempt in task_attempts if self.is_live(task_attempt)]
+            if task_id in self.completed:
+                state = "cached" if self.completed[task_id]["attempt"] is None and not task_attempts else "completed"
+            elif any(task_attempt["start"] is not None for task_attempt in live_attempts):
+                state = "running"
+            elif live_attempts:
+                state = "queued"
+            else:
+                state = "pending"
+            duration = self.completed[task_id]["duration"] if task_id in self.completed else None
+            states[task_id] = {"state": state, "attempts": len(task_attempts), "duration": duration}
+        return states
+
+    def idle_workers(self):
+        # workers whose attempts have all reported back
+        busy_workers = set()
+        idle_workers = set()
+        for task_attempts in self.attempts.values():
+            for task_attempt in task_attempts:
+                if task_attempt["finished"]:
+                    idle_workers.add(task_attempt["worker"])
+                else:
+                    busy_workers.add(task_attempt["worker"])
+        return sorted(idle_workers - busy_workers - self.failed_workers - {""})
+
+    def healthy_workers(self):
+        # idle workers first, then busy ones, never a worker that lost an attempt
+        workers = {task_attempt["worker"] for task_attempts in self.attempts.values() for task_attempt in task_attempts}
+        idle_workers = self.idle_workers()
+        return idle_workers + sorted(workers - set(idle_workers) - self.failed_workers - {""})
+
+    def is_live(self, task_attempt):
+        return not task_attempt["finished"] and not task_attempt["lost"]
+
+    def handle_message(self, payload):
+        task_id, status = payload[0], payload[1]
+        attempt = payload[2] if len(payload) > 2 else 0
+        if task_id not in self.attempts or attempt >= len(self.attempts[task_id]):
+            # e.g. a mapper attempt that lost and reports during the reduce phase
+            logging.info(f"Ignoring {status} from {task_id} attempt {attempt} (not a running {self.role} attempt)")
+            return
+
+        task_attempt = self.attempts[task_id][attempt]
+        task_attempt["seen"] = time.time()
+        if status == "HEARTBEAT":
+            return
+        if status == "STARTED":
+            task_attempt["start"] = time.time()
+            logging.info(f"{task_id} attempt {attempt} started")
+            return
+        if status == "FAILED":
+            if self.is_live(task_attempt):
+                self.lose_attempt(task_id, attempt, "reported a failure")
+            return
+        task_attempt["finished"] = True
+        duration = time.time() - (task_attempt["start"] or task_attempt["launched"])
+        if task_id in self.completed:
+            print(f"[MASTER] {task_id} attempt {attempt} finished after the task completed ({status}), output discarded")
+            logging.info(f"{task_id} attempt {attempt} finished after the task completed ({status}), output discarded")
+        elif status == "DONE":
+            # a lost attempt that reports DONE after all did commit first
+            self.completed[task_id] = {"attempt": attempt, "duration": duration}
+            print(f"[MASTER] {task_id} task completed by attempt {attempt} in {duration:.2f} seconds")
+            logging.info(f"{task_id} task completed by attempt {attempt} in {duration:.2f} seconds")
+        else:
+            # DISCARDED before any DONE: an earlier attempt committed the
+            # task's output but was lost before it could report DONE
+            self.completed[task_id] = {"attempt": None, "duration": duration}
+            print(f"[MASTER] {task_id} task was committed by an attempt that did not report back")
+            logging.info(f"{task_id} task was committed by an attempt that did not report back (attempt {attempt} {status})")
+
+    def lose_attempt(self, task_id, attempt, reason):
+        task_attempt = self.attempts[task_id][attempt]
+        task_attempt["lost"] = True
+        if task_attempt["worker"]:
+            self.failed_workers.add(task_attempt["worker"])
+        print(f"[MASTER] {task_id} attempt {attempt} lost: {reason}")
+        logging.error(f"{task_id} attempt {attempt} lost: {reason} {task_attempt['worker']}")
+
+    def check_timeouts(self):
+        now = time.time()
+        for task_id in self.task_ids:
+            if task_id in self.completed:
+                continue
+            task_attempts = self.attempts[task_id]
+            if not task_attempts:
+                # not launched yet, e.g. reducers before reduce_slowstart
+                continue
+            for attempt, task_attempt in enumerate(task_attempts):
+                if not self.is_live(task_attempt):
+                    continue
+                if task_attempt["start"] is None and now - task_attempt["launched"] > self.start_timeout:
+                    self.lose_attempt(task_id, attempt, f"not started after {self.start_timeout} seconds")
+                elif task_attempt["start"] is not None and now - task_attempt["seen"] > self.heartbeat_timeout:
+                    self.lose_attempt(task_id, attempt, f"no heartbeat for {self.heartbeat_timeout} seconds")
+
+            if any(self.is_live(task_attempt) for task_attempt in task_attempts):
+                continue
+            failures = sum(1 for task_attempt in task_attempts if task_attempt["lost"])
+            if failures >= self.max_failures:
+                raise RuntimeError(f"{task_id} failed: {failures} attempts lost")
+            attempt = len(task_attempts)
+            worker = self.launch_attempt(task_id, attempt, self.healthy_workers())
+            if worker is None:
+                raise RuntimeError(f"{task_id} failed: no worker left to re-execute it on")
+            self.start_attempt(task_id, worker)
+            self.reexecutions += 1
+            print(f"[MASTER] {task_id} has no live attempt, re-executing it as attempt {attempt}")
+            logging.info(f"{task_id} has no live attempt, re-executing it as attempt {attempt} {worker}")
+
+    def check_stragglers(self):
+        durations = [task["duration"] for task in self.completed.values() if task["duration"] is not None]
+        if not self.speculative_execution or not durations:
+            return
+        median_duration = statistics.median(durations)
+        threshold = max(self.slowdown * median_duration, self.min_seconds)
+        now = time.time()
+        for task_id in self.task_ids:
+            task_attempts = self.attempts[task_id]
+            if task_id in self.completed:
+                continue
+            live_attempts = [task_attempt for task_attempt in task_attempts if self.is_live(task_attempt)]
+            failures = sum(1 for task_attempt in task_attempts if task_attempt["lost"])
+            if len(live_attempts) != 1 or len(task_attempts) - failures >= self.max_attempts:
+                continue
+            if live_attempts[0]["start"] is None:
+                # still queued, not slow
+                continue
+            elapsed = now - live_attempts[0]["start"]
+            if elapsed < threshold:
+                continue
+            attempt = len(task_attempts)
+            worker = self.launch_attempt(task_id, attempt, self.idle_workers())
+            if worker is None:
+                continue
+            self.start_attempt(task_id, worker, backup=True)
+            self.backups_launched += 1
+            print(f"[MASTER] {task_id} running for {elapsed:.2f}s (median {median_duration:.2f}s), started backup attempt {attempt}")
+            logging.info(f"{task_id} running for {elapsed:.2f}s (median {median_duration:.2f}s), started backup attempt {attempt} {worker}")
+
+    def wait(self, ack_listener, poll_interval=0.1, other_trackers=(), min_completed=None):
+        # barrier: returns once every task (or min_completed tasks) has a
+        # completed attempt. other_trackers are the phases running alongside
+        # this one (reducers started while mappers run): their messages are
+        # routed to them and their attempts are checked too
+        trackers = [self] + list(other_trackers)
+        target = len(self.task_ids) if min_completed is None else min(min_completed, len(self.task_ids))
+        while len(self.completed) < target:
+            if self.cancelled is not None and self.cancelled.is_set():
+                raise JobCancelled(f"cancelled while waiting for {self.role}s")
+            messages = []
+            try:
+                messages.append(ack_listener.get(poll_interval))
+                # drain the backlog before checking timeouts, so no attempt
+                # is timed out for a message that is already queued
+                while True:
+                    messages.append(ack_listener.get(0))
+            except queue.Empty:
+                pass
+            for payload in messages:
+                tracker = next((tracker for tracker in trackers if payload[0] in tracker.attempts), self)
+                tracker.handle_message(payload)
+            for tracker in trackers:
+                tracker.check_timeouts()
+                tracker.check_stragglers()
+        if target < len(self.task_ids):
+            return
+
+        backups_won = sum(1 for task_id, task in self.completed.items() if task["attempt"] is not None and self.attempts[task_id][task["attempt"]]["backup"])
+        print(f"\n[MASTER] ACK received from all {len(self.task_ids)} {self.role}s ({self.backups_launched} backup attempts, {backups_won} won; {self.reexecutions} re-executions)")
+        logging.info(f"ACK received from all {len(self.task_ids)} {self.role}s ({self.backups_launched} backup attempts, {backups_won} won; {self.reexecutions} re-executions)")
@@ -0,0 +1,73 @@
+import atexit
+import os
+import subprocess
+import sys
+import logging
+
+from utils import local_backend
+
+# Sizing of the worker daemon pool (worker_mode "daemon"), separate from job
+# submission: daemons are started once and then serve every job through the
+# task dispatcher, so back-to-back jobs skip provisioning entirely.
+#
+# On GCE a daemon runs on a VM named <role><i> (mapper1, reducer2, ...),
+# provisioned concurrently by utils/provisioner.py;
+# locally it is a subprocess with the worker id <role>-daemon<i>.
+
+# role -> Popen handles of the local daemons, in worker id order
+local_daemons = {"mapper": [], "reducer": []}
+
+def stop_local_daemons():
+    for handles in local_daemons.values():
+        for handle in handles:
+            handle.terminate()
+            handle.wait()
+        handles.clear()
+
+atexit.register(stop_local_daemons)
+
+def scale_local_workers(config, role, count):
+    handles = local_daemons[role]
+    script_path = os.path.join(local_backend.SCRIPTS_DIR, f"{role}.py")
+    while len(handles) < count:
+        worker_id = f"{role}-daemon{len(handles) + 1}"
+        handles.append(subprocess.Popen([sys.executable, script_path, "--daemon", worker_id, config["local_config_path"]]))
+    while len(handles) > count:
+        handle = handles.pop()
+        handle.terminate()
+        handle.wait()
+    return [f"{role}-daemon{i}" for i in range(1, count + 1)]
+
+def scale_gce_workers(config, role, count):
+    # GCP modules are only needed when provisioning VMs
+    from googleapiclient import discovery
+    from utils.instance_utils import list_instances
+    from utils.provisioner import Provisioner, start_script
+    from utils.bundle import build_bundle
+
+    project = config["project_id"]
+    zone = config["zone"]
+    compute = discovery.build('compute', 'v1')
+    worker_names = [f"{role}{i}" for i in range(1, count + 1)]
+    existing_names = {instance_obj["name"] for instance_obj in list_instances(compute, project, zone) or []}
+
+    new_names = [name for name in worker_names if name not in existing_names]
+    if new_names:
+        Provisioner(compute, config).provision(new_names, start_script(build_bundle(config, role), f"{role}.py", "--daemon"))
+
+    extra_names = sorted(name for name in existing_names if name.startswith(role) and name[len(role):].isdigit() and int(name[len(role):]) > count)
+    for name in extra_names:
+        subprocess.Popen(["gcloud", "compute", "instances", "delete", name, f"--zone={zone}", "--delete-disks=all", "--quiet"])
+    return worker_names
+
+def scale_worker_pool(config, role, count):
+    # daemons read the dispatcher address from the published config (see
+    # master.resolve_hosts and master.publish_config); returns the ids of the
+    # role's daemons
+    if config["execution_backend"] == "gce":
+        worker_ids = scale_gce_workers(config, role, count)
+    else:
+        worker_ids = scale_local_workers(config, role, count)
+    print(f"[MASTER] {role} worker pool scaled to {count} daemons")
+    logging.info(f"{role} worker pool scaled to {count} daemons: {worker_ids}")
+    return worker_ids